@@ -0,0 +1,2 @@
+@ECHO OFF
+C:\Users\nhlo\AppData\Local\Programs\Python\Python312\python.exe C:\Users\nhlo\Documents\GitHub\PythonCompiler\simulator\cycles.py "%1"
\ No newline at end of file
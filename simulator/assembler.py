@@ -1,145 +1,218 @@
 #CREDIT OF MR GWILT
 
-from sys import argv
+from sys import argv, byteorder
 from os import path
-from re import sub, search
+from array import array
+import re
+from functools import lru_cache
+
+OPERAND_CACHE_SIZE = 4096 # Operands parsed once, generated code repeats the same registers and addresses
+SPARSE_GAP = 4 # Zero words in a row that are left out of a sparse image, shorter runs are cheaper to write than an @address
+
+OPCODES = {
+    'LDR' : 0,
+    'STR' : 1,
+    'ADD' : 2,
+    'SUB' : 3,
+    'ORR' : 9,
+    'AND' : 8,
+    'EOR' : 10,
+    'MOV' : 4,
+    'MVN' : 11,
+    'LSL' : 12,
+    'LSR' : 13,
+    'ASR' : 14,
+    'CMP' : 5,
+    'BAL' : 6,
+    'BEQ' : 7,
+    'BNE' : 7,
+    'BGT' : 7,
+    'BLT' : 7,
+    'HALT': 15,
+    'MUL': 16,
+    }
+
+'''Bit position of each operand of an instruction, the last operand sets bit 26 when it is a register'''
+FIELDS = {
+    'LDR' : (0, 3),
+    'STR' : (0, 3),
+    'MOV' : (0, 6),
+    'MVN' : (0, 6),
+    'CMP' : (3, 6),
+    'HALT' : (),
+    }
+FIELDS.update((opcode, (0, 3, 6)) for opcode in ('ADD', 'SUB', 'AND', 'ORR', 'LSL', 'LSR', 'EOR', 'ASR', 'MUL'))
+CONDITIONS = {'BAL' : 0, 'BEQ' : 0, 'BNE' : 3, 'BGT' : 1, 'BLT' : 2} # Condition code in bits 26:25 of a branch
+REGISTER_BITS = 3 # Registers are r0-r7
+VALUE_END = 26 # A number in the last operand runs from its position up to bit 25, below the register flag
+TARGET_BITS = 23 # Branch targets are bits 22:0
+WORD_BITS = 32
+
+LABEL_PATTERN = re.compile(r'\s*(\w+)\s*:')
+OPERAND_PATTERN = re.compile(r'([rR#]?)(?:0x([\dA-Fa-f]+)|(\d+))')
+
+class AssemblerError(Exception):
+    pass
 
 def decode(asm_line):
     if asm_line:
-        opcode,*operands = [x.strip() for x in asm_line.split()]
+        opcode,*operands = asm_line.replace(","," ").split()
         return opcode, operands
     else:
         return "NOP",[]
 
-
-def preprocessor(asmfile):
-    with open(asmfile,'r') as fp:
-        asm = sub(r';.*?\n',r'\n',fp.read()) # Strip comments
-        asm = sub(r'(\w+)\s*:\s*\n',r'\1:',asm) # Move bare labels onto line below
-        # asm = sub(r'\n\s*\n',r'\n',asm) # Strip bare lines
-        memory = [data.rstrip() for data in asm.splitlines()]
-
-    labels = {}
-
-    for address,data in enumerate(memory):
-        labelpat = r'\A\s*(\w+)\s*:'
-        if m := search(labelpat,data):
-            labels[m.group(1)] = address
-        memory[address] = sub(labelpat,'',memory[address])
-
-    memory = [data.replace(","," ") for data in memory]
-    memory = [data.strip() for data in memory]
-    memory = [sub(r'\b0x([\dA-Fa-f]+)\b',lambda x: str(int(x.group(1),16)),data) for data in memory]
-
-    for label,address in labels.items():
-        pat = f'\\b{label}\\b'
-        memory = [sub(pat,str(address),data) for data in memory]
-
-    return memory,labels
-
-def assembler(asmfile):
-
-    memory, labels = preprocessor(asmfile)
+@lru_cache(maxsize=OPERAND_CACHE_SIZE)
+def parse_number(operand): # Returns (value, is register) for a register, immediate or number, None for anything else
+    if m := OPERAND_PATTERN.fullmatch(operand):
+        prefix, hexadecimal, decimal = m.groups()
+        return (int(hexadecimal, 16) if hexadecimal else int(decimal)), prefix in ("r", "R")
+    return None
+
+def parse_operand(operand, labels): # Returns (value, is register) for a register, immediate, number or label
+    if (parsed := parse_number(operand)) is not None:
+        return parsed
+    if operand in labels:
+        return labels[operand], False
+    raise AssemblerError(f"invalid operand {operand}")
+
+def check_field(operand, value, register, width): # Raises AssemblerError if value does not fit in a field of width bits
+    if register and value >= 1 << REGISTER_BITS:
+        raise AssemblerError(f"register {operand} does not exist, there are {1 << REGISTER_BITS}")
+    if value >= 1 << width:
+        raise AssemblerError(f"{operand} does not fit in {width} bits")
+
+def preprocessor(lines):
+    '''
+    Pass one, tokenizes each line once. Returns the words of the program as (line number, opcode, operands) or None for an empty word,
+    the address of each label and the address each word of the source has once PRT lines are left out, which numbered branches are mapped through.
+    '''
+    program, labels, addresses = [], {}, []
+    pending = [] # Labels waiting for the next word, a label on a line of its own belongs to the line below
+    for number, line in enumerate(lines, 1):
+        line = line.split(";", 1)[0] # Strip comments
+        labelled = False
+        while m := LABEL_PATTERN.match(line):
+            pending.append(m.group(1))
+            line = line[m.end():]
+            labelled = True
+        opcode, operands = decode(line.strip())
+        if opcode == "NOP" and pending and (labelled or not line.strip()): # Bare label, or a blank line after one
+            continue
+        for label in pending:
+            labels[label] = len(program)
+        pending.clear()
+        addresses.append(len(program))
+        if opcode == "PRT": # Output is only simulated, there is no word for it in memory
+            continue
+        program.append(None if opcode == "NOP" else (number, opcode, operands))
+    for label in pending: # Labels at the end of the file
+        labels[label] = len(program)
+    return program, labels, addresses
+
+def assembler(lines):
+    '''Pass two, encodes each word of the program. lines is any iterable of source lines, such as an open file'''
+    program, labels, addresses = preprocessor(lines)
     machine_code = []
-    opcodes = {
-        'LDR' : 0,
-        'STR' : 1,
-        'ADD' : 2,
-        'SUB' : 3,
-        'ORR' : 9,
-        'AND' : 8,
-        'EOR' : 10,
-        'MOV' : 4,
-        'MVN' : 11,
-        'LSL' : 12,
-        'LSR' : 13,
-        'ASR' : 14,
-        'CMP' : 5,
-        'BAL' : 6,
-        'BEQ' : 7,
-        'BNE' : 7,
-        'BGT' : 7,
-        'BLT' : 7,
-        'HALT': 15,
-        'MUL': 16,
-        }
-
-    for asm_line in memory:
-        if not asm_line.replace(" ", ""):
+    for word in program:
+        if word is None:
             machine_code.append(0)
             continue
-        if "PRT" in asm_line:
-            continue
+        number, opcode, operands = word
         try:
-            opcode, operands = decode(asm_line)
-            inst = opcodes[opcode] << 27
-            imm = 1 if operands and operands[-1].lower().startswith("r") else 0
-            match opcode:
-                case "CMP" :
-                    inst |= (imm << 26)
-                    inst |= (int(operands[0].lower().replace("r","").replace("#","")) << 3)
-                    inst |= (int(operands[1].lower().replace("r","").replace("#","")) << 6)
-                case "MOV" | "MVN" :
-                    inst |= (imm << 26)
-                    inst |= (int(operands[0].lower().replace("r","").replace("#","")))
-                    inst |= (int(operands[1].lower().replace("r","").replace("#","")) << 6)
-                case "BAL" | "BEQ" :
-                    inst |= int(operands[0])
-                case "BNE" :
-                    inst |= (3 << 25)
-                    inst |= int(operands[0])
-                case "BGT" :
-                    inst |= (1 << 25)
-                    inst |= int(operands[0])
-                case "BLT" :
-                    inst |= (2 << 25)
-                    inst |= int(operands[0])
-                case "LDR" | "STR" :
-                    inst |= (imm << 26)
-                    inst |= (int(operands[0].lower().replace("r","").replace("#","")))
-                    inst |= int(operands[1].lower().replace("r", "").replace("#", "")) << 3
-                case "ADD" | "SUB" | "AND" | "ORR" | "LSL" | "LSR" | "EOR" | "ASR" | "MUL" :
-                    inst |= (imm << 26)
-                    inst |= (int(operands[0].lower().replace("r","").replace("#","")))
-                    inst |= (int(operands[1].lower().replace("r","").replace("#","")) << 3)
-                    inst |= (int(operands[2].lower().replace("r","").replace("#","")) << 6)
-                case "HALT" :
-                    pass
-            
-            machine_code.append(inst)
-        except SyntaxError as e:
-            print(f"Syntax Error: {asm_line}",e)
-            break
-
+            if opcode not in OPCODES:
+                raise AssemblerError(f"unknown instruction {opcode}")
+            inst = OPCODES[opcode] << 27
+            if opcode in CONDITIONS:
+                if len(operands) != 1:
+                    raise AssemblerError(f"{opcode} takes 1 operand")
+                target = operands[0]
+                if target in labels:
+                    target = labels[target]
+                else:
+                    target, _ = parse_operand(target, labels)
+                    target = addresses[target] if target < len(addresses) else target - len(addresses) + len(program)
+                check_field(operands[0], target, False, TARGET_BITS)
+                inst |= (CONDITIONS[opcode] << 25) | target
+            else:
+                fields = FIELDS[opcode]
+                if len(operands) != len(fields):
+                    raise AssemblerError(f"{opcode} takes {len(fields)} operands")
+                register = False
+                for operand, shift, end in zip(operands, fields, fields[1:] + (VALUE_END,)):
+                    value, register = parse_operand(operand, labels)
+                    if not register and end != VALUE_END:
+                        raise AssemblerError(f"{operand} is not a register, only the last operand can be a number")
+                    check_field(operand, value, register, end - shift) # Only the last operand can be wider than a register
+                    inst |= value << shift
+                inst |= register << 26 # Set by the last operand
+        except AssemblerError as e:
+            raise AssemblerError(f"Syntax Error occurred on line {number}: {e}") from None
+        machine_code.append(inst)
     return machine_code
 
+def write_memory_image(machine_code, f): # Every word in hex, as read by $readmemh
+    f.write("".join("0 " if instruction == 0 else f"{instruction:08X} " for instruction in machine_code))
+
+def write_sparse_memory_image(machine_code, f): # Only the populated words, each section starts with the @address $readmemh loads it at
+    written = False
+    zeros = 0 # Zero words since the last populated word
+    for address, instruction in enumerate(machine_code):
+        if instruction == 0:
+            zeros += 1
+            continue
+        if not written or zeros >= SPARSE_GAP:
+            f.write(f"\n@{address:X}\n" if written else f"@{address:X}\n")
+        else:
+            f.write("0 " * zeros)
+        f.write(f"{instruction:08X} ")
+        written, zeros = True, 0
+
+def write_binary_image(machine_code, f): # Raw little endian 32 bit words, loaded without parsing
+    for address, instruction in enumerate(machine_code):
+        if not 0 <= instruction < 1 << WORD_BITS:
+            raise AssemblerError(f"Word {instruction} at address {address} does not fit in {WORD_BITS} bits")
+    words = array("I", machine_code)
+    if byteorder == "big":
+        words.byteswap()
+    words.tofile(f)
+
 def run():
 
     if "--version" in argv:
         print(f"\033[36;1mpasm v0.15\033[0m")
         quit()
 
-    usage = f'\033[91;1mUsage: {argv[0]} <asm>\033[0m'
+    usage = f'\033[91;1mUsage: {argv[0]} <asm> [--sparse | --binary]\033[0m'
 
-    if len(argv) != 2:
+    args = [arg for arg in argv[1:] if arg not in ("--sparse", "--binary")]
+
+    if len(args) != 1:
         print(usage)
         quit()
 
-    asmfile = argv[1]
+    asmfile = args[0]
 
     if not(path.exists(asmfile) and path.isfile(asmfile)):
         print(usage)
         quit()
 
-    machine_code = assembler(asmfile)
+    try:
+        with open(asmfile, "r") as f:
+            machine_code = assembler(f)
+    except AssemblerError as e:
+        print(f"\033[91;1m{e}\033[0m")
+        quit()
 
-    with open("memory.txt","w") as f:
-        for instruction in machine_code:
-            if instruction == 0:
-                f.write("0 ")
-            else:
-                f.write(f"{instruction:08X} ")
-    
-    print(f"\033[92;1mAssembly code assembled successfully into memory.txt\033[0m")
+    if "--binary" in argv:
+        memfile = "memory.bin"
+        with open(memfile, "wb") as f:
+            write_binary_image(machine_code, f)
+    else:
+        memfile = "memory.txt"
+        with open(memfile, "w") as f:
+            (write_sparse_memory_image if "--sparse" in argv else write_memory_image)(machine_code, f)
+
+    print(f"\033[92;1mAssembly code assembled successfully into {memfile}\033[0m")
 
-run()
+if __name__ in "__main__":
+    run()
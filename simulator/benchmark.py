@@ -0,0 +1,128 @@
+import json
+from sys import argv, version
+from os import path, listdir
+from io import StringIO
+from time import perf_counter
+from contextlib import redirect_stdout
+from compiler import Compiler
+from pipeline import compile_source, assemble, execute
+from assembler import AssemblerError
+from executer import count_instructions
+from emulator import EmulationError, emulate
+from cycles import simulate_cycles
+
+BENCHMARK_DIRECTORY = path.join(path.dirname(path.dirname(path.abspath(__file__))), "benchmarks")
+BASELINE_FILE = path.join(BENCHMARK_DIRECTORY, "baseline.json")
+RESULTS_FILE = "benchmark.json"
+REPEATS = 3 # Each time is the best of this many runs
+TOLERANCE = 0.25 # Fraction a time can grow by before it is a regression, counts regress on any increase
+MIN_SLOWDOWN = 0.002 # Seconds a time must grow by to be a regression, shorter times are mostly noise
+MAX_EMULATED_STEPS = 10 ** 8
+COUNTS = ("instructions", "words", "executed", "cycles") # Emitted assembly lines, machine code words, instructions executed by executer.py and clock cycles on the processor
+TIMES = ("compile", "assemble", "executer", "translator", "emulator")
+
+def best_time(function, repeats): # Returns the shortest time function took and what it returned
+    best = None
+    for _ in range(repeats):
+        stime = perf_counter()
+        result = function()
+        seconds = perf_counter() - stime
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+def measure(source, optimise=False, repeats=REPEATS):
+    '''
+    Returns the counts and the seconds of each stage for one program, None for the stages it could not go through.
+    The emulator only runs programs that assemble, and only the executer counts instructions as it has every opcode.
+    Cycles come from the pipeline model in cycles.py, so they are only known for programs that assemble.
+    '''
+    seconds = dict.fromkeys(TIMES)
+    result = dict.fromkeys(COUNTS)
+    seconds["compile"], (assembly, errors) = best_time(lambda: compile_source(source, optimise), repeats)
+    result["instructions"] = len(assembly)
+    if errors:
+        return dict(result, seconds=seconds, errors=errors)
+    try:
+        seconds["assemble"], machine_code = best_time(lambda: assemble(assembly), repeats)
+        result["words"] = len(machine_code)
+    except AssemblerError:
+        machine_code = None
+    seconds["executer"], (output, _) = best_time(lambda: execute(assembly), repeats)
+    seconds["translator"], _ = best_time(lambda: execute(assembly, translate=True), repeats)
+    memory = assembly + [""] * (Compiler.ARRAY_RANGE[1] + 1 - len(assembly))
+    with redirect_stdout(StringIO()):
+        result["executed"] = count_instructions(memory)
+    if machine_code is not None:
+        try:
+            seconds["emulator"], _ = best_time(lambda: emulate(machine_code, MAX_EMULATED_STEPS), repeats)
+            result["cycles"] = simulate_cycles(machine_code, MAX_EMULATED_STEPS)[0]
+        except EmulationError: # Runs differently on the processor, eg. comparisons are unsigned
+            pass
+    return dict(result, seconds=seconds, output=output)
+
+def run_benchmarks(source_files, repeats=REPEATS): # Results keyed by program name, with " -O" for the optimised build
+    results = {}
+    for source_file in source_files:
+        with open(source_file, "r") as f:
+            source = f.read()
+        name = path.splitext(path.basename(source_file))[0]
+        for optimise in (False, True):
+            results[name + (" -O" if optimise else "")] = measure(source, optimise, repeats)
+    return results
+
+def find_regressions(results, baseline, tolerance=TOLERANCE): # Returns (benchmark, measurement, baseline value, new value) for everything that got worse
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        for count in COUNTS:
+            if None not in (result[count], old.get(count)) and result[count] > old[count]:
+                regressions.append((name, count, old[count], result[count]))
+        for stage in TIMES:
+            new_time, old_time = result["seconds"][stage], old["seconds"].get(stage)
+            if None not in (new_time, old_time) and new_time - old_time > max(old_time * tolerance, MIN_SLOWDOWN):
+                regressions.append((name, f"{stage} seconds", old_time, new_time))
+        if result.get("output") != old.get("output"): # Wrong answers are a regression too
+            regressions.append((name, "output", old.get("output"), result.get("output")))
+    return regressions
+
+def report(results): # Table of the results, times in milliseconds
+    print(f"\033[36;1m{'benchmark':20}{'lines':>8}{'words':>8}{'executed':>12}{'cycles':>12}" + "".join(f"{stage:>12}" for stage in TIMES) + "\033[0m")
+    for name, result in results.items():
+        counts = "".join(f"{'-' if result[count] is None else result[count]:>{width}}" for count, width in zip(COUNTS, (8, 8, 12, 12)))
+        times = "".join(f"{'-' if result['seconds'][stage] is None else round(result['seconds'][stage] * 1000, 3):>12}" for stage in TIMES)
+        print(f"{name:20}{counts}{times}")
+
+if __name__ in "__main__":
+    options = dict(arg[2:].split("=", 1) for arg in argv[1:] if arg.startswith("--") and "=" in arg) # Options can go anywhere
+    files = [arg for arg in argv[1:] if not arg.startswith("--")]
+    if "--version" in argv: # Version argument
+        print(f"\033[36;1mpbench v0.15\033[0m")
+    elif "--help" in argv: # Help argument
+        print("\033[91;1mpbench syntax: pbench [<code files>] [--repeat=<count>] [--output=<file>] [--baseline=<file>] [--tolerance=<fraction>] [--update-baseline]\033[0m")
+    else:
+        files = files or sorted(path.join(BENCHMARK_DIRECTORY, name) for name in listdir(BENCHMARK_DIRECTORY) if name.endswith(".txt"))
+        baseline_file = options.get("baseline", BASELINE_FILE)
+        try:
+            results = run_benchmarks(files, int(options.get("repeat", REPEATS)))
+        except FileNotFoundError as err: # Code file not found
+            print(f"\033[91;1m{err}\033[0m")
+            quit()
+        report(results)
+        document = {"python": version.split()[0], "results": results}
+        with open(options.get("output", RESULTS_FILE), "w") as f:
+            json.dump(document, f, indent=1)
+        if "--update-baseline" in argv:
+            with open(baseline_file, "w") as f:
+                json.dump(document, f, indent=1)
+            print(f"\033[92;1mBaseline written to {baseline_file}\033[0m")
+        elif path.isfile(baseline_file):
+            with open(baseline_file, "r") as f:
+                baseline = json.load(f)["results"]
+            regressions = find_regressions(results, baseline, float(options.get("tolerance", TOLERANCE)))
+            for name, measurement, old, new in regressions:
+                print(f"\033[91;1mREGRESSION {name}: {measurement} {old} -> {new}\033[0m")
+            if regressions:
+                exit(1)
+            print(f"\033[92;1mNo regressions against {baseline_file}\033[0m")
@@ -0,0 +1,155 @@
+from instructions import Instruction, Label
+from peephole import Program, BRANCHES, is_immediate, is_register
+
+INVERSE = {"BEQ": "BNE", "BNE": "BEQ"} # Branch taken exactly when the other is not
+BOUNDED = {"BGT": ("BLT", 1), "BLT": ("BGT", -1)} # x > k is not x < k + 1 and x < k is not x > k - 1, for integers only
+IMMEDIATE_LIMIT = 1 << 20 # Immediate values the processor can encode
+FLOAT_OPCODES = ("DIV", "EXP") # Instructions that can leave a float in a register
+
+def remove(program, ln): # Remove the instruction at ln, keeping the analysis right so later changes can still use it
+    program.remove(ln)
+    position = ln
+    while position >= 0 and program.next_real[position] == ln:
+        program.next_real[position] = program.next_real[ln+1]
+        position -= 1
+
+def rotate_loop(program, ln): # Move the test of the while loop whose backward BAL is at ln to the bottom of the loop
+    '''
+    A while loop is compiled as
+        header: test, Bcc body, BAL exit, body: ..., BAL header
+    which runs two taken branches an iteration. The test is moved in place of the backward BAL
+        header: BAL test, body: ..., test: test, Bcc body, BAL exit
+    so an iteration only takes the Bcc, and BAL exit is removed when it goes to the next instruction.
+    Returns True if the loop had that shape.
+    '''
+    code = program.code
+    header = program.landing(code[ln])
+    if header >= ln:
+        return False
+    test = header
+    while code[test].opcode not in BRANCHES + ("HALT",) and test != program.end:
+        test = program.following(test)
+        if test in program.targets: # The test must only be entered at the header
+            return False
+    leave = program.following(test)
+    if code[test].opcode not in BRANCHES or code[test].opcode == "BAL" or code[leave].opcode != "BAL" or leave in program.targets:
+        return False
+    body = program.landing(code[test])
+    if body != program.following(leave) or not leave < body <= ln:
+        return False
+    first = code[header]
+    if first.opcode in ("LDR", "STR") and is_register(first.operands[1]): # Takes its address from the instruction before it on the processor
+        return False
+
+    length = ln - leave - 1 # Instructions in the body
+    labels = {id(instruction.target): instruction.target for instruction in program.branches if instruction.target is not None}
+
+    def relocate(position): # Where an instruction ends up, the backward BAL's place is taken by the test
+        if header < position <= leave:
+            return position + length + 1
+        if leave < position < ln:
+            return position - (leave - header)
+        if position == ln:
+            return header + length + 1
+        return position
+
+    for label in labels.values():
+        if label.position is not None:
+            label.position = relocate(label.position)
+    program.replace(header, ln, [Instruction("BAL", target=Label(header + length + 1), line=first.line)] + code[leave+1:ln] + code[header:leave+1])
+    return True
+
+def invert_condition(program, ln, integers): # Bcc L, BAL M, L: -> B(not cc) M, returns True if it was changed
+    '''
+    The processor only has BEQ, BNE, BGT and BLT, so BGT and BLT are only inverted after a CMP with an immediate value,
+    which is moved by one, and only when integers is True as it does not hold for floats.
+    '''
+    code = program.code
+    branch = code[ln]
+    leave = program.following(ln)
+    if branch.opcode not in INVERSE and branch.opcode not in BOUNDED or code[leave].opcode != "BAL" or leave in program.targets:
+        return False
+    if program.landing(branch) != program.following(leave):
+        return False
+    if branch.opcode in INVERSE:
+        branch.opcode = INVERSE[branch.opcode]
+    else:
+        compare = program.preceding(ln)
+        if not integers or compare is None or ln in program.targets or code[compare].opcode != "CMP":
+            return False
+        lhs, rhs = code[compare].operands
+        if not is_register(lhs) or not is_immediate(rhs):
+            return False
+        opcode, step = BOUNDED[branch.opcode]
+        value = int(rhs[1:]) + step
+        if not 0 <= value < IMMEDIATE_LIMIT:
+            return False
+        code[compare].operands = (lhs, f"#{value}")
+        branch.opcode = opcode
+    branch.target = code[leave].target
+    program.targets.add(program.landing(branch))
+    remove(program, leave)
+    return True
+
+def thread_jump(program, ln): # Branch to a BAL -> branch to where the chain of BALs ends, BAL to the end of the program -> HALT
+    code = program.code
+    instruction = code[ln]
+    seen = {ln}
+    landing = program.landing(instruction)
+    target = instruction.target
+    while code[landing].opcode == "BAL" and landing != program.end and landing not in seen:
+        seen.add(landing)
+        target = code[landing].target
+        landing = program.landing(code[landing])
+    if instruction.opcode == "BAL" and landing == program.end:
+        instruction.opcode, instruction.target = "HALT", None
+        return True
+    if target is instruction.target:
+        return False
+    instruction.target = target
+    program.targets.add(landing)
+    return True
+
+def remove_unreachable(program): # Remove instructions no path from the start of the program reaches, returns True if any were removed
+    reached, stack = set(), [program.next_real[0]]
+    while stack:
+        ln = stack.pop()
+        if ln in reached:
+            continue
+        reached.add(ln)
+        stack.extend(program.successors(ln))
+    unreachable = [ln for ln in program.positions if ln not in reached and program.code[ln].opcode != "PASS"]
+    for ln in unreachable:
+        remove(program, ln)
+    return bool(unreachable)
+
+def optimise_branches(assembly_code): # Returns the number of branches removed
+    '''
+    Lays out the code so that fewer branches are taken, as each taken branch flushes the processor's pipeline:
+    while loops are rotated to test at the bottom, a conditional branch over a BAL is inverted to take its place,
+    branches to BALs go straight to where they end up, and code that can never run is removed.
+    assembly_code is the compiler's instruction list, changed the same way as by the peephole optimiser.
+    '''
+    if not assembly_code:
+        return 0
+    before = sum(instruction.opcode in BRANCHES for instruction in assembly_code)
+    integers = not any(instruction.opcode in FLOAT_OPCODES for instruction in assembly_code)
+    program = Program(assembly_code, liveness=False)
+    for idx in range(len(program.positions) - 1, -1, -1): # Rotating keeps the analysis up to date, so the loops inside one are found where they moved to
+        if assembly_code[program.positions[idx]].opcode == "BAL":
+            rotate_loop(program, program.positions[idx])
+    changed = True
+    while changed: # The other changes keep the analysis up to date, so one pass makes as many as it can
+        program = Program(assembly_code, liveness=False)
+        changed = False
+        for ln in program.positions:
+            instruction = assembly_code[ln]
+            if instruction.opcode not in BRANCHES:
+                continue
+            if invert_condition(program, ln, integers) or thread_jump(program, ln):
+                changed = True
+            elif program.landing(instruction) == program.following(ln): # Branch to the next instruction
+                remove(program, ln)
+                changed = True
+        changed = remove_unreachable(program) or changed
+    return before - sum(instruction.opcode in BRANCHES for instruction in assembly_code)
@@ -0,0 +1,201 @@
+import re
+
+INDENT_SIZE = 4
+INDENT, DEDENT, LINE = range(3) # Kinds of token made from the source
+
+'''Statements, line is the index of the source line the statement starts on'''
+
+class If:
+    __slots__ = ("branches", "orelse", "line")
+
+    def __init__(self, branches, orelse, line):
+        self.branches = branches # (condition, body) for the if and each elif
+        self.orelse = orelse # Body of the else statement, None if there is no else
+        self.line = line
+
+class While:
+    __slots__ = ("condition", "body", "line")
+
+    def __init__(self, condition, body, line):
+        self.condition = condition
+        self.body = body
+        self.line = line
+
+class For:
+    __slots__ = ("initialisation", "condition", "increment", "body", "line")
+
+    def __init__(self, initialisation, condition, increment, body, line):
+        self.initialisation = initialisation # Statement run before the loop
+        self.condition = condition
+        self.increment = increment # Statement run at the end of each iteration
+        self.body = body
+        self.line = line
+
+class Break:
+    __slots__ = ("line",)
+
+    def __init__(self, line):
+        self.line = line
+
+class Pass:
+    __slots__ = ("line",)
+
+    def __init__(self, line):
+        self.line = line
+
+class ArrayDeclaration:
+    __slots__ = ("name", "size", "line")
+
+    def __init__(self, name, size, line):
+        self.name = name
+        self.size = size
+        self.line = line
+
+class ArrayAssignment:
+    __slots__ = ("name", "index", "expression", "line")
+
+    def __init__(self, name, index, expression, line):
+        self.name = name
+        self.index = index
+        self.expression = expression
+        self.line = line
+
+class Assignment:
+    __slots__ = ("variable", "expression", "line")
+
+    def __init__(self, variable, expression, line):
+        self.variable = variable
+        self.expression = expression
+        self.line = line
+
+class Print:
+    __slots__ = ("argument", "line")
+
+    def __init__(self, argument, line):
+        self.argument = argument
+        self.line = line
+
+def tokenize(code): # Returns (kind, line number, line without spaces) tokens and the indentation errors found
+    '''Blank lines are skipped, an INDENT comes before the first line of each deeper block and a DEDENT after its last line.'''
+    tokens, errors = [], []
+    levels = [0] # Indentation of the blocks that are open
+    for number, line in enumerate(code):
+        if not line.strip():
+            continue
+        indent = len(line) - len(line.lstrip(" "))
+        if indent % INDENT_SIZE or indent < levels[-1] and indent not in levels:
+            errors.append(SyntaxError(f"INDENT ERROR occurred on line {number+1}"))
+            continue
+        if indent > levels[-1]:
+            levels.append(indent)
+            tokens.append((INDENT, number, None))
+        while indent < levels[-1]:
+            levels.pop()
+            tokens.append((DEDENT, number, None))
+        tokens.append((LINE, number, line.replace(" ", "")))
+    tokens.extend((DEDENT, len(code), None) for _ in levels[1:])
+    return tokens, errors
+
+def parse_simple_statement(line, number): # Statement that does not start a block, None if line is not one
+    if line == "break": # Break statement
+        return Break(number)
+    if line == "END": # Pass statement
+        return Pass(number)
+    if match := re.fullmatch(r"(.*)=array\((.*)\)", line): # Array declaration
+        return ArrayDeclaration(match.group(1), match.group(2), number)
+    if match := re.fullmatch(r"(.+?)([-+*/^%\\])=(.+)", line): # Fast operators, x += y is x = x + (y)
+        target, operator, operand = match.groups()
+        line = f"{target}={target}{operator}({operand})"
+    elif match := re.fullmatch(r"(.+)(\+\+|--)", line): # Increment and decrement operators
+        target, operator = match.groups()
+        line = f"{target}={target}{operator[0]}1"
+    if match := re.fullmatch(r"([^\[\]=]+)\[(.*)\]=([^=].*)", line): # Assignment to an array
+        return ArrayAssignment(*match.groups(), number)
+    if match := re.fullmatch(r"([^=]+)=([^=].*)", line): # Assignment
+        return Assignment(*match.groups(), number)
+    if match := re.fullmatch(r"print\((.*)\)", line): # Print statement
+        return Print(match.group(1), number)
+    return None
+
+class Parser: # Recursive descent parser over the tokens of a program
+
+    def __init__(self, code):
+        self.tokens, self.errors = tokenize(code)
+        self.position = 0
+
+    def __peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (DEDENT, None, None)
+
+    def __error(self, number):
+        self.errors.append(SyntaxError(f"Syntax Error occurred on line {number+1}"))
+
+    def parse_block(self): # Statements up to the end of the current block
+        statements = []
+        while (token := self.__peek())[0] != DEDENT:
+            self.position += 1
+            if token[0] == INDENT: # Indented lines that do not belong to a statement
+                self.__error(token[1])
+                self.parse_block()
+                self.position += 1
+            elif (statement := self.__parse_statement(*token[1:])) is not None:
+                statements.append(statement)
+        return statements
+
+    def __parse_body(self): # Block indented under the line just parsed, which may be empty
+        if self.__peek()[0] != INDENT:
+            return []
+        self.position += 1
+        body = self.parse_block()
+        self.position += 1 # DEDENT
+        return body
+
+    def __parse_statement(self, number, line):
+        if match := re.fullmatch(r"(if|while)(.*):", line): # If statement or while loop
+            keyword, condition = match.groups()
+            body = self.__parse_body()
+            if keyword == "while":
+                return While(condition, body, number)
+            branches, orelse = [(condition, body)], None
+            while (token := self.__peek())[0] == LINE and orelse is None:
+                if match := re.fullmatch(r"elif(.*):", token[2]): # Elif statement
+                    self.position += 1
+                    branches.append((match.group(1), self.__parse_body()))
+                elif token[2] == "else:": # Else statement
+                    self.position += 1
+                    orelse = self.__parse_body()
+                else:
+                    break
+            return If(branches, orelse, number)
+
+        if match := re.fullmatch(r"for\((.*),(.*),(.*)\):", line): # For loop
+            initialisation, condition, increment = match.groups()
+            body = self.__parse_body()
+            initialisation, increment = parse_simple_statement(initialisation, number), parse_simple_statement(increment, number)
+            if initialisation is None or increment is None:
+                self.__error(number)
+                return None
+            return For(initialisation, condition, increment, body, number)
+
+        if (statement := parse_simple_statement(line, number)) is None:
+            self.__error(number)
+            self.__parse_body() # Skip anything indented under it
+        return statement
+
+def parse(code): # Returns the statements of the program and the syntax errors found in it
+    parser = Parser(code)
+    statements = parser.parse_block()
+    return statements, parser.errors
+
+def walk(statements): # Every statement in statements and in the blocks inside them
+    for statement in statements:
+        yield statement
+        match statement:
+            case If():
+                for _, body in statement.branches:
+                    yield from walk(body)
+                if statement.orelse is not None:
+                    yield from walk(statement.orelse)
+            case While():
+                yield from walk(statement.body)
+            case For():
+                yield from walk([statement.initialisation, statement.increment] + statement.body)
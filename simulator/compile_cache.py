@@ -0,0 +1,70 @@
+import marshal
+from os import makedirs, path, listdir, remove, replace, stat, utime
+from hashlib import sha256
+
+CACHE_VERSION = "4" # Change when the code generated for a block changes
+CACHE_DIRECTORY = path.join(path.dirname(path.abspath(__file__)), "__pycache__")
+CACHE_SIZE = 16 * 1024 * 1024 # Bytes of compiled blocks kept on disk before the least recently used are removed
+PREFIX = "block-"
+
+class BlockCache: # Content addressed store of compiled top level blocks, kept in memory and on disk
+
+    def __init__(self, directory=CACHE_DIRECTORY, max_size=CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.entries = {} # key: block hash, value: cached entry, blocks used in this run
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(*parts): # Hash of the block source and everything else the generated code depends on
+        return sha256("\n".join((CACHE_VERSION,) + tuple(map(str, parts))).encode()).hexdigest()
+
+    def __file(self, key):
+        return path.join(self.directory, f"{PREFIX}{key}.bin")
+
+    def get(self, key): # Cached entry for key or None
+        if key in self.entries:
+            self.hits += 1
+            return self.entries[key]
+        entry = None
+        if path.isfile(cache_file := self.__file(key)):
+            try:
+                with open(cache_file, "rb") as f:
+                    entry = marshal.load(f)
+                utime(cache_file) # Mark as recently used
+            except (OSError, EOFError, ValueError, TypeError): # Corrupt or removed cache entry, compile again
+                entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries[key] = entry
+        return entry
+
+    def put(self, key, entry): # entry must only contain types marshal can write
+        self.entries[key] = entry
+        makedirs(self.directory, exist_ok=True)
+        with open(self.__file(key) + ".tmp", "wb") as f:
+            marshal.dump(entry, f)
+        replace(self.__file(key) + ".tmp", self.__file(key)) # Readers never see a partly written file
+
+    def trim(self): # Remove the least recently used blocks until the cache fits in max_size bytes
+        try:
+            files = [path.join(self.directory, name) for name in listdir(self.directory) if name.startswith(PREFIX) and name.endswith(".bin")]
+        except FileNotFoundError:
+            return
+        stats = []
+        for cache_file in files:
+            try:
+                stats.append((stat(cache_file), cache_file))
+            except FileNotFoundError: # Removed by another compile
+                pass
+        size = sum(st.st_size for st, _ in stats)
+        for st, cache_file in sorted(stats, key=lambda item: item[0].st_mtime):
+            if size <= self.max_size:
+                break
+            try:
+                remove(cache_file)
+            except FileNotFoundError:
+                pass
+            size -= st.st_size
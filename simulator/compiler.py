@@ -1,138 +1,238 @@
 import re
+import json
 from sys import argv
-from convert_expressions import OPERATIONS, convert_expression, is_number, is_value, is_variable
+from os import path
+from code_parser import INDENT_SIZE, If, While, For, Break, Pass, ArrayDeclaration, ArrayAssignment, Assignment, Print, parse, walk
+from convert_expressions import Operator, convert_to_rpn, is_number, is_value, is_variable
+from compile_cache import BlockCache
+from instructions import Label, Instruction
+from loops import optimise_loops
+from peephole import optimise as peephole_optimise
+from branches import optimise_branches
+from memory_planner import NAME_PATTERN, MemoryPlan, plan_memory, print_memory_map, write_memory_map
 
 VERSION = "v0.15"
 
 class CompliationError(Exception):
     pass
 
+class RegisterPressureError(CompliationError): # Raised when a statement needs more temporary registers than are free
+    pass
+
 class Compiler:
 
-    INDENT_SIZE = 4
+    INDENT_SIZE = INDENT_SIZE
     VARIABLE_RANGE = (1024, 1087)
-    ARRAY_RANGE = (1088, 3135)
-
-    def __init__(self):
-        self.__variables = {} # key: variable name, value: address
+    ARRAY_RANGE = (1088, 3135) # The memory planner packs variables and arrays anywhere from VARIABLE_RANGE[0] to ARRAY_RANGE[1]
+    MIN_TEMPORARY_REGISTERS = 2 # Registers always left for evaluating expressions when variables are kept in registers
+    WRITES_FIRST_OPERAND = ("LDR", "MOV", "ADD", "SUB", "MUL", "DIV", "EXP", "MOD", "FDV", "LSL", "LSR", "AND") # Opcodes whose first operand is the destination register
+    MAX_POWER_CHAIN = 8 # Longest chain of MULs used in place of raising to a constant power
+    UNROLL_FACTOR = 4 # Copies of the body in each iteration of an unrolled for loop
+
+    def __init__(self, register_allocation=True, optimise=False, unroll_factor=UNROLL_FACTOR, cache=None):
+        self.register_allocation = register_allocation
+        self.cache = cache # BlockCache that compiled top level blocks are reused from, None compiles everything
+        self.optimise = optimise # Run the peephole optimiser over the generated code
+        self.unroll_factor = unroll_factor # Unroll factor used with optimise, halved until the code fits below VARIABLE_RANGE
+        self.loops_unrolled = 0 # Number of for loops unrolled in the last compile
+        self.instructions_removed = 0 # Number of instructions the peephole optimiser removed in the last compile
+        self.instructions_hoisted = 0 # Number of loop invariant instructions moved out of loops in the last compile
+        self.branches_removed = 0 # Number of branches the branch layout pass removed in the last compile
+        self.induction_variables_rebased = 0 # Number of loop counters rebased onto the addresses calculated from them in the last compile
+        self.source_map = [] # Source line, counting from 1, that each line of the last compiled assembly came from
+        self.memory_plan = None # MemoryPlan with the addresses of the variables and arrays in the last compiled program
+        self.variable_registers = {} # key: variable name, value: register it was kept in in the last compiled program
+        self.__float_variables = set() # Variables and arrays that may hold the result of a division, these are never strength reduced
+        self.__signed_variables = set() # Variables and arrays that may hold a negative value, which LSR does not floor divide on the processor
+        self.__unroll_factor = 1 # Unroll factor of the current compile
+        self.__errors = [] # Syntax errors found while parsing the last program
+        self.__reset()
+
+    def __reset(self, allocation=None, plan=None): # Clear all state from a previous compile, allocation maps variables to the registers they are kept in
+        self.__variables = {} # key: variable name, value: address, None for variables kept in registers
         self.__arrays = {} # key: array name, value: (address, size of array)
         self.__registers = {"r0": False, "r1": False, "r2": False, "r3": False, "r4": False, "r5": False, "r6": False, "r7": False}
+        self.__allocation = allocation or {} # key: variable name, value: register
+        self.__plan = plan or MemoryPlan(self.VARIABLE_RANGE[0]) # Addresses the variables and arrays are given
+        self.__next_address = self.__plan.end # Address for anything the plan does not cover
+        self.loops_unrolled = 0
+        for reg in self.__allocation.values():
+            self.__registers[reg] = True # Registers holding variables are never used as temporaries
   
-    def __next_variable_address(self):
-        return max(list(self.__variables.values())) + 1 if self.__variables else self.VARIABLE_RANGE[0]
-
-    def __next_array_address(self):
-        if not self.__arrays:
-            return self.ARRAY_RANGE[0]
-        name, max_address = max(list(self.__arrays.values()), key= lambda x: x[0])
-        return self.__arrays[name][1] + max_address + 1
+    def __variable_address(self, var):
+        if var in self.__plan.variables:
+            return self.__plan.variables[var]
+        self.__next_address += 1
+        return self.__next_address - 1
+
+    def __array_address(self, name, size, line):
+        if (name, line) in self.__plan.arrays:
+            return self.__plan.arrays[name, line][0]
+        self.__next_address += int(size)
+        return self.__next_address - int(size)
     
     def __next_available_register(self):
         for k, v in self.__registers.items():
             if not v:
                 return k
+        raise RegisterPressureError("Not enough registers to evaluate expression")
             
     def __block_register(self, reg):
         self.__registers[reg] = True
     
     def __free_register(self, reg):
-        self.__registers[reg] = False
-
-    def __num_indents(self, code, ln):
-        for idx, char in enumerate(code[ln]):
-            if char != " ":
-                if idx % self.INDENT_SIZE != 0:
-                    raise SyntaxError(f"INDENT ERROR occurred on line {ln}")
-                return idx // self.INDENT_SIZE
-
-    def __find_end_of_if_statement(self, code, start_line, indents):
-        for ln in range(start_line, len(code)):
-            if self.__num_indents(code, ln) <= indents and not re.match(r" *else:", code[ln]) and not re.match(r" *elif.*:", code[ln]):
-                return ln
-
-    def __find_end_of_curr_if_block(self, code, start_line, indents):
-        for ln in range(start_line, len(code)):
-            if self.__num_indents(code, ln) == indents:
-                return ln
-
-    def find_else_block(self, code, start_line, indents):
-        for ln in range(start_line, len(code)):
-            if self.__num_indents(code, ln) == indents and re.match(r" *else:", code[ln]):
-                return ln
-
-    def __shift_pointers(self, assembly_code, start_line, split_point=None, only_pointers=False):
-        output = {}
-        for ln, line in assembly_code.items():
-            if line[0] == "B" and "break" not in line:
-                ptr = int(line.split(' ')[1])
-                if split_point is None or (split_point is not None and ptr > split_point):
-                    line = f"{line.split(' ')[0]} {ptr + start_line}"
-            output[ln if only_pointers else ln+start_line] = line
-        return output
-
-    def __extend_code(self, assembly_code, new_code, start_line):
-        for k, v in self.__shift_pointers(new_code, start_line).items():
-            assembly_code[k] = v
-        return assembly_code
-
-    def __find_pointers_to(self, assembly_code, ptr): # Function to find pointers to a given line
-        for ln, line in assembly_code.items():
-            if line[0] == "B" and int(line.split(" ")[1]) == ptr:
-                yield ln
-
-    def __next_non_pass_line(self, assembly_code, linenum): # Function to find next non-pass line after given line number
-        for ln in range(linenum, len(assembly_code)):
-            if assembly_code[ln] != "PASS":
-                return ln
-
-    def __extract_section(self, assembly_code, start, end): # Function to extract code between inclusive start and end bounds
-        new_code = {}
-        for ln, line in assembly_code.items():
-            if start <= ln <= end:
-                new_code[ln] = line
-        return new_code
+        if reg not in self.__allocation.values():
+            self.__registers[reg] = False
+
+    def __find_variables(self, statements, operator): # Variables and arrays that may be assigned a result of operator, directly or through each other
+        assignments = []
+        for statement in walk(statements):
+            if type(statement) in (Assignment, ArrayAssignment):
+                var = statement.variable if type(statement) is Assignment else statement.name
+                assignments.append((var, operator in statement.expression, set(re.findall(r"[A-Za-z_]\w*", statement.expression))))
+
+        found = set()
+        changed = True
+        while changed: # Results spread through assignments until nothing changes
+            changed = False
+            for var, uses, names in assignments:
+                if var not in found and (uses or names & found):
+                    found.add(var)
+                    changed = True
+        return found
+
+    def __unroll_for_loop(self, loop): # Statements that run a constant trip count for loop several iterations at a time, None if it cannot be unrolled
+        '''
+        Only loops like for(i=0, i<100, i+=2) with a literal start, bound and step whose body never assigns to the
+        loop variable are unrolled. The main loop runs the body and increment __unroll_factor times for each compare
+        and branch, then a remainder loop runs the iterations left over.
+        '''
+        init, increment = loop.initialisation, loop.increment
+        if self.__unroll_factor < 2 or type(init) is not Assignment or type(increment) is not Assignment or not init.expression.isdigit():
+            return None
+        var, start = init.variable, int(init.expression)
+        if var in self.__float_variables or increment.variable != var or not (cond := re.fullmatch(rf"{re.escape(var)}([<>])(\d+)", loop.condition)):
+            return None
+        if not (inc := re.fullmatch(rf"{re.escape(var)}([-+])(?:(\d+)|\((\d+)\))", increment.expression)): # i++, i--, i+=n or i-=n
+            return None
+        step = int(inc.group(2) or inc.group(3)) * (1 if inc.group(1) == "+" else -1)
+        if not step or (step > 0) != (cond.group(1) == "<"): # Loops that never end are left alone
+            return None
+        trip_count = max(0, -(-(int(cond.group(2)) - start) // step))
+        if trip_count < self.__unroll_factor:
+            return None
+        if any(type(statement) is Assignment and statement.variable == var for statement in walk(loop.body)): # Body changes the loop variable
+            return None
+
+        unrolled = trip_count - trip_count % self.__unroll_factor # Iterations run by the main loop
+        last = start + (unrolled - 1) * step # Value of the loop variable in the last iteration of the main loop
+        statements = [init, While(f"{var}{cond.group(1)}{last + 1 if step > 0 else last - 1}", (loop.body + [increment]) * self.__unroll_factor, loop.line)]
+        if unrolled < trip_count: # Remainder loop
+            statements.append(While(loop.condition, loop.body + [increment], loop.line))
+        self.loops_unrolled += 1
+        return statements
+
+    def __reduce_strength(self, token, register, operand1, operand2, negative_dividend=True): # Cheaper instructions for an operation with a constant integer operand, None if there are none
+        if operand1[0] == "#" or operand2[0] != "#" or not operand2[1:].isdigit():
+            return None
+        constant = int(operand2[1:])
+        power_of_two = constant and not constant & (constant - 1)
+        match token:
+            case "*": # alu.v multiplies in a single cycle, so only a multiply by 0, 1 or a power of two is replaced by one instruction
+                if not constant:
+                    return [Instruction("MOV", register, "#0")]
+                if constant == 1:
+                    return [Instruction("MOV", register, operand1)]
+                if power_of_two:
+                    return [Instruction("LSL", register, operand1, f"#{constant.bit_length() - 1}")]
+            case "\\" if power_of_two and not negative_dividend: # alu.v shifts the unsigned word, which only floor divides a dividend that is not negative
+                return [Instruction("LSR", register, operand1, f"#{constant.bit_length() - 1}")]
+            case "%" if power_of_two:
+                return [Instruction("AND", register, operand1, f"#{constant - 1}")]
+            case "^":
+                if not constant:
+                    return [Instruction("MOV", register, "#1")]
+                if constant.bit_length() + bin(constant).count("1") - 2 > self.MAX_POWER_CHAIN:
+                    return None
+                assembly_code = [Instruction("MOV", register, operand1)]
+                for bit in bin(constant)[3:]: # Square and multiply from the most significant bit
+                    assembly_code.append(Instruction("MUL", register, register, register))
+                    if bit == "1":
+                        assembly_code.append(Instruction("MUL", register, register, operand1))
+                if len(assembly_code) > 1: # Square straight from the operand rather than copying it first
+                    assembly_code[1].operands = (register, operand1, operand1)
+                    assembly_code.pop(0)
+                return assembly_code
+        return None
 
     def __compile_rpn(self, rpn):
 
-        assembly_code = {}
+        assembly_code = []
         stack = []
+        floats = set() # Registers that may hold a float
+        signed = set() # Registers that may hold a negative value, only subtraction makes one as numbers are never negative
 
         for token in rpn: # Loop through all tokens in RPN list
-            if token in OPERATIONS: # Operator found
+            if type(token) is Operator: # Operator found
                 register = self.__next_available_register()
                 self.__block_register(register)
                 operand2 = stack.pop()
                 operand1 = stack.pop()
+                if token == "/" or {operand1, operand2} & (floats | self.__float_variables): # Result may be a float
+                    floats.add(register)
+                else:
+                    floats.discard(register)
+                negative_dividend = operand1 in signed | self.__signed_variables
+                if token == "-" or {operand1, operand2} & (signed | self.__signed_variables):
+                    signed.add(register)
+                else:
+                    signed.discard(register)
                 if token == "~": # array index operation:
                     addrregname = self.__next_available_register()
                     self.__block_register(addrregname)
                     if is_number(operand2): # Index is an immediate value
-                        assembly_code[len(assembly_code)] = f"MOV {addrregname} #{self.__arrays[operand1][0] + int(operand2[1:])}"
+                        assembly_code.append(Instruction("MOV", addrregname, f"#{self.__arrays[operand1][0] + int(operand2[1:])}"))
                     else: # Index is either a register or a variable
                         if re.match(r"r\d", operand2): # Index is a register
                             index_reg = operand2
                         else:
                             extcode, index_reg = self.__compile_variable_load(operand2)
-                            assembly_code = self.__extend_code(assembly_code, extcode, len(assembly_code))
-                        assembly_code[len(assembly_code)] = f"ADD {addrregname} {index_reg} #{self.__arrays[operand1][0]}"
-                    assembly_code[len(assembly_code)] = f"LDR {register} {addrregname}"
+                            assembly_code.extend(extcode)
+                        assembly_code.append(Instruction("ADD", addrregname, index_reg, f"#{self.__arrays[operand1][0]}"))
+                        self.__free_register(index_reg) # Free up register holding the index
+                    assembly_code.append(Instruction("LDR", register, addrregname))
                     self.__free_register(addrregname)
                 else:
                     if is_variable(operand1): # operand 1 is a variable
                         extcode, operand1 = self.__compile_variable_load(operand1)
-                        assembly_code = self.__extend_code(assembly_code, extcode, len(assembly_code))
+                        assembly_code.extend(extcode)
                     if is_variable(operand2): # operand 2 is a variable  
                         extcode, operand2 = self.__compile_variable_load(operand2)
-                        assembly_code = self.__extend_code(assembly_code, extcode, len(assembly_code))
-                    match token:
-                        case "+": assembly_code[len(assembly_code)] = f"ADD {register} {operand1} {operand2}"
-                        case "-": assembly_code[len(assembly_code)] = f"SUB {register} {operand1} {operand2}"
-                        case "*": assembly_code[len(assembly_code)] = f"MUL {register} {operand1} {operand2}" 
-                        case "/": assembly_code[len(assembly_code)] = f"DIV {register} {operand1} {operand2}"
-                        case "^": assembly_code[len(assembly_code)] = f"EXP {register} {operand1} {operand2}"
-                        case "%": assembly_code[len(assembly_code)] = f"MOD {register} {operand1} {operand2}"
-                        case "\\": assembly_code[len(assembly_code)] = f"FDV {register} {operand1} {operand2}"
-                        case "~": assembly_code[len(assembly_code)] = f"AGT {register} {operand1} {operand2}"
+                        assembly_code.extend(extcode)
+                    if token in "+*" and is_number(operand1) and not is_number(operand2): # Only the last operand can be an immediate value on the processor
+                        operand1, operand2 = operand2, operand1
+                    if is_number(operand1) and is_number(operand2) and token in "+-*" and \
+                            (folded := {"+": int.__add__, "-": int.__sub__, "*": int.__mul__}[token](int(operand1[1:]), int(operand2[1:]))) >= 0:
+                        reduced = [Instruction("MOV", register, f"#{folded}")] # Both constant, negative results cannot be written as an immediate
+                    else:
+                        if is_number(operand1): # Copied into a register, the first operand's field cannot hold a number
+                            temp = self.__next_available_register()
+                            self.__block_register(temp)
+                            assembly_code.append(Instruction("MOV", temp, operand1))
+                            operand1 = temp
+                        reduced = None if register in floats else self.__reduce_strength(token, register, operand1, operand2, negative_dividend)
+                    if reduced is not None: # Constant operand with a cheaper sequence of instructions
+                        assembly_code.extend(reduced)
+                    else:
+                        match token:
+                            case "+": assembly_code.append(Instruction("ADD", register, operand1, operand2))
+                            case "-": assembly_code.append(Instruction("SUB", register, operand1, operand2))
+                            case "*": assembly_code.append(Instruction("MUL", register, operand1, operand2)) 
+                            case "/": assembly_code.append(Instruction("DIV", register, operand1, operand2))
+                            case "^": assembly_code.append(Instruction("EXP", register, operand1, operand2))
+                            case "%": assembly_code.append(Instruction("MOD", register, operand1, operand2))
+                            case "\\": assembly_code.append(Instruction("FDV", register, operand1, operand2))
+                            case "~": assembly_code.append(Instruction("AGT", register, operand1, operand2))
                 stack.append(register)
                 if operand1 in self.__registers:
                     self.__free_register(operand1) # Free up register if used as operand
@@ -147,28 +247,39 @@ class Compiler:
         return assembly_code, stack[-1] # Return assembly code and the register where output is stored at
 
     def __compile_argument(self, expression): # Compile argument
-        rpn = convert_expression(expression).split(",")
+        rpn = convert_to_rpn(expression)
         if len(rpn) == 1:
             return self.__compile_variable_load(rpn[0])
         return self.__compile_rpn(rpn)
     
     def __compile_variable_load(self, value):
-        assembly_code = {}
+        assembly_code = []
         if value not in self.__variables: # Operand not found in existing variables
             raise CompliationError("Variable does not exist")
+        if value in self.__allocation: # Variable is kept in a register
+            return assembly_code, self.__allocation[value]
         nextreg = self.__next_available_register()
-        assembly_code[0] = f"LDR {nextreg} {self.__variables[value]}"
+        assembly_code.append(Instruction("LDR", nextreg, str(self.__variables[value])))
         self.__block_register(nextreg)
         return assembly_code, nextreg
     
-    def __compile_variable_store(self, var, value):
-
-        assembly_code = {}
+    def __compile_move(self, assembly_code, dest, src): # Copy src into dest, writing straight into dest if src was only just calculated
+        if dest == src:
+            return
+        if assembly_code and assembly_code[-1].opcode in self.WRITES_FIRST_OPERAND and assembly_code[-1].operands[0] == src \
+            and src not in self.__allocation.values():
+            assembly_code[-1].operands = (dest,) + assembly_code[-1].operands[1:]
+        else:
+            assembly_code.append(Instruction("MOV", dest, src))
+
+    def __compile_variable_store(self, var, value, assembly_code=None): # Appends to assembly_code if given
+
+        assembly_code = [] if assembly_code is None else assembly_code
             
         if is_number(value): # Operand is an immediate value
 
             nextreg = self.__next_available_register()
-            assembly_code[0] = f"MOV {nextreg} {'#' if is_number(value) else ''}{value}" # move immediate value into register
+            assembly_code.append(Instruction("MOV", nextreg, f"{'#' if is_number(value) else ''}{value}")) # move immediate value into register
             self.__block_register(nextreg)
         
         elif re.match(r"r\d+", value): # Operand is a register
@@ -178,57 +289,62 @@ class Compiler:
         else: # Operand is a variable name
             
             code, nextreg = self.__compile_variable_load(value)
-            assembly_code = self.__extend_code(assembly_code, code, len(assembly_code))
+            assembly_code.extend(code)
 
-        if var in self.__variables: # Variable that is being saved to already exists
-            assembly_code[len(assembly_code)] = f"STR {nextreg} {self.__variables[var]}"
+        if var in self.__allocation: # Variable is kept in a register
+            self.__variables.setdefault(var, None)
+            self.__compile_move(assembly_code, self.__allocation[var], nextreg)
+        elif var in self.__variables: # Variable that is being saved to already exists
+            assembly_code.append(Instruction("STR", nextreg, str(self.__variables[var])))
         else:       
-            nextaddr = self.__next_variable_address()
-            assembly_code[len(assembly_code)] = f"STR {nextreg} {nextaddr}" # store value in register into next available address
+            nextaddr = self.__variable_address(var)
+            assembly_code.append(Instruction("STR", nextreg, str(nextaddr))) # store value in register into next available address
             self.__variables[var] = nextaddr
         self.__free_register(nextreg)
 
         return assembly_code
 
-    def __compile_assignment(self, line): # Compile Assignment operations
+    def __compile_assignment(self, lefthalf, righthalf): # Compile Assignment operations
 
-        lefthalf, righthalf = line.split("=") # Split assignment into two halves
-        rpn = convert_expression(righthalf).split(",") # Convert the right hand side into RPN
-        assembly_code = {}
+        rpn = convert_to_rpn(righthalf) # Convert the right hand side into RPN
+        assembly_code = []
 
         if len(rpn) == 1: # If only one operand
-            assembly_code = self.__extend_code(assembly_code, self.__compile_variable_store(lefthalf, rpn[0]), len(assembly_code))
+            assembly_code.extend(self.__compile_variable_store(lefthalf, rpn[0]))
         else: # Multiple operands
             assembly_code, lastreg = self.__compile_rpn(rpn) # Compile RPN
-            assembly_code = self.__extend_code(assembly_code, self.__compile_variable_store(lefthalf, lastreg), len(assembly_code))
+            self.__compile_variable_store(lefthalf, lastreg, assembly_code)
             self.__free_register(lastreg)
 
         return assembly_code
 
-    def __compile_comparison(self, line): # Compile comparison operation
+    def __compile_comparison(self, condition, target): # Compile comparison operation, branching to target when the condition holds
 
-        assembly_code = {}
+        assembly_code = []
 
-        condition = line.split("if")[1][:-1] # Get the if statement
         for cond, keyword in {"==": "BEQ", "!=": "BNE", ">": "BGT", "<": "BLT"}.items(): # Loop through all compare possibilities
             if re.match(r".*"+cond+r".*", condition): # Check if line matches
 
                 lefthalf, righthalf = condition.split(cond) # Split condition into lefthalf and righthalf
-                lrpn, rrpn = convert_expression(lefthalf).split(","), convert_expression(righthalf).split(",")
+                lrpn, rrpn = convert_to_rpn(lefthalf), convert_to_rpn(righthalf)
 
                 '''Compile rpn for LHS and RHS and add compare instruction'''
                 if len(lrpn) == 1 and len(rrpn) == 1: # both do not require compiling
-                    if is_number(lrpn[0]): # Immediate value
+                    if is_number(lrpn[0]) and is_number(rrpn[0]): # Both immediate values, only the last operand can be one on the processor
+                        lhs = self.__next_available_register()
+                        assembly_code.append(Instruction("MOV", lhs, f"#{lrpn[0]}"))
+                        lrpn = [lhs]
+                    elif is_number(lrpn[0]): # Immediate value
                         lhs = lrpn[0]
                     else: # Variable
                         extcode, lhs = self.__compile_variable_load(lrpn[0])
-                        assembly_code = self.__extend_code(assembly_code, extcode, len(assembly_code))
+                        assembly_code.extend(extcode)
                     if is_number(rrpn[0]): # Immediate value
                         rhs = rrpn[0]
                     else: # Variable
                         extcode, rhs = self.__compile_variable_load(rrpn[0])
-                        assembly_code = self.__extend_code(assembly_code, extcode, len(assembly_code))
-                    assembly_code[len(assembly_code)] = f"CMP {'#' if is_number(lrpn[0]) else ''}{lhs} {'#' if is_number(rrpn[0]) else ''}{rhs}"
+                        assembly_code.extend(extcode)
+                    assembly_code.append(Instruction("CMP", f"{'#' if is_number(lrpn[0]) else ''}{lhs}", f"{'#' if is_number(rrpn[0]) else ''}{rhs}"))
                     if not is_number(lrpn[0]):
                         self.__free_register(lhs)
                     if not is_number(rrpn[0]):
@@ -239,10 +355,10 @@ class Compiler:
                         lhs = lrpn[0]
                     else: # Variable
                         extcode, lhs = self.__compile_variable_load(lrpn[0])
-                        assembly_code = self.__extend_code(assembly_code, extcode, len(assembly_code))
+                        assembly_code.extend(extcode)
                     extcode, lastreg = self.__compile_rpn(rrpn)
-                    assembly_code = self.__extend_code(assembly_code, extcode, len(assembly_code))
-                    assembly_code[len(assembly_code)] = f"CMP {'#' if is_number(lrpn[0]) else ''}{lhs} {lastreg}"
+                    assembly_code.extend(extcode)
+                    assembly_code.append(Instruction("CMP", f"{'#' if is_number(lrpn[0]) else ''}{lhs}", lastreg))
                     self.__free_register(lastreg)
                     if not is_number(lrpn[0]):
                         self.__free_register(lhs)
@@ -252,10 +368,10 @@ class Compiler:
                         rhs = rrpn[0]
                     else: # Variable
                         extcode, rhs = self.__compile_variable_load(rrpn[0])
-                        assembly_code = self.__extend_code(assembly_code, extcode, len(assembly_code))
+                        assembly_code.extend(extcode)
                     extcode, lastreg = self.__compile_rpn(lrpn)
-                    assembly_code = self.__extend_code(assembly_code, extcode, len(assembly_code))
-                    assembly_code[len(assembly_code)] = f"CMP {'#' if is_number(rrpn[0]) else ''}{rhs} {lastreg}"
+                    assembly_code.extend(extcode)
+                    assembly_code.append(Instruction("CMP", f"{'#' if is_number(rrpn[0]) else ''}{rhs}", lastreg))
                     self.__free_register(lastreg)
                     if not is_number(rrpn[0]):
                         self.__free_register(rhs)
@@ -263,251 +379,352 @@ class Compiler:
                 else: # both sides need compiling
                     assembly_code, lastreg = self.__compile_rpn(lrpn) # Compile LHS and store register with stored value
                     new_code, lastreg2 = self.__compile_rpn(rrpn) # Compile RHS whilst blocking out register that is being used
-                    assembly_code = self.__extend_code(assembly_code, new_code, len(assembly_code)) # Extend the assembly code
-                    assembly_code[len(assembly_code)] = f"CMP {lastreg} {lastreg2}" # Add the compare operation
+                    assembly_code.extend(new_code) # Extend the assembly code
+                    assembly_code.append(Instruction("CMP", lastreg, lastreg2)) # Add the compare operation
                     self.__free_register(lastreg)
                     self.__free_register(lastreg2)
 
-                linenum = len(assembly_code)
-                assembly_code[linenum] = f"{keyword} {linenum+2}" # Add branch instruction
+                assembly_code.append(Instruction(keyword, target=target)) # Add branch instruction
                 return assembly_code
 
-    def __remove_pass_statements(self, assembly_code): # Remove pass statements from compiled code
-        ln = 0
-        while ln < len(assembly_code) - 1:
-            line = assembly_code[ln]
-            if line == "PASS":
-                next_line = self.__next_non_pass_line(assembly_code, ln)
-                for loc in self.__find_pointers_to(assembly_code, ln):
-                    assembly_code[loc].replace(str(ln), str(next_line))
-                assembly_code = self.__extend_code(self.__shift_pointers(self.__extract_section(assembly_code, 0, ln), -1, split_point=ln, only_pointers=True), 
-                                            self.__shift_pointers(self.__extract_section(assembly_code, ln+1, len(assembly_code)), -1, split_point=ln), 0)
-                ln = 0
-            ln += 1
-        assembly_code[len(assembly_code)-1] = "HALT"
-        return assembly_code
+    def __resolve_labels(self, assembly_code): # Remove pass statements and fill in branch targets in a single pass
+        addresses = [] # addresses[position] = final address of the first non pass instruction at or after position
+        address = 0
+        last = len(assembly_code) - 1
+        for position, instruction in enumerate(assembly_code):
+            addresses.append(address)
+            if instruction.opcode != "PASS" or position == last: # The final statement is always kept as it becomes HALT
+                address += 1
+        addresses.append(address)
+
+        output, lines = [], []
+        for instruction in assembly_code[:-1]:
+            if instruction.opcode == "PASS":
+                continue
+            lines.append(instruction.line)
+            if instruction.opcode[0] == "B":
+                output.append(f"{instruction.opcode} {addresses[instruction.target.position]}")
+            else:
+                output.append(str(instruction))
+        output.append("HALT")
+        lines.append(assembly_code[-1].line)
+
+        for ln in range(len(lines) - 2, -1, -1): # Instructions added by the optimisers belong to the statement after them, like a loop they were hoisted out of
+            if lines[ln] is None:
+                lines[ln] = lines[ln+1]
+        for ln in range(1, len(lines)):
+            if lines[ln] is None:
+                lines[ln] = lines[ln-1]
+        self.source_map = [None if line is None else line + 1 for line in lines]
+        return output
     
+    def __check_branch_targets(self, assembly_code): # Raise for a branch left without a target, before the optimisers follow it
+        for instruction in assembly_code:
+            if instruction.opcode[0] == "B" and (instruction.target is None or instruction.target.position is None):
+                raise CompliationError(f"Unresolved branch target for {instruction.opcode}, break statements must be inside a for loop")
+
     def __check_operand_order(self, assembly_code):
-        for ln, line in assembly_code.items():
+        for ln, line in enumerate(assembly_code):
             if (opcode := line.split(" ")[0]) == "CMP" and "#" in line:
                 operands = sorted(line.split(" ")[1:], reverse=True)
                 assembly_code[ln] = f"{opcode} {' '.join(operands)}"
         return assembly_code
 
-    def __compile_code(self, code): # Compile code function with pass statements
-
-        '''Handle cases where there is no line after if statement or no else statement'''
-        if "END" not in code and code: # If there is no ending statement in the current code
-            code += [f"{self.__num_indents(code, 0)*' '*self.INDENT_SIZE}END"] # Add the ending statement
-
-        assembly_code = {} # Initialise assembly code dictionary
-        ptrs = {} # Initialise dictionary for if statement pointers
-        break_ptrs = {} # Initialise dictionary for break statement pointers
-        ln = 0 # Set current line number to be 0
-
-        try:
-            while ln < len(code):
-
-                line = code[ln]
-                line = line.replace(" ", "")
-                linenum = len(assembly_code)
-
-                '''Fill in pointers if line found for if statements'''
-                if ln in ptrs: # If the pointer line matches
-                    for actual_line in ptrs[ln]: # Loop through pointer lines
-                        assembly_code[actual_line] = assembly_code[actual_line].replace("ptr", str(linenum)) # Replace the temporary pointer with the actual line
-                
-                '''Fill in pointers if line found for break statements'''
-                if ln in break_ptrs:
-                    for k, v in assembly_code.items():
-                        if "break" in v:
-                            assembly_code[k] = v.replace("break", str(break_ptrs[ln]))
-                
-                if re.match(r"if.*:", line) or re.match(r"elif.*:", line) or re.match(r"while.*:", line): # If statement, elif statement or while loop
-                    
-                    while_loop = False
-                    if re.match(r"elif.*:", line): # Elif statement
-                        line = line.replace("elif", "if")
-                    elif re.match(r"while.*:", line): # While loop
-                        line = line.replace("while", "if")
-                        while_loop = True
-                    
-                    '''Add the compare and initial branch instruction'''
-                    linenum = len(assembly_code)
-                    if while_loop:
-                        while_instruction_linenum = linenum
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_comparison(line), linenum)
-                    
-                    '''Add else branch instruction pointer'''
-                    linenum = len(assembly_code)
-                    end_of_curr_if_block = self.__find_end_of_curr_if_block(code, ln+1, self.__num_indents(code, ln)) # Find when the current if block ends
-                    assembly_code[linenum] = f"BAL ptr" # Add else instruction
-                    else_instruction = linenum
-                    
-                    '''Compile code inside the if statement'''
-                    linenum = len(assembly_code)
-                    end_of_if_statement = self.__find_end_of_if_statement(code, ln+1, self.__num_indents(code, ln)) # Find when the if statement ends
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code(code[ln+1:end_of_curr_if_block]), linenum) # Compile whatever code there is inside the if block
-                    if while_loop: # While loop
-                        assembly_code[linenum := len(assembly_code)] = f"BAL {while_instruction_linenum}"
-                    else:
-                        assembly_code[linenum := len(assembly_code)] = "BAL ptr"
-                        if end_of_if_statement not in ptrs:
-                            ptrs[end_of_if_statement] = set()
-                        ptrs[end_of_if_statement].add(linenum)
-
-                    '''Fill in address for else branch instruction'''
-                    assembly_code[else_instruction] = assembly_code[else_instruction].replace("ptr", str(len(assembly_code)))
-                    ln = end_of_curr_if_block # Set line in original code to jump to next
-                
-                elif re.match(r"for(.*,.*,.*):", line): # For loop
-                    linenum = len(assembly_code)
-                    initialisation, condition, increment = line.replace("):", "").replace("for(", "").split(",") # split for loop code into three sections
-                    end_of_for_loop = self.__find_end_of_if_statement(code,ln+1, indents := self.__num_indents(code, ln)) # Find when the for loop ends
-                    loop_code = [" "*self.INDENT_SIZE*indents + initialisation, f"{' '*self.INDENT_SIZE*indents}while {condition}:"] + code[ln+1:end_of_for_loop] + [f"{' '*self.INDENT_SIZE*(indents+1)}{increment}"] # convert for loop into a while loop
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code(loop_code), linenum)
-                    ln = end_of_for_loop
-                    break_ptrs[ln] = len(assembly_code)
-                
-                elif re.match(r"else:", line): # Else statement
-                    linenum = len(assembly_code)
-                    end_of_if_statement = self.__find_end_of_if_statement(code, ln+1, self.__num_indents(code, ln)) # Find when the if statement ends
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code(code[ln+1:end_of_if_statement]), linenum) # Compile whatever code there is inside the if block
-                    ln = end_of_if_statement
-                
-                elif re.match(r"break", line): # Break statement
-                    assembly_code[linenum] = "BAL break"
-                    ln += 1
-                
-                elif re.match(r".*=array(.*)", line): # Array declaration
-                    name, size = line[:-1].split("=array(")
+    def __compile_statements(self, statements, assembly_code): # Compile a block of statements, appends to assembly_code and returns unresolved break statements
+        breaks = [] # Initialise list for break statements that are yet to be given a target
+
+        for statement in statements:
+            start = len(assembly_code)
+            match statement:
+
+                case If(): # If statement with any elif and else statements
+                    end_of_if_statement = Label() # Every branch to the end of the if statement shares this label
+                    for condition, body in statement.branches:
+
+                        '''Add the compare and initial branch instruction'''
+                        if_block, else_block = Label(), Label()
+                        assembly_code.extend(self.__compile_comparison(condition, if_block))
+                        assembly_code.append(Instruction("BAL", target=else_block)) # Add else instruction
+
+                        '''Compile code inside the if block'''
+                        if_block.bind(len(assembly_code))
+                        breaks.extend(self.__compile_statements(body, assembly_code))
+                        assembly_code.append(Instruction("BAL", target=end_of_if_statement))
+
+                        '''Fill in address for else branch instruction'''
+                        else_block.bind(len(assembly_code))
+
+                    if statement.orelse is not None: # Else statement
+                        breaks.extend(self.__compile_statements(statement.orelse, assembly_code))
+                    end_of_if_statement.bind(len(assembly_code))
+
+                case While(): # While loop
+                    loop_start = Label(len(assembly_code))
+                    if_block, else_block = Label(), Label()
+                    assembly_code.extend(self.__compile_comparison(statement.condition, if_block))
+                    assembly_code.append(Instruction("BAL", target=else_block)) # Leave the loop
+                    if_block.bind(len(assembly_code))
+                    breaks.extend(self.__compile_statements(statement.body, assembly_code))
+                    assembly_code.append(Instruction("BAL", target=loop_start))
+                    else_block.bind(len(assembly_code))
+
+                case For(): # For loop
+                    loop = self.__unroll_for_loop(statement)
+                    if loop is None: # Not unrolled
+                        loop = [statement.initialisation, While(statement.condition, statement.body + [statement.increment], statement.line)] # convert for loop into a while loop
+                    loop_breaks = self.__compile_statements(loop, assembly_code)
+
+                    '''Fill in pointers for break statements'''
+                    end_of_loop = Label(len(assembly_code))
+                    for instruction in loop_breaks:
+                        instruction.target = end_of_loop
+
+                case Break(): # Break statement
+                    assembly_code.append(instruction := Instruction("BAL"))
+                    breaks.append(instruction)
+
+                case ArrayDeclaration(): # Array declaration
+                    name, size = statement.name, statement.size
                     if not is_number(size):
                         raise CompliationError("Variable length arrays are not supported")
-                    nextaddr = self.__next_array_address()
-                    self.__arrays[name] = (nextaddr, size)
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_variable_store(f"__{name}__size__", size), len(assembly_code))
-                    ln += 1
-                
-                elif re.match(r".*\[.*\]=.*", line): # Assignment to an array
-                    __front, expression = line.split("]=")
-                    array_name, index = __front.split("[")
+                    self.__arrays[name] = (self.__array_address(name, size, statement.line), size)
+
+                case ArrayAssignment(): # Assignment to an array
+                    array_name, index, expression = statement.name, statement.index, statement.expression
                     if not is_value(index): # index is an expression
                         new_code1, index = self.__compile_argument(index)
-                        assembly_code = self.__extend_code(assembly_code, new_code1, linenum)
+                        assembly_code.extend(new_code1)
                     elif not is_number(index): # index is a variable
                         extcode, index = self.__compile_variable_load(index)
-                        assembly_code = self.__extend_code(assembly_code, extcode, len(assembly_code))
+                        assembly_code.extend(extcode)
                     if not is_value(expression): # value is an expression
                         new_code2, expreg = self.__compile_argument(expression)
-                        assembly_code = self.__extend_code(assembly_code, new_code2, len(assembly_code))
+                        assembly_code.extend(new_code2)
                     elif not is_number(expression): # value is a variable
                         extcode, expreg = self.__compile_variable_load(expression)
-                        assembly_code = self.__extend_code(assembly_code, extcode, len(assembly_code))
+                        assembly_code.extend(extcode)
                     else: # value is an immediate value
                         expreg = self.__next_available_register()
-                        assembly_code[len(assembly_code)] = f"MOV {expreg} #{expression}"
+                        assembly_code.append(Instruction("MOV", expreg, f"#{expression}"))
                         self.__block_register(expreg)
                     addrreg = self.__next_available_register()
-                    assembly_code[len(assembly_code)] = f"ADD {addrreg} {'#' if is_number(index) else ''}{index} #{self.__arrays[array_name][0]}"
-                    assembly_code[len(assembly_code)] = f"STR {expreg} {addrreg}"
+                    if is_number(index): # Index is an immediate value
+                        assembly_code.append(Instruction("MOV", addrreg, f"#{self.__arrays[array_name][0] + int(index)}"))
+                    else:
+                        assembly_code.append(Instruction("ADD", addrreg, index, f"#{self.__arrays[array_name][0]}"))
+                    assembly_code.append(Instruction("STR", expreg, addrreg))
                     self.__free_register(expreg)
                     self.__free_register(addrreg)
-                    ln += 1
-                
-                elif re.match(r".*\+=.*", line): # Fast Addition operator
-                    variable, operand = line.split("+=")
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code([f"{variable} = {variable} + ({operand})"]), linenum) # Convert fast addition operator into compilable syntax
-                    ln += 1
-                
-                elif re.match(r".*-=.*", line): # Fast Subtraction operator
-                    variable, operand = line.split("-=")
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code([f"{variable} = {variable} - ({operand})"]), linenum) # Convert fast subtraction operator into compilable syntax
-                    ln += 1
-                
-                elif re.match(r".*\*=.*", line): # Fast Multiplication operator
-                    variable, operand = line.split("*=")
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code([f"{variable} = {variable} * ({operand})"]), linenum) # Convert fast multiplication operator into compilable syntax
-                    ln += 1
-                
-                elif re.match(r".*/=.*", line): # Fast Division operator
-                    variable, operand = line.split("/=")
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code([f"{variable} = {variable} / ({operand})"]), linenum) # Convert fast division operator into compilable syntax
-                    ln += 1
-                
-                elif re.match(r".*^=.*", line): # Fast Exponentiation operator
-                    variable, operand = line.split("^=")
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code([f"{variable} = {variable} ^ ({operand})"]), linenum) # Convert fast exponentiation operator into compilable syntax
-                    ln += 1
-                
-                elif re.match(r".*%=.*", line): # Fast Modulo operator
-                    variable, operand = line.split("%=")
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code([f"{variable} = {variable} % ({operand})"]), linenum) # Convert fast modulo operator into compilable syntax
-                    ln += 1
-                
-                elif re.match(r".*\\=.*", line): # Fast Floor Division operator
-                    variable, operand = line.split("\\=")
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code([f"{variable} = {variable} \\ ({operand})"]), linenum) # Convert fast floor division operator into compilable syntax
-                    ln += 1
-
-                elif re.match(r".*=.*", line): # Assignment
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_assignment(line), linenum) # Compile assignment RPN into multiple statements
-                    ln += 1
-                
-                elif re.match(r".*\+\+", line): # Increment operator
-                    variable = line.replace("++", "")
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code([f"{variable} = {variable} + 1"]), linenum) # Convert increment operator into compilable syntax
-                    ln += 1
-                
-                elif re.match(r".*--", line): # Decrement operator
-                    variable = line.replace("--", "")
-                    assembly_code = self.__extend_code(assembly_code, self.__compile_code([f"{variable} = {variable} - 1"]), linenum) # Convert decrement operator into compilable syntax
-                    ln += 1
+                    if index in self.__registers:
+                        self.__free_register(index) # Free up register holding the index
+
+                case Assignment(): # Assignment, the parser turns fast operators like x += y into x = x + (y)
+                    assembly_code.extend(self.__compile_assignment(statement.variable, statement.expression)) # Compile assignment RPN into multiple statements
 
-                elif re.match(r"print(.*)", line): # Print Statement
-                    argument = line.split("print(")[1][:-1]
+                case Print(): # Print Statement
+                    argument = statement.argument
                     if not is_number(argument):
                         new_code, argument = self.__compile_argument(argument)
-                        assembly_code = self.__extend_code(assembly_code, new_code, len(assembly_code))
-                    assembly_code[len(assembly_code)] = f"PRT {argument}"
-                    ln += 1
-
-                elif line == "END": # Pass statement used to make compiling process easier
-                    assembly_code[linenum] = "PASS"
-                    ln += 1
+                        assembly_code.extend(new_code)
+                    assembly_code.append(Instruction("PRT", argument))
+                    if argument in self.__registers:
+                        self.__free_register(argument) # Free up register holding the printed value
+
+                case Pass(): # Pass statement
+                    assembly_code.append(Instruction("PASS"))
+
+            for instruction in assembly_code[start:]: # Statements inside this one have already given their instructions a line
+                if instruction.line is None:
+                    instruction.line = statement.line
+
+        assembly_code.append(Instruction("PASS")) # Statements after the block start here, the last one in the program becomes HALT
+        return breaks
+
+    def __allocate_registers(self, assembly_code, budget): # Choose which variables to keep in the top budget registers
+        '''
+        Uses code compiled without register allocation. Each variable is live from its first to its last access,
+        widened to cover every loop it is accessed in, and variables whose live ranges do not overlap can share a register.
+        Variables are coloured hottest first, with accesses weighted by 10 to the power of their loop depth,
+        and those that do not fit stay in memory. Variables that are never loaded are left in memory.
+        '''
+        addresses = {str(address): var for var, address in self.__variables.items()}
+        loops = [(instruction.target.position, ln) for ln, instruction in enumerate(assembly_code)
+                 if instruction.target is not None and instruction.target.position is not None and instruction.target.position <= ln] # Backward branches
+
+        depths = [0] * (len(assembly_code) + 1)
+        for start, end in loops:
+            depths[start] += 1
+            depths[end+1] -= 1
+        for ln in range(1, len(depths)):
+            depths[ln] += depths[ln-1]
+
+        live_ranges, weights, loaded = {}, {}, set()
+        for ln, instruction in enumerate(assembly_code):
+            if instruction.opcode in ("LDR", "STR") and instruction.operands[1] in addresses:
+                var = addresses[instruction.operands[1]]
+                start, end = live_ranges.get(var, (ln, ln))
+                live_ranges[var] = (min(start, ln), max(end, ln))
+                weights[var] = weights.get(var, 0) + 10 ** depths[ln]
+                if instruction.opcode == "LDR":
+                    loaded.add(var)
+
+        changed = True
+        while changed: # A value may be needed on the next iteration, so live ranges touching a loop cover all of it
+            changed = False
+            for start, end in loops:
+                for var, (first, last) in live_ranges.items():
+                    if first <= end and last >= start and (first > start or last < end):
+                        live_ranges[var] = (min(first, start), max(last, end))
+                        changed = True
+
+        registers = list(self.__registers)[len(self.__registers)-budget:][::-1] # Temporaries are taken from r0 upwards so variables use the top registers
+        allocation = {}
+        for var in sorted(loaded, key=lambda var: (-weights[var], live_ranges[var][0], var)): # Ties go to the variable accessed first, then by name, so the output does not depend on set order
+            first, last = live_ranges[var]
+            in_use = {reg for other, reg in allocation.items() if live_ranges[other][0] <= last and live_ranges[other][1] >= first}
+            for reg in registers:
+                if reg not in in_use:
+                    allocation[var] = reg
+                    break
+        return allocation
 
-                else:
-                    raise SyntaxError(f"Syntax Error occurred on line {linenum+1}") # Syntax Error
-                
-        except SyntaxError as err:
+    def compile_code(self, code): # Compile code function without pass statements
+        statements, self.__errors = parse(code)
+        self.__float_variables = self.__find_variables(statements, "/")
+        self.__signed_variables = self.__find_variables(statements, "-")
+        self.__unroll_factor = self.unroll_factor if self.optimise else 1
+        while True: # Unroll less until the code fits below the variables in memory
+            assembly_code = self.__compile_program(code, statements)
+            if assembly_code is not None and (len(assembly_code) <= self.VARIABLE_RANGE[0] or not self.loops_unrolled):
+                break
+            self.__unroll_factor //= 2
+        for err in self.__errors:
             print(err)
-            
+        if self.cache is not None:
+            self.cache.trim()
         return assembly_code
 
-    def compile_code(self, code): # Compile code function without pass statements
-        return self.__check_operand_order(self.__remove_pass_statements(self.__compile_code(code)))
-
-def main(source, dest): # Main function
+    def __compile_blocks(self, code, statements, assembly_code): # Compile the program one top level statement at a time, reusing statements from the cache
+        '''
+        The code for a top level statement depends on its source lines and on the state it is compiled in, so the cache key covers the
+        variables and arrays declared before it, the addresses planned for the names in it, the registers in use, the register allocation,
+        the float and signed variables and the unroll factor.
+        Each entry keeps the variables and arrays the statement declared, branch targets relative to its first instruction and source lines relative to its first line.
+        '''
+        if self.cache is None or not statements:
+            self.__compile_statements(statements, assembly_code)
+            return
+
+        context = BlockCache.key(sorted(self.__allocation.items()), sorted(self.__float_variables), sorted(self.__signed_variables), self.__unroll_factor)
+        symbols = context # Hash of the declarations so far, symbol tables only change by the declarations each statement makes
+        for statement, end in zip(statements, [statement.line for statement in statements[1:]] + [len(code)]):
+            names = set(NAME_PATTERN.findall("\n".join(code[statement.line:end])))
+            key = BlockCache.key(symbols, self.__plan.addresses(names), self.__registers, *code[statement.line:end])
+            position = len(assembly_code)
+            if (entry := self.cache.get(key)) is None:
+                variables, arrays, loops_unrolled = dict(self.__variables), dict(self.__arrays), self.loops_unrolled
+                self.__compile_statements([statement], assembly_code)
+                instructions = [(instruction.opcode, instruction.operands, None if instruction.target is None or instruction.target.position is None
+                                 else instruction.target.position - position, None if instruction.line is None else instruction.line - statement.line)
+                                for instruction in assembly_code[position:]]
+                variables = {var: address for var, address in self.__variables.items() if var not in variables or variables[var] != address}
+                arrays = {name: array for name, array in self.__arrays.items() if arrays.get(name) != array}
+                self.cache.put(key, (instructions, variables, arrays, dict(self.__registers), self.loops_unrolled - loops_unrolled))
+            else:
+                instructions, variables, arrays, registers, loops_unrolled = entry
+                for opcode, operands, target, line in instructions:
+                    assembly_code.append(Instruction(opcode, *operands, target=None if target is None else Label(position + target),
+                                                     line=None if line is None else statement.line + line))
+                self.__variables.update(variables)
+                self.__arrays.update(arrays)
+                self.__registers = dict(registers)
+                self.loops_unrolled += loops_unrolled
+            if variables or arrays:
+                symbols = BlockCache.key(symbols, variables, arrays)
+
+    def __compile_program(self, code, statements): # Compile the whole program with the current unroll factor, None if the unrolled code is too large
+        allocations = [{}]
+        if self.register_allocation:
+            self.__reset(plan=plan_memory(statements, self.VARIABLE_RANGE[0], reuse=False)) # The allocator tells variables apart by their addresses
+            profile = []
+            self.__compile_blocks(code, statements, profile)
+            allocations = [self.__allocate_registers(profile, budget) for budget in range(len(self.__registers) - self.MIN_TEMPORARY_REGISTERS, 0, -1)] + allocations
+
+        for allocation in allocations: # Keep fewer variables in registers if expressions run out of temporary registers
+            self.memory_plan = plan_memory(statements, self.VARIABLE_RANGE[0], allocation) # Variables in registers need no memory
+            if self.memory_plan.end > self.ARRAY_RANGE[1] + 1:
+                raise CompliationError(f"Variables and arrays need {self.memory_plan.words} words of memory, "
+                                       f"only {self.ARRAY_RANGE[1] + 1 - self.VARIABLE_RANGE[0]} are available")
+            self.__reset(allocation, self.memory_plan)
+            assembly_code = []
+            try:
+                self.__compile_blocks(code, statements, assembly_code)
+            except RegisterPressureError:
+                if allocation:
+                    continue
+                raise
+            if self.loops_unrolled and sum(instruction.opcode != "PASS" for instruction in assembly_code) > self.VARIABLE_RANGE[0]:
+                return None # Checked before the optimisers run, so they only run for the unroll factor that is kept
+            self.__check_branch_targets(assembly_code)
+            self.instructions_hoisted, self.induction_variables_rebased = optimise_loops(assembly_code) if self.optimise else (0, 0)
+            self.instructions_removed = peephole_optimise(assembly_code) if self.optimise else 0
+            self.branches_removed = optimise_branches(assembly_code) if self.optimise else 0
+            self.variable_registers = dict(allocation)
+            return self.__check_operand_order(self.__resolve_labels(assembly_code))
+
+def source_ranges(source_map): # (source line, first assembly line, last assembly line) for each run of assembly lines from the same source line
+    ranges = []
+    for ln, line in enumerate(source_map):
+        if ranges and ranges[-1][0] == line and ranges[-1][2] == ln - 1:
+            ranges[-1][2] = ln
+        else:
+            ranges.append([line, ln, ln])
+    return ranges
+
+def write_source_map(source, source_map, map_file): # JSON source map, lines has the source line of every assembly line
+    with open(map_file, "w") as f:
+        json.dump({"source": source, "lines": source_map, "ranges": source_ranges(source_map)}, f)
+
+def main(source, dest, optimise=False, unroll_factor=Compiler.UNROLL_FACTOR, use_cache=True, memory_map=False): # Main function
     try:
         with open(source, "r") as f: # Read code file
             code = f.read().splitlines()
-        compiler = Compiler()
+        compiler = Compiler(optimise=optimise, unroll_factor=unroll_factor, cache=BlockCache() if use_cache else None)
         assembly = compiler.compile_code(code) # Compile the code
         with open(dest, "w") as f: # Write the assembly to output file
-            for line in assembly.values():
+            for line in assembly:
                 f.write(line+"\n")
             for _ in range(len(assembly), Compiler.ARRAY_RANGE[1]+1):
                 f.write("\n")
+        write_source_map(path.abspath(source), compiler.source_map, path.splitext(dest)[0] + ".map") # Read by pexec --profile
+        write_memory_map(compiler.memory_plan, path.splitext(dest)[0] + ".memory.json", compiler.variable_registers)
+        if memory_map:
+            print_memory_map(compiler.memory_plan, compiler.variable_registers)
+        if optimise:
+            print(f"\033[36;1mUnrolled {compiler.loops_unrolled} for loops\033[0m")
+            print(f"\033[36;1mLoop optimiser hoisted {compiler.instructions_hoisted} instructions and rebased {compiler.induction_variables_rebased} induction variables\033[0m")
+            print(f"\033[36;1mPeephole optimiser removed {compiler.instructions_removed} instructions\033[0m")
+            print(f"\033[36;1mBranch layout removed {compiler.branches_removed} branches\033[0m")
+        print(f"\033[36;1mVariables and arrays use {compiler.memory_plan.words} words of memory, {len(compiler.variable_registers)} variables are kept in registers\033[0m")
+        if use_cache:
+            print(f"\033[36;1mReused {compiler.cache.hits} of {compiler.cache.hits + compiler.cache.misses} compiled blocks from the cache\033[0m")
         print(f"\033[92;1mCode compiled successfully into {dest}\033[0m")
     except FileNotFoundError as err: # Code file not found
         print(f"\033[91;1m{err}\033[0m")
 
 if __name__ in "__main__":
-    if argv[1] == "--version":
+    optimise = "-O" in argv # Optimisation flag can go anywhere
+    use_cache = "--no-cache" not in argv
+    memory_map = "--memory-map" in argv
+    unroll = [arg for arg in argv if arg.startswith("--unroll=")] # Unroll factor can go anywhere too
+    unroll_factor = int(unroll[-1].split("=")[1]) if unroll else Compiler.UNROLL_FACTOR
+    args = [arg for arg in argv if arg not in ("-O", "--no-cache", "--memory-map") and arg not in unroll] + ["", ""]
+    if args[1] == "--version":
         print(f"\033[36;1mpcompile {VERSION}\033[0m")
-    elif not argv[1] and not argv[2]: # No arguments passed:
-        print("\033[91;1musage: pcompile <code file> [-o <output file>] \033[0m")
-    elif not argv[2]: # Second argument not passed:
-        main(argv[1], "assembly.txt")
+    elif not args[1] and not args[2]: # No arguments passed:
+        print("\033[91;1musage: pcompile <code file> [<output file>] [-O] [--unroll=<factor>] [--no-cache] [--memory-map] \033[0m")
+    elif not args[2]: # Second argument not passed:
+        main(args[1], "assembly.txt", optimise, unroll_factor, use_cache, memory_map)
     else: # Both arguments passed
-        main(argv[1], argv[2])
+        main(args[1], args[2], optimise, unroll_factor, use_cache, memory_map)
         
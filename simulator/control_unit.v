@@ -117,7 +117,7 @@ always @(posedge clk or negedge nreset)
     else if (decode) begin
         execute_store_e <= (opcode_d == STR);
         execute_load_e <= (opcode_d == LDR);
-        do_halt_e <= (opcode_d == HALT);
+        do_halt_e <= (opcode_d == HALT) && !flush; // A HALT squashed by a taken branch must not stop the processor
         alu_op_e <= alu_op_d;
     end
 
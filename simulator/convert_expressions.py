@@ -1,47 +1,43 @@
 import re
+from functools import lru_cache
 
 OPERATIONS = "+-*/%^\\~"
+EXPRESSION_CACHE_SIZE = 4096 # Expressions whose RPN is kept, a program repeats the same few expressions many times
 
+NUMBER_PATTERN = re.compile(r"\d+(?:\Z|\.\d)") # Integer, or the start of a float
+REGISTER_PATTERN = re.compile(r"r\d")
+TOKEN_PATTERN = re.compile(r"""(?P<string>(["']).*?\2)|(?P<number>[\d.]+)|(?P<variable>[^\W\d_][^\W_]*)|(?P<operator>[-+*/%^\\~])|(?P<bracket>[()\[\]])|.""", re.S)
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
 def is_variable(s):
-    return not (is_number(s[1:]) and s[0] == "#") and not re.match(r"r\d", s)
+    return not (is_number(s[1:]) and s[0] == "#") and not REGISTER_PATTERN.match(s)
 
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
 def is_number(s):
-    s = s.replace("#", "")
-    if s.isdigit(): # Integer
-        return True
-    elif re.match(r"\d+\.\d+", s): # Float
-        return True
-    return False
-
-class Number:
-    def __init__(self, value):
-        self.value = value
-    
-    def to_str(self):
-        return f"{self.value}"
-    
-    def __repr__(self):
-        return f"Number({self.value})"
-
-class String:
-    def __init__(self, string):
-        self.string = string[1:-1]
-    
-    def to_str(self):
-        return f'"{self.string}"'
-    
-    def __repr__(self):
-        return f"String({self.string})"
-
-class Variable:
-    def __init__(self, name):
-        self.name = name
-    
-    def to_str(self):
-        return f"{self.name}"
-    
+    return NUMBER_PATTERN.match(s.replace("#", "")) is not None
+
+'''Tokens are the text they were read from, the class says what kind of token it is'''
+
+class Token(str):
+    __slots__ = ()
+
     def __repr__(self):
-        return f"Variable({self.name})"
+        return f"{type(self).__name__}({str.__str__(self)})"
+
+class Number(Token):
+    __slots__ = ()
+
+class String(Token):
+    __slots__ = ()
+
+class Variable(Token):
+    __slots__ = ()
+
+class Operator(Token):
+    __slots__ = ()
+
+class Bracket(Token):
+    __slots__ = ()
 
 def precedence(operator):
     if operator == "~":
@@ -58,70 +54,57 @@ def precedence(operator):
 def associativity(operator):
     return "R" if operator == "^" else "L"
 
-def extract_components_from_infix(s):
+PRECEDENCE = {operator: precedence(operator) for operator in OPERATIONS}
+RIGHT_ASSOCIATIVE = {operator for operator in OPERATIONS if associativity(operator) == "R"}
+KINDS = {"string": String, "number": Number, "variable": Variable, "operator": Operator}
+ARRAY_INDEX = (Operator("~"), Bracket("("))
+CLOSE_INDEX = Bracket(")")
+
+def extract_components_from_infix(s): # Split s into tokens in a single scan, characters that cannot start a token are skipped
     tokens = []
-    i = 0
-    while i < len(s):
-        char = s[i]
-        if char == "'" or char == '"': # string quotes
-            tokens.append(String(part := s[i:s[i+1:].find(char)+i+2]))
-        elif char in OPERATIONS+"()": # operation or bracket
-            tokens.append(part := char)
-        elif char == "[": # open square backet denotes accessing item in array
-            tokens.append(part := "~")
-            tokens.append("(")
-        elif char == "]": # close square bracket
-            tokens.append(")")
-        elif char.isdigit() or char == ".": # start of a number
-            if i == len(s) - 1:
-                tokens.append(Number(part := char))
-            else:
-                for j, c in enumerate(s[i+1:]):
-                    if not c.isdigit() and c != ".":
-                        tokens.append(Number(part := s[i:j+i+1]))
-                        break
-                else:
-                    tokens.append(Number(part := s[i:]))
-        elif char.isalpha(): # start of a variable
-            if i == len(s) - 1:
-                tokens.append(Variable(part := char))
+    for match in TOKEN_PATTERN.finditer(s):
+        kind = match.lastgroup
+        if kind in KINDS:
+            tokens.append(KINDS[kind](match.group(kind)))
+        elif kind == "bracket":
+            bracket = match.group(kind)
+            if bracket == "[": # open square backet denotes accessing item in array
+                tokens.extend(ARRAY_INDEX)
+            elif bracket == "]":
+                tokens.append(CLOSE_INDEX)
             else:
-                for j, c in enumerate(s[i+1:]):
-                    if not c.isalpha() and not c.isdigit():
-                        tokens.append(Variable(part := s[i:j+i+1]))
-                        break
-                else:
-                    tokens.append(Variable(part := s[i:]))
-        i += len(part)
+                tokens.append(Bracket(bracket))
     return tokens
 
-def convert_to_rpn(s):
-    tokens = extract_components_from_infix(s)
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def convert_to_rpn(s): # Shunting yard, returns a tuple of tokens that is shared between callers so it must not be changed
     operator_stack = []
     result = []
-    for token in tokens:
-        if type(token) in (Number, String, Variable): # Operand
-            result.append(token)
-        elif token == "(": # Open bracket
-            operator_stack.append(token)
-        elif token == ")": # Close bracket
-            while operator_stack and operator_stack[-1] != "(": # While stack is not empty and item at top of stack is not open bracket
-                result.append(operator_stack.pop()) # Pop from stack and add to result
-            operator_stack.pop() # Pop the open bracket
-        else: # Operator
-            while operator_stack and (precedence(token) < precedence(operator_stack[-1]) or \
-                             precedence(token) == precedence(operator_stack[-1]) and associativity(token) == "L"): 
+    for token in extract_components_from_infix(s):
+        if type(token) is Bracket:
+            if token == "(": # Open bracket
+                operator_stack.append(token)
+            else: # Close bracket
+                while operator_stack and operator_stack[-1] != "(": # While stack is not empty and item at top of stack is not open bracket
+                    result.append(operator_stack.pop()) # Pop from stack and add to result
+                operator_stack.pop() # Pop the open bracket
+        elif type(token) is Operator:
+            rank = PRECEDENCE[token]
+            while operator_stack and operator_stack[-1] != "(" and (rank < PRECEDENCE[operator_stack[-1]] or \
+                             rank == PRECEDENCE[operator_stack[-1]] and token not in RIGHT_ASSOCIATIVE):
                 # Precedence of token <= precedence of operator on stack, accounting for associativity of repeated exponentiation (aka. tetration)
-                result.append(operator_stack.pop()) # Pop from stack and add to reuslt
+                result.append(operator_stack.pop()) # Pop from stack and add to result
             operator_stack.append(token)
-    
+        else: # Operand
+            result.append(token)
+
     while operator_stack:
         result.append(operator_stack.pop())
-    
-    return result
 
-def convert_expression(s):
-    return ','.join([token.to_str() if type(token) != str else token for token in convert_to_rpn(s)])
+    return tuple(result)
+
+def convert_expression(s): # RPN as comma separated text
+    return ','.join(convert_to_rpn(s))
 
-def is_value(s):
-    return len(convert_expression(s)) == 1
\ No newline at end of file
+def is_value(s): # Expression is a single number or variable
+    return len(convert_to_rpn(s)) == 1
@@ -0,0 +1,122 @@
+import json
+from sys import argv
+from time import perf_counter
+from operator import eq, gt, lt, ne
+from executer import NoComparison
+from emulator import LDR, STR, BAL, BCOND, HALT, EQ, GT, LT, NE, MEMORY_SIZE, EmulationError, build_handlers, load_memory_image
+
+'''States of control_unit.v'''
+FETCH, BUBBLE, HALTED = range(3)
+
+CONDITIONS = {EQ: eq, GT: gt, LT: lt, NE: ne} # Status register bit each condition code of BCOND reads
+MNEMONICS = ("LDR", "STR", "ADD", "SUB", "MOV", "CMP", "BAL", "BCOND", "AND", "ORR", "EOR", "MVN", "LSL", "LSR", "ASR", "HALT", "MUL")
+CYCLES_FILE = "cycles.json"
+TOP = 10 # Rows in the table of the instructions that stall the most
+
+def simulate_cycles(image, max_cycles=None, memory_size=MEMORY_SIZE):
+    '''
+    Clocks a model of control_unit.v from reset until it reaches HALTED, returning (cycles, executed, bubbles, flushes, stalls)
+    where the last four are lists with a count for every address. Each loop iteration is one rising edge:
+    the state, decode and execute flags, program counter and instruction registers change exactly as the RTL's do,
+    and an instruction takes effect, through the emulator's handlers, on the edge that ends its execute cycle.
+    A bubble is the cycle after a LDR or STR is decoded, when the RAM is busy with its access instead of a fetch,
+    and is counted against that instruction. A flush is a taken branch in execute, which squashes decode and fetch.
+    Stalls are the cycles nothing executes, counted against the last LDR, STR or taken branch before them,
+    so cycles is always the instructions executed plus the stalls plus the 3 cycles it takes the first instruction to reach execute.
+    '''
+    registers = [0] * 8
+    memory = image + [0] * (memory_size - len(image))
+    status = [NoComparison(), NoComparison()] # Operands of the last CMP, the status register resets to all conditions false
+    handlers = build_handlers(image, registers, memory, status)
+    opcodes = [word >> 27 for word in memory]
+    executed, bubbles, flushes, stalls = [0] * len(memory), [0] * len(memory), [0] * len(memory), [0] * len(memory)
+    cause = None # Address of the instruction the next stall is counted against
+
+    state, decode, execute, do_halt_e = BUBBLE, False, False, False # Reset values
+    pc_f = pc_d = pc_e = 0 # Program counter and the addresses of the instructions in cir_d and cir_e
+    cycles = 0
+    try:
+        while state != HALTED:
+            if cycles == max_cycles:
+                raise EmulationError(f"Program did not halt within {max_cycles} cycles")
+            fetch = state == FETCH
+            flush = False
+            if execute:
+                opcode = opcodes[pc_e]
+                executed[pc_e] += 1
+                if opcode == BAL:
+                    flush = True
+                elif opcode == BCOND:
+                    flush = CONDITIONS[(memory[pc_e] >> 25) & 3](status[0], status[1])
+                if opcode != HALT: # A branch's handler only checks where it goes, it raises for a LDR or STR needing an address the branch did not compute
+                    handlers[pc_e]()
+                if state == BUBBLE:
+                    bubbles[pc_e] += 1
+                    cause = pc_e
+                if flush:
+                    flushes[pc_e] += 1
+                    cause = pc_e
+            elif cause is not None:
+                stalls[cause] += 1
+            if do_halt_e:
+                next_state = HALTED
+            elif not flush and decode and opcodes[pc_d] in (LDR, STR):
+                next_state = BUBBLE
+            else:
+                next_state = FETCH
+
+            next_pc_f = memory[pc_e] & 0x7FFFFF if flush else pc_f + 1 # Branch target in bits 22:0
+
+            # Rising edge, every register takes the value computed from the ones before it
+            halt = do_halt_e
+            if decode:
+                pc_e, do_halt_e = pc_d, opcodes[pc_d] == HALT and not flush
+            decode, execute = fetch and not flush and not halt, decode and not flush and not halt
+            if fetch:
+                pc_d, pc_f = pc_f, next_pc_f
+            state = next_state
+            cycles += 1
+    except IndexError:
+        raise EmulationError(f"Address out of range at program counter {pc_e}") from None
+    return cycles, executed, bubbles, flushes, stalls
+
+def report_cycles(image, cycles, executed, bubbles, flushes, stalls, cycles_file=CYCLES_FILE): # Prints the totals and the instructions that stall the most, and writes every count as JSON
+    instructions = sum(executed)
+    print(f"\033[36;1m{cycles} cycles, {instructions} instructions, CPI {cycles / instructions:.3f}, {sum(bubbles)} bubbles, {sum(flushes)} flushes, {sum(stalls)} stalls\033[0m")
+    print(f"\033[36;1m{'address':>8}  {'word':8}  {'opcode':8}{'executed':>12}{'bubbles':>12}{'flushes':>12}{'stalls':>12}\033[0m")
+    for address in sorted((address for address in range(len(executed)) if stalls[address]), key=lambda address: -stalls[address])[:TOP]:
+        word = image[address] if address < len(image) else 0
+        print(f"{address:>8}  {word:08X}  {MNEMONICS[word >> 27] if word >> 27 < len(MNEMONICS) else '?':8}"
+              f"{executed[address]:>12}{bubbles[address]:>12}{flushes[address]:>12}{stalls[address]:>12}")
+    with open(cycles_file, "w") as f:
+        json.dump({
+            "cycles": cycles,
+            "instructions": instructions,
+            "cpi": cycles / instructions,
+            "bubbles": sum(bubbles),
+            "flushes": sum(flushes),
+            "stalls": sum(stalls),
+            "addresses": [{"address": address, "executed": executed[address], "bubbles": bubbles[address], "flushes": flushes[address], "stalls": stalls[address]}
+                          for address in range(len(executed)) if executed[address]],
+        }, f, indent=1)
+
+if __name__ in "__main__":
+    options = dict(arg[2:].split("=", 1) for arg in argv[2:] if arg.startswith("--") and "=" in arg) # --max-cycles=<limit>
+    if "--version" in argv: # Version argument
+        print(f"\033[36;1mpcycles v0.15\033[0m")
+    elif "--help" in argv: # Help argument
+        print("\033[91;1mpcycles syntax: pcycles <memory file or .bin image> [--max-cycles=<limit>]\033[0m")
+    elif len(argv) < 2 or any(not arg.startswith("--max-cycles=") for arg in argv[2:]): # Incorrect arguments
+        print("\033[91;1mpcycles: Incorrect number of arguments\033[0m")
+    elif not argv[1]: # Blank arguments
+        print("\033[91;1mpcycles: Some arguments are blank\033[0m")
+    else:
+        try:
+            image = load_memory_image(argv[1])
+            stime = perf_counter()
+            counts = simulate_cycles(image, int(options["max-cycles"]) if "max-cycles" in options else None)
+            seconds = perf_counter() - stime
+            report_cycles(image, *counts)
+            print(f"\033[92;1mCycle simulation successful, written to {CYCLES_FILE}, took {seconds} seconds\033[0m")
+        except (FileNotFoundError, EmulationError) as err: # Memory file not found or program failed
+            print(f"\033[91;1m{err}\033[0m")
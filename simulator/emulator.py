@@ -0,0 +1,242 @@
+from sys import argv, byteorder
+from time import perf_counter
+from array import array
+from executer import Halt, NoComparison
+
+WORD_MASK = 0xFFFFFFFF
+MEMORY_SIZE = 4096 # Words of RAM given to a program, covers the compiler's variable and array ranges
+
+'''Opcodes as encoded in bits 31:27 by the assembler'''
+LDR, STR, ADD, SUB, MOV, CMP, BAL, BCOND, AND, ORR, EOR, MVN, LSL, LSR, ASR, HALT, MUL = range(17)
+ALU = {
+    ADD: lambda a, b: (a + b) & WORD_MASK,
+    SUB: lambda a, b: (a - b) & WORD_MASK,
+    AND: lambda a, b: a & b,
+    ORR: lambda a, b: a | b,
+    EOR: lambda a, b: a ^ b,
+    LSL: lambda a, b: (a << b) & WORD_MASK,
+    LSR: lambda a, b: a >> b,
+    MUL: lambda a, b: (a * b) & WORD_MASK,
+}
+
+'''Condition codes in bits 26:25 of a conditional branch'''
+EQ, GT, LT, NE = range(4)
+
+class EmulationError(Exception):
+    pass
+
+def load_memory_image(path): # Read the space separated hex words written by the assembler, or its binary image if path ends in .bin
+    if path.endswith(".bin"):
+        return load_binary_image(path)
+    with open(path, "r") as f:
+        words = f.read().split()
+    if not any(word.startswith("@") for word in words):
+        return [int(word, 16) for word in words]
+    image, address = [], 0
+    for word in words: # Sparse image, @address moves to where the following words are loaded
+        if word.startswith("@"):
+            address = int(word[1:], 16)
+            continue
+        if address >= len(image):
+            image.extend([0] * (address + 1 - len(image)))
+        image[address] = int(word, 16)
+        address += 1
+    return image
+
+def load_binary_image(path): # Read the little endian 32 bit words written by the assembler with --binary
+    words = array("I")
+    with open(path, "rb") as f:
+        words.frombytes(f.read())
+    if byteorder == "big":
+        words.byteswap()
+    return words.tolist()
+
+def decode(word): # Split a machine code word into its fields, mirroring assembler()
+    '''
+    Returns (opcode, register mode, condition, rd, rn, rm, immediate, address, target) where
+    register mode is bit 26 (the last operand is a register), condition is bits 26:25,
+    rd is bits 2:0, rn is bits 5:3, rm is bits 8:6, immediate is bits 25:6, address is bits 25:3 and target is bits 22:0.
+    '''
+    return (word >> 27, (word >> 26) & 1, (word >> 25) & 3, word & 7, (word >> 3) & 7, (word >> 6) & 7,
+            (word >> 6) & 0xFFFFF, (word >> 3) & 0x7FFFFF, word & 0x7FFFFF)
+
+'''Handler factories, each returns a function that executes one word and returns the next program counter'''
+
+def _alu(registers, memory, status, pc, opcode, mode, rd, rn, rm, immediate):
+    fn, nxt = ALU[opcode], pc + 1
+    if mode: # Second operand is a register
+        def step():
+            registers[rd] = fn(registers[rn], registers[rm])
+            return nxt
+    else:
+        def step():
+            registers[rd] = fn(registers[rn], immediate)
+            return nxt
+    return step
+
+def _move(registers, memory, status, pc, opcode, mode, rd, rm, immediate):
+    nxt = pc + 1
+    invert = WORD_MASK if opcode == MVN else 0
+    if mode: # Register
+        def step():
+            registers[rd] = registers[rm] ^ invert
+            return nxt
+    else:
+        value = immediate ^ invert
+        def step():
+            registers[rd] = value
+            return nxt
+    return step
+
+def computes(word, reg): # The instruction in word is an ALU operation or move whose result is written to reg
+    return (word >> 27 in ALU or word >> 27 in (MOV, MVN)) and word & 7 == reg
+
+def indirect(word): # The instruction in word is a LDR or STR in register mode
+    return word >> 27 in (LDR, STR) and (word >> 26) & 1
+
+def address_error(pc, opcode, reason): # Error for a register mode LDR or STR at pc that would use an address the processor never computed
+    return EmulationError(f"{'LDR' if opcode == LDR else 'STR'} at program counter {pc} takes its address from the result of the previous instruction, {reason}")
+
+def _memory_access(registers, memory, status, pc, opcode, mode, rd, rn, address, previous):
+    '''
+    In register mode the RTL takes the address from the previous instruction's ALU result rather than from rn, so it is only run
+    when previous, the word before it, computes rn, as in the ADD then LDR/STR sequences the compiler emits, and raises otherwise.
+    Branches to it raise when they are taken, see build_handlers().
+    '''
+    nxt = pc + 1
+    if mode and (previous is None or not computes(previous, rn)):
+        def step():
+            raise address_error(pc, opcode, f"which does not compute r{rn}")
+        return step
+    match opcode, mode:
+        case (0, 0): # LDR, absolute address
+            def step():
+                registers[rd] = memory[address]
+                return nxt
+        case (0, 1): # LDR, address in register
+            def step():
+                registers[rd] = memory[registers[rn]]
+                return nxt
+        case (1, 0): # STR, absolute address
+            def step():
+                memory[address] = registers[rd]
+                return nxt
+        case (1, 1): # STR, address in register
+            def step():
+                memory[registers[rn]] = registers[rd]
+                return nxt
+    return step
+
+def _compare(registers, memory, status, pc, mode, rn, rm, immediate): # Branches compare the stored operands as unsigned words
+    nxt = pc + 1
+    if mode:
+        def step():
+            status[0] = registers[rn]
+            status[1] = registers[rm]
+            return nxt
+    else:
+        def step():
+            status[0] = registers[rn]
+            status[1] = immediate
+            return nxt
+    return step
+
+def _branch(registers, memory, status, pc, condition, target):
+    nxt = pc + 1
+    match condition:
+        case None: # BAL
+            def step():
+                return target
+        case 0: # EQ
+            def step():
+                return target if status[0] == status[1] else nxt
+        case 1: # GT
+            def step():
+                return target if status[0] > status[1] else nxt
+        case 2: # LT
+            def step():
+                return target if status[0] < status[1] else nxt
+        case 3: # NE
+            def step():
+                return target if status[0] != status[1] else nxt
+    return step
+
+def _halt():
+    raise Halt
+
+def _unsupported(word):
+    def step():
+        raise EmulationError(f"Opcode {word >> 27} in word {word:08X} is not implemented by the processor")
+    return step
+
+def _enters_indirect(step, pc, target, opcode): # A branch handler that raises when it is taken to the register mode LDR or STR at target
+    def guarded():
+        if (nxt := step()) == target:
+            raise address_error(target, opcode, f"which is the branch at program counter {pc}")
+        return nxt
+    return guarded
+
+def build_handlers(image, registers, memory, status): # Decode every word of the image once
+    handlers = []
+    for pc, word in enumerate(image):
+        opcode, mode, condition, rd, rn, rm, immediate, address, target = decode(word)
+        if opcode in ALU:
+            handlers.append(_alu(registers, memory, status, pc, opcode, mode, rd, rn, rm, immediate))
+        elif opcode in (MOV, MVN):
+            handlers.append(_move(registers, memory, status, pc, opcode, mode, rd, rm, immediate))
+        elif opcode in (LDR, STR):
+            handlers.append(_memory_access(registers, memory, status, pc, opcode, mode, rd, rn, address, image[pc-1] if pc else None))
+        elif opcode == CMP:
+            handlers.append(_compare(registers, memory, status, pc, mode, rn, rm, immediate))
+        elif opcode == BAL:
+            handlers.append(_branch(registers, memory, status, pc, None, target))
+        elif opcode == BCOND:
+            handlers.append(_branch(registers, memory, status, pc, condition, target))
+        elif opcode == HALT:
+            handlers.append(_halt)
+        else: # ASR and unused opcodes do not write anything on the processor
+            handlers.append(_unsupported(word))
+        if opcode in (BAL, BCOND) and target < len(image) and indirect(image[target]):
+            handlers[-1] = _enters_indirect(handlers[-1], pc, target, image[target] >> 27)
+    return handlers
+
+def emulate(image, max_steps=None, memory_size=MEMORY_SIZE): # Run a machine code image until HALT
+    '''
+    Returns the registers r0-r7, the RAM and the number of instructions executed.
+    Code is decoded once before running, so stores into the code region do not change the program.
+    '''
+    registers = [0] * 8
+    memory = image + [0] * (memory_size - len(image))
+    status = [NoComparison(), NoComparison()] # Operands of the last CMP, the status register resets to all conditions false
+    handlers = build_handlers(image, registers, memory, status)
+    pc = steps = 0
+    try:
+        while steps != max_steps:
+            pc = handlers[pc]()
+            steps += 1
+        raise EmulationError(f"Program did not halt within {max_steps} instructions")
+    except Halt:
+        steps += 1
+    except IndexError:
+        raise EmulationError(f"Address out of range at program counter {pc}") from None
+    return registers, memory, steps
+
+if __name__ in "__main__":
+    if "--version" in argv: # Version argument
+        print(f"\033[36;1mpemu v0.15\033[0m")
+    elif "--help" in argv: # Help argument
+        print("\033[91;1mpemu syntax: pemu <memory file or .bin image>\033[0m")
+    elif len(argv) != 2: # Not enough arguments
+        print("\033[91;1mpemu: Incorrect number of arguments\033[0m")
+    elif not argv[1]: # Blank arguments
+        print("\033[91;1mpemu: Some arguments are blank\033[0m")
+    else:
+        try:
+            image = load_memory_image(argv[1])
+            stime = perf_counter()
+            registers, memory, steps = emulate(image)
+            for idx, value in enumerate(registers):
+                print(f"r{idx} = {value} (0x{value:08X})")
+            print(f"\033[92;1mEmulation successful, {steps} instructions took {perf_counter() - stime} seconds\033[0m")
+        except (FileNotFoundError, EmulationError) as err: # Memory file not found or program failed
+            print(f"\033[91;1m{err}\033[0m")
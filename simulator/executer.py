@@ -1,5 +1,13 @@
+import asyncio
+import marshal
 from sys import argv
+from os import path, replace
+from hashlib import sha256
 from time import perf_counter
+from array import array
+from mmap import mmap, ACCESS_COPY
+from operator import add, sub, mul, truediv, pow, mod, floordiv, lshift, rshift, and_
+from profiler import PROFILE_FILE, FOLDED_FILE, load_source_map, report_profile
 
 def is_number(s):
     s = s.replace("#", "")
@@ -7,73 +15,569 @@ def is_number(s):
         return True
     return False
 
-NUMERICAL_INSTRUCTIONS = ("ADD", "SUB", "MUL", "DIV", "EXP", "MOD", "FDV")
+NUMERICAL_INSTRUCTIONS = ("ADD", "SUB", "MUL", "DIV", "EXP", "MOD", "FDV", "LSL", "LSR", "AND")
+REGISTER_NAMES = ("r0", "r1", "r2", "r3", "r4", "r5", "r6", "r7")
 
-def execute_assembly_code(memory):
-    REGISTERS = {"r0": None, "r1": None, "r2": None, "r3": None, "r4": None, "r5": None, "r6": None, "r7": None}
-    STATUS_REGISTER = (None, None, None, None) # Equal, Not Equal, Greater Than, Less Than
+'''Opcode IDs used by decoded instructions'''
+HALT, ADD, SUB, MUL, DIV, EXP, MOD, FDV, LSL, LSR, AND, LDR, STR, MOV, CMP, BAL, BEQ, BNE, BGT, BLT, PRT, INVALID = range(22)
+OPCODES = {"HALT": HALT, "ADD": ADD, "SUB": SUB, "MUL": MUL, "DIV": DIV, "EXP": EXP, "MOD": MOD, "FDV": FDV, "LSL": LSL, "LSR": LSR, "AND": AND,
+           "LDR": LDR, "STR": STR, "MOV": MOV, "CMP": CMP, "BAL": BAL, "BEQ": BEQ, "BNE": BNE, "BGT": BGT, "BLT": BLT, "PRT": PRT}
+ARITHMETIC = {ADD: add, SUB: sub, MUL: mul, DIV: truediv, EXP: pow, MOD: mod, FDV: floordiv, LSL: lshift, LSR: rshift, AND: and_}
+CONDITIONAL_BRANCHES = (BEQ, BNE, BGT, BLT)
+
+MEMORY_SIZE = 3136 # Words of data memory, enough for the compiler's variables and arrays at 1024 to 3135
+WORD_TYPE = "q" # Data memory words are signed 64 bit integers
+WIDE = -1 << 63 # Word value marking an address whose value is in Memory.wide, so -2**63 itself cannot be stored
+CHECK_STEPS = 1024 # Handlers run between reads of the clock when a machine is given a time budget
+TIME_SLICE = 0.005 # Seconds a machine runs for before run_async lets the other tasks on the event loop have a turn
+SNAPSHOT_MAGIC = b"PCSNAP1\n" # Start of every snapshot, the digit is the version of the format
+PAGE_WORDS = 64 # Words in a page of data memory, snapshots only keep the pages with a word that is not 0
+CHECKPOINT_STEPS = 1 << 24 # Handlers pexec runs between checkpoints
+
+class Halt(Exception): # Raised by the HALT instruction to leave the execution loop
+    pass
+
+class Memory: # Data segment, kept apart from the decoded code segment, memory[address] reads a value back
+    '''
+    Words are a typed array, or a memoryview of a mapped file, so loads and stores need no conversions and unwritten addresses read 0 as in ram.v.
+    Floats and integers too wide for a word, which the processor does not have, are kept in wide and the word is set to WIDE.
+    '''
+    __slots__ = ("words", "wide")
+
+    def __init__(self, words):
+        self.words = words
+        self.wide = {} # key: address, value: float or wide integer stored there
+
+    @classmethod
+    def zeros(cls, size=MEMORY_SIZE):
+        return cls(array(WORD_TYPE, bytes(size * array(WORD_TYPE).itemsize)))
+
+    @classmethod
+    def load(cls, image, size=MEMORY_SIZE): # Map a file of native order words written by save, it is only copied if it is shorter than size words
+        with open(image, "rb") as f:
+            if path.getsize(image) >= size * array(WORD_TYPE).itemsize:
+                return cls(memoryview(mmap(f.fileno(), 0, access=ACCESS_COPY)).cast(WORD_TYPE)) # Stores change the mapping, never the file
+            words = array(WORD_TYPE)
+            words.frombytes(f.read())
+        words.frombytes(bytes((size - len(words)) * words.itemsize))
+        return cls(words)
+
+    def save(self, image): # Write the words to a file Memory.load maps, wide values are not kept
+        with open(image, "wb") as f:
+            f.write(self.words)
+
+    def __getitem__(self, address):
+        value = self.words[address]
+        return self.wide[address] if value == WIDE else value
+
+    def __setitem__(self, address, value): # Store value the same way STR does
+        try:
+            self.words[address] = value
+        except (TypeError, OverflowError, ValueError):
+            self.words[address] = WIDE
+            self.wide[address] = value
+
+    def copy(self): # Memory with the same values that can be changed without changing this one
+        memory = Memory(array(WORD_TYPE, self.words))
+        memory.wide.update(self.wide)
+        return memory
+
+    def __len__(self):
+        return len(self.words)
+
+    def __repr__(self):
+        return f"Memory({ {address: self[address] for address, word in enumerate(self.words) if word} })"
+
+class NoComparison: # Status register contents before the first CMP, no branch condition holds
+
+    def __eq__(self, other):
+        return False
+
+    __ne__ = __gt__ = __lt__ = __eq__
+    __hash__ = None
+
+def decode(memory): # Decode every line of memory once into a tuple of integers
+    '''
+    Registers are replaced by their index and every immediate value is given a slot after r0-r7 in the register file,
+    so an operand is always an index into the register file and never needs parsing again.
+    Blank lines after the last instruction are data and are not decoded.
+    Returns the decoded program and the initial register file.
+    '''
+    register_index = {name: idx for idx, name in enumerate(REGISTER_NAMES)}
+    constants = {} # key: immediate value, value: index in the register file
+
+    def operand(op):
+        if op in register_index: # Register
+            return register_index[op]
+        if is_number(op): # Immediate value or address
+            value = int(op.replace("#", ""))
+            if value not in constants:
+                constants[value] = len(REGISTER_NAMES) + len(constants)
+            return constants[value]
+        raise ValueError(f"Invalid operand {op}")
+
+    end = len(memory)
+    while end and not memory[end-1]:
+        end -= 1
+
+    program = []
+    for line in memory[:end]:
+        try:
+            if line == "HALT":
+                program.append((HALT,))
+                continue
+            opcode, *operands = line.split(" ")
+            opid = OPCODES.get(opcode, INVALID)
+            if opid in ARITHMETIC: # Numerical instruction
+                var, op1, op2 = operands
+                program.append((opid, register_index[var], operand(op1), operand(op2)))
+            elif opid in (LDR, STR, MOV): # Load, store or move instruction
+                reg, ref = operands
+                program.append((opid, register_index[reg], operand(ref)))
+            elif opid == CMP: # Compare instruction
+                lhs, rhs = operands
+                program.append((CMP, operand(lhs), operand(rhs)))
+            elif opid in (BAL, BEQ, BNE, BGT, BLT): # Branch instruction
+                program.append((opid, int(operands[0])))
+            elif opid == PRT: # Print instruction
+                program.append((PRT, operand(operands[0])))
+            else:
+                program.append((INVALID, line))
+        except (ValueError, KeyError): # Malformed operands only raise an error if the line is executed
+            program.append((INVALID, line))
+
+    registers = [None] * len(REGISTER_NAMES) + sorted(constants, key=constants.get)
+    return program, registers
+
+'''Handler factories, each returns a function that executes one decoded instruction and returns the next line number'''
+
+def _halt(registers, memory, status, ln):
+    def step():
+        raise Halt
+    return step
+
+def _arithmetic(opid):
+    def factory(registers, memory, status, ln, var, op1, op2):
+        fn, nxt = ARITHMETIC[opid], ln + 1
+        def step():
+            registers[var] = fn(registers[op1], registers[op2])
+            return nxt
+        return step
+    return factory
+
+def _load(registers, memory, status, ln, reg, ref):
+    nxt, words, wide = ln + 1, memory.words, memory.wide
+    if ref >= len(REGISTER_NAMES): # Absolute address
+        address = registers[ref]
+        def step():
+            value = words[address]
+            registers[reg] = wide[address] if value == WIDE else value
+            return nxt
+    else: # Address held in a register
+        def step():
+            address = registers[ref]
+            value = words[address]
+            registers[reg] = wide[address] if value == WIDE else value
+            return nxt
+    return step
+
+def _store(registers, memory, status, ln, reg, ref):
+    nxt, words, wide = ln + 1, memory.words, memory.wide
+    if ref >= len(REGISTER_NAMES): # Absolute address
+        address = registers[ref]
+        def step():
+            try:
+                words[address] = registers[reg]
+            except (TypeError, OverflowError, ValueError): # Does not fit in a word
+                words[address] = WIDE
+                wide[address] = registers[reg]
+            return nxt
+    else: # Address held in a register
+        def step():
+            address = registers[ref]
+            try:
+                words[address] = registers[reg]
+            except (TypeError, OverflowError, ValueError):
+                words[address] = WIDE
+                wide[address] = registers[reg]
+            return nxt
+    return step
+
+def _move(registers, memory, status, ln, reg, op):
+    nxt = ln + 1
+    def step():
+        registers[reg] = registers[op]
+        return nxt
+    return step
+
+def _compare(registers, memory, status, ln, lhs, rhs): # The comparison itself is made by whichever branch reads the status register
+    nxt = ln + 1
+    def step():
+        status[0] = registers[lhs]
+        status[1] = registers[rhs]
+        return nxt
+    return step
+
+def _branch(registers, memory, status, ln, address):
+    def step():
+        return address
+    return step
+
+def _branch_if_equal(registers, memory, status, ln, address):
+    nxt = ln + 1
+    def step():
+        return address if status[0] == status[1] else nxt
+    return step
+
+def _branch_if_not_equal(registers, memory, status, ln, address):
+    nxt = ln + 1
+    def step():
+        return address if status[0] != status[1] else nxt
+    return step
+
+def _branch_if_greater(registers, memory, status, ln, address):
+    nxt = ln + 1
+    def step():
+        return address if status[0] > status[1] else nxt
+    return step
+
+def _branch_if_less(registers, memory, status, ln, address):
+    nxt = ln + 1
+    def step():
+        return address if status[0] < status[1] else nxt
+    return step
+
+def _print(registers, memory, status, ln, op, write=print): # write is called with each value printed
+    nxt = ln + 1
+    if op >= len(REGISTER_NAMES): # Immediate value
+        value = float(registers[op])
+        def step():
+            write(value)
+            return nxt
+    else:
+        def step():
+            write(registers[op])
+            return nxt
+    return step
+
+def _invalid(registers, memory, status, ln, line):
+    def step():
+        raise SyntaxError(f"Invalid instruction '{line}'")
+    return step
+
+DISPATCH = {HALT: _halt, ADD: _arithmetic(ADD), SUB: _arithmetic(SUB), MUL: _arithmetic(MUL), DIV: _arithmetic(DIV), EXP: _arithmetic(EXP),
+            MOD: _arithmetic(MOD), FDV: _arithmetic(FDV), LSL: _arithmetic(LSL), LSR: _arithmetic(LSR), AND: _arithmetic(AND), LDR: _load, STR: _store, MOV: _move, CMP: _compare, BAL: _branch,
+            BEQ: _branch_if_equal, BNE: _branch_if_not_equal, BGT: _branch_if_greater, BLT: _branch_if_less, PRT: _print, INVALID: _invalid}
+
+'''Superinstructions, each replaces the handler of the first instruction of a common sequence'''
+
+def _compare_and_branch(registers, memory, status, ln, lhs, rhs, condition, address, otherwise):
+    if condition == BEQ:
+        def step():
+            status[0] = a = registers[lhs]
+            status[1] = b = registers[rhs]
+            return address if a == b else otherwise
+    elif condition == BNE:
+        def step():
+            status[0] = a = registers[lhs]
+            status[1] = b = registers[rhs]
+            return address if a != b else otherwise
+    elif condition == BGT:
+        def step():
+            status[0] = a = registers[lhs]
+            status[1] = b = registers[rhs]
+            return address if a > b else otherwise
+    else:
+        def step():
+            status[0] = a = registers[lhs]
+            status[1] = b = registers[rhs]
+            return address if a < b else otherwise
+    return step
+
+def _load_operate_store(registers, memory, status, ln, reg, ref, opid, var, op1, op2, src, dest):
+    fn, nxt, words, wide = ARITHMETIC[opid], ln + 3, memory.words, memory.wide
+    def step():
+        address = registers[ref]
+        value = words[address]
+        registers[reg] = wide[address] if value == WIDE else value
+        registers[var] = fn(registers[op1], registers[op2])
+        address = registers[dest]
+        try:
+            words[address] = registers[src]
+        except (TypeError, OverflowError, ValueError):
+            words[address] = WIDE
+            wide[address] = registers[src]
+        return nxt
+    return step
+
+def _load_load(registers, memory, status, ln, reg1, ref1, reg2, ref2):
+    nxt, words, wide = ln + 2, memory.words, memory.wide
+    def step():
+        address = registers[ref1]
+        value = words[address]
+        registers[reg1] = wide[address] if value == WIDE else value
+        address = registers[ref2]
+        value = words[address]
+        registers[reg2] = wide[address] if value == WIDE else value
+        return nxt
+    return step
+
+def _load_operate(registers, memory, status, ln, reg, ref, opid, var, op1, op2):
+    fn, nxt, words, wide = ARITHMETIC[opid], ln + 2, memory.words, memory.wide
+    def step():
+        address = registers[ref]
+        value = words[address]
+        registers[reg] = wide[address] if value == WIDE else value
+        registers[var] = fn(registers[op1], registers[op2])
+        return nxt
+    return step
+
+def _operate_store(registers, memory, status, ln, opid, var, op1, op2, src, dest):
+    fn, nxt, words, wide = ARITHMETIC[opid], ln + 2, memory.words, memory.wide
+    def step():
+        registers[var] = fn(registers[op1], registers[op2])
+        address = registers[dest]
+        try:
+            words[address] = registers[src]
+        except (TypeError, OverflowError, ValueError):
+            words[address] = WIDE
+            wide[address] = registers[src]
+        return nxt
+    return step
+
+def fuse(program, registers, memory, status, handlers): # Replace handlers at the start of hot instruction sequences with superinstructions
+    '''
+    Every line keeps a handler so branches into the middle of a sequence still work,
+    the superinstruction only changes what runs when execution reaches the first line of the sequence.
+    '''
+    for ln in range(len(program) - 1):
+        first, second = program[ln], program[ln+1]
+        third = program[ln+2] if ln + 2 < len(program) else (INVALID,)
+        if first[0] == CMP and second[0] in CONDITIONAL_BRANCHES: # CMP followed by a conditional branch, and possibly the BAL to the else block
+            otherwise = third[1] if third[0] == BAL else ln + 2
+            handlers[ln] = _compare_and_branch(registers, memory, status, ln, *first[1:], second[0], second[1], otherwise)
+        elif first[0] == LDR and second[0] in ARITHMETIC and third[0] == STR: # Load, operate on and store a value
+            handlers[ln] = _load_operate_store(registers, memory, status, ln, *first[1:], *second, *third[1:])
+        elif first[0] == LDR and second[0] == LDR: # Load both operands
+            handlers[ln] = _load_load(registers, memory, status, ln, *first[1:], *second[1:])
+        elif first[0] == LDR and second[0] in ARITHMETIC: # Load then operate
+            handlers[ln] = _load_operate(registers, memory, status, ln, *first[1:], *second)
+        elif first[0] in ARITHMETIC and second[0] == STR: # Operate then store the result
+            handlers[ln] = _operate_store(registers, memory, status, ln, *first, *second[1:])
+    return handlers
+
+class Machine: # A program with its registers, data segment and program counter, run a slice at a time
+    '''
+    run executes handlers until the program halts or fails, or until a budget of handlers or seconds is spent,
+    and returns with the state intact so the next call carries on from the same instruction.
+    A superinstruction is one handler however many instructions it runs. What the program prints is kept in output
+    until take_output or flush collects it, rather than being printed one line at a time.
+    '''
+    __slots__ = ("program", "registers", "data", "status", "handlers", "output", "ln", "halted", "error")
+
+    def __init__(self, memory, data=None, decoded=None):
+        '''memory holds the assembly lines, data is the data segment, a new one if None, and decoded is decode(memory) if it has already been decoded.'''
+        self.program, self.registers = decode(memory) if decoded is None else (decoded[0], list(decoded[1]))
+        program = self.program
+        self.data = Memory.zeros(max(MEMORY_SIZE, len(memory or program))) if data is None else data
+        self.status = [NoComparison(), NoComparison()] # Operands of the last comparison, each branch checks its own condition
+        self.output = [] # Values printed since the output was last collected
+        handlers = [DISPATCH[instruction[0]](self.registers, self.data, self.status, ln, *instruction[1:]) for ln, instruction in enumerate(program)]
+        for ln, instruction in enumerate(program):
+            if instruction[0] == PRT: # Never the start of a superinstruction
+                handlers[ln] = _print(self.registers, self.data, self.status, ln, *instruction[1:], write=self.output.append)
+        self.handlers = fuse(program, self.registers, self.data, self.status, handlers)
+        self.ln = 0 # Line of the next instruction
+        self.halted = False
+        self.error = None # Message of the error that stopped the program
+
+    @property
+    def stopped(self):
+        return self.halted or self.error is not None
+
+    def run(self, steps=None, seconds=None): # Returns True once the program has halted or failed
+        '''
+        Runs at most steps handlers and for about seconds, the clock is only read every CHECK_STEPS handlers.
+        With neither it runs to the end in the same loop as before there were budgets, which has nothing to count.
+        '''
+        if self.stopped:
+            return True
+        handlers, ln = self.handlers, self.ln
+        deadline = None if seconds is None else perf_counter() + seconds
+        try:
+            if steps is None and deadline is None:
+                while True:
+                    ln = handlers[ln]()
+            while steps is None or steps > 0:
+                chunk = CHECK_STEPS if steps is None else min(steps, CHECK_STEPS)
+                steps = None if steps is None else steps - chunk
+                while chunk: # Counting down is cheaper than a for loop over a range
+                    ln = handlers[ln]()
+                    chunk -= 1
+                if deadline is not None and perf_counter() >= deadline:
+                    break
+        except Halt:
+            self.halted = True
+        except Exception as err:
+            self.error = f"Error occurred on line {ln}: {err}"
+        finally: # Also keeps the place of a program stopped by KeyboardInterrupt
+            self.ln = ln
+        return self.stopped
+
+    def take_output(self): # The lines printed since the output was last collected
+        lines = [str(value) for value in self.output]
+        self.output.clear()
+        return lines
+
+    def flush(self, file=None): # Write the lines printed since the output was last collected in one go, to stdout if file is None
+        if self.output:
+            print("\n".join(self.take_output()), file=file)
+
+    def fork(self, data=None):
+        '''
+        A new machine that carries on from this one's state with a copy of its data segment, or with data, without decoding the program again.
+        Its output starts empty. Change its registers or data before running it to continue several variants from the same state.
+        '''
+        machine = Machine(None, self.data.copy() if data is None else data, (self.program, [None] * len(REGISTER_NAMES) + self.registers[len(REGISTER_NAMES):]))
+        machine.registers[:len(REGISTER_NAMES)] = self.registers[:len(REGISTER_NAMES)]
+        machine.status[:] = self.status
+        machine.ln, machine.halted, machine.error = self.ln, self.halted, self.error
+        return machine
+
+    def digest(self): # Hash of the decoded program, a snapshot only restores onto the program it was taken from
+        return sha256(repr((self.program, self.registers[len(REGISTER_NAMES):])).encode()).digest()
+
+    def snapshot(self):
+        '''
+        The machine's state as bytes: the program counter, r0-r7, the status register, output not yet collected, whether it has stopped,
+        and the pages of data memory with a word that is not 0, which is all restore needs as unwritten words read 0.
+        Call it between runs, as a run that was interrupted part of the way through an instruction has no state to resume from.
+        '''
+        words = self.data.words
+        pages = {}
+        for start in range(0, len(words), PAGE_WORDS):
+            page = words[start:start+PAGE_WORDS]
+            if any(page):
+                pages[start // PAGE_WORDS] = page.tobytes()
+        status = tuple(... if isinstance(value, NoComparison) else value for value in self.status) # marshal has no NoComparison
+        return SNAPSHOT_MAGIC + marshal.dumps((self.digest(), self.ln, self.halted, self.error, tuple(self.registers[:len(REGISTER_NAMES)]), status,
+                                               list(self.output), len(words), pages, self.data.wide))
+
+    @classmethod
+    def restore(cls, memory, snapshot): # Machine running the assembly lines in memory from the state in snapshot, ready to run again
+        if not snapshot.startswith(SNAPSHOT_MAGIC):
+            raise ValueError("Not a snapshot written by this version of pexec")
+        digest, ln, halted, error, registers, status, output, size, pages, wide = marshal.loads(snapshot[len(SNAPSHOT_MAGIC):])
+        machine = cls(memory, Memory.zeros(size))
+        if digest != machine.digest():
+            raise ValueError("Snapshot was taken from a different program")
+        words = machine.data.words
+        for page, raw in pages.items():
+            values = array(WORD_TYPE)
+            values.frombytes(raw)
+            words[page * PAGE_WORDS:page * PAGE_WORDS + len(values)] = values
+        machine.data.wide.update(wide)
+        machine.registers[:len(REGISTER_NAMES)] = registers
+        machine.status[:] = [NoComparison() if value is ... else value for value in status]
+        machine.output.extend(output)
+        machine.ln, machine.halted, machine.error = ln, halted, error
+        return machine
+
+    def save(self, snapshot_file): # Write a snapshot, replacing the file only once it is complete so a crash never leaves half of one
+        with open(snapshot_file + ".tmp", "wb") as f:
+            f.write(self.snapshot())
+        replace(snapshot_file + ".tmp", snapshot_file)
+
+    @classmethod
+    def load(cls, memory, snapshot_file):
+        with open(snapshot_file, "rb") as f:
+            return cls.restore(memory, f.read())
+
+async def run_async(machine, seconds=TIME_SLICE):
+    '''
+    Runs machine to the end on the running event loop, letting the other tasks have a turn after every slice of seconds,
+    so many programs can be interleaved without one of them starving the rest. Returns the machine, its output is left in it.
+    '''
+    while not machine.run(seconds=seconds):
+        await asyncio.sleep(0)
+    return machine
+
+def run_with_checkpoints(machine, checkpoint_file, steps=CHECKPOINT_STEPS): # Run machine to the end, printing its output and saving a snapshot every steps handlers
+    while not machine.run(steps):
+        machine.flush() # Before the snapshot, so a resumed run does not print it again
+        machine.save(checkpoint_file)
+    machine.flush()
+    machine.save(checkpoint_file)
+    if machine.error is not None:
+        print(machine.error)
+    return machine.data
+
+def execute_assembly_code(memory, data=None): # Run the assembly lines in memory with data as the data segment, returns the data segment
+    return run_assembly_code(memory, data)[1]
+
+def run_assembly_code(memory, data=None): # Same as execute_assembly_code, returning the final values of r0-r7 with the data segment
+    machine = Machine(memory, data)
+    try:
+        machine.run()
+    finally: # What a program printed before it was interrupted is still shown
+        machine.flush()
+    if machine.error is not None:
+        print(machine.error)
+    return machine.registers[:len(REGISTER_NAMES)], machine.data
+
+def count_instructions(memory): # Run the program one instruction at a time, without superinstructions, and return how many it executed
+    program, REGISTERS = decode(memory)
+    data = Memory.zeros(max(MEMORY_SIZE, len(memory)))
+    STATUS_REGISTER = [NoComparison(), NoComparison()]
+    handlers = [DISPATCH[instruction[0]](REGISTERS, data, STATUS_REGISTER, ln, *instruction[1:]) for ln, instruction in enumerate(program)]
+    ln = steps = 0
+    try:
+        while True:
+            ln = handlers[ln]()
+            steps += 1
+    except Halt:
+        steps += 1
+    return steps
+
+def profile_assembly_code(memory):
+    '''
+    Runs the program one instruction at a time like count_instructions, recording where it spends its time.
+    Returns the times each line was executed, [taken, not taken] for each conditional branch line,
+    [loads, stores] for each memory address and (first line, last line) of each loop, found from its backward branch.
+    '''
+    program, REGISTERS = decode(memory)
+    data = Memory.zeros(max(MEMORY_SIZE, len(memory)))
+    STATUS_REGISTER = [NoComparison(), NoComparison()]
+    handlers = [DISPATCH[instruction[0]](REGISTERS, data, STATUS_REGISTER, ln, *instruction[1:]) for ln, instruction in enumerate(program)]
+    executions = [0] * len(program)
+    branches = {ln: [0, 0] for ln, instruction in enumerate(program) if instruction[0] in CONDITIONAL_BRANCHES}
+    references = {ln: (instruction[2], instruction[0] == STR) for ln, instruction in enumerate(program) if instruction[0] in (LDR, STR)}
+    loops = [(instruction[1], ln) for ln, instruction in enumerate(program) if instruction[0] in (BAL,) + CONDITIONAL_BRANCHES and instruction[1] <= ln]
+    accesses = {}
     ln = 0
     try:
         while True:
-            line = memory[ln]
-            if line == "HALT":
-                break
-            opcode, operand = line.split(" ")[0], line.split(" ")[1:]
-            if opcode in NUMERICAL_INSTRUCTIONS: # Numerical instruction
-                var, op1, op2 = operand
-                num1, num2 = (int(op1[1:]) if is_number(op1) else REGISTERS[op1]), (int(op2[1:]) if is_number(op2) else REGISTERS[op2])
-                match opcode:
-                    case "ADD": REGISTERS[var] = num1 + num2
-                    case "SUB": REGISTERS[var] = num1 - num2
-                    case "MUL": REGISTERS[var] = num1 * num2
-                    case "DIV": REGISTERS[var] = num1 / num2
-                    case "EXP": REGISTERS[var] = num1 ** num2
-                    case "MOD": REGISTERS[var] = num1 % num2
-                    case "FDV": REGISTERS[var] = num1 // num2
-                ln += 1
-            elif opcode == "LDR": # Load instruction
-                reg, ref = operand
-                ref = int(ref.replace("#", "")) if is_number(ref) else REGISTERS[ref]
-                REGISTERS[reg] = memory[ref]
-                ln += 1
-            elif opcode == "STR": # Store instruction
-                reg, ref = operand
-                ref = int(ref.replace("#", "")) if is_number(ref) else REGISTERS[ref]
-                memory[ref] = REGISTERS[reg]
-                ln += 1
-            elif opcode == "MOV": # Move instruction
-                reg, op = operand
-                op = int(op.replace("#", "")) if is_number(op) else REGISTERS[op]
-                REGISTERS[reg] = op
-                ln += 1
-            elif opcode == "CMP": # Compare instruction
-                lhs, rhs = operand
-                num1, num2 = (int(lhs[1:]) if is_number(lhs) else REGISTERS[lhs]), (int(rhs[1:]) if is_number(rhs) else REGISTERS[rhs])
-                STATUS_REGISTER = (num1 == num2, num1 != num2, num1 > num2, num1 < num2)
-                ln += 1
-            elif opcode[0] == "B": # Branch instruction
-                address = int(operand[0])
-                if opcode == "BAL":
-                    ln = address
-                elif opcode == "BEQ" and STATUS_REGISTER[0] or opcode == "BNE" and STATUS_REGISTER[1] or \
-                    opcode == "BGT" and STATUS_REGISTER[2] or opcode == "BLT" and STATUS_REGISTER[3]:
-                    ln = address
-                else:
-                    ln += 1
-            elif opcode == "PRT": # Print instruction
-                val = float(operand[0]) if is_number(operand[0]) else REGISTERS[operand[0]]
-                print(val)
-                ln += 1               
+            executions[ln] += 1
+            if ln in references:
+                ref, store = references[ln]
+                accesses.setdefault(REGISTERS[ref], [0, 0])[store] += 1
+            nxt = handlers[ln]()
+            if ln in branches:
+                branches[ln][nxt == ln + 1] += 1
+            ln = nxt
+    except Halt:
+        pass
     except Exception as err:
-        print(memory)
-        print(f"Error occurred on line {ln}: {err}") 
+        print(f"Error occurred on line {ln}: {err}")
+    return executions, branches, accesses, loops
 
 if __name__ in "__main__":
+    options = dict(arg[2:].split("=", 1) for arg in argv[2:] if arg.startswith("--") and "=" in arg) # --memory=<image>, --dump=<image>, --checkpoint=<file>, --every=<handlers> and --resume=<file>
     if "--version" in argv: # Version argument
         print(f"\033[36;1mpexec v0.15\033[0m")
     elif "--help" in argv: # Help argument
-        print("\033[91;1mpexec syntax: pcompile <code file> <output>\033[0m")
-    elif len(argv) != 2: # Not enough arguments
+        print("\033[91;1mpexec syntax: pexec <assembly file> [--profile] [--memory=<image>] [--dump=<image>] [--checkpoint=<file>] [--every=<handlers>] [--resume=<file>]\033[0m")
+    elif len(argv) < 2 or any(arg != "--profile" and arg[2:].split("=")[0] not in ("memory", "dump", "checkpoint", "every", "resume") for arg in argv[2:]): # Incorrect arguments
         print("\033[91;1mpexec: Incorrect number of arguments\033[0m")
     elif not argv[1]: # Blank arguments
         print("\033[91;1mpexec: Some arguments are blank\033[0m")
@@ -82,7 +586,22 @@ if __name__ in "__main__":
             with open(argv[1], "r") as f:
                 memory = f.read().splitlines()
             stime = perf_counter()
-            execute_assembly_code(memory)
-            print(f"\033[92;1mExecution successful, took {perf_counter() - stime} seconds\033[0m")
+            if "--profile" in argv: # Count every instruction, then report the hottest source lines and loops from the compiler's source map
+                profile = profile_assembly_code(memory)
+                seconds = perf_counter() - stime
+                report_profile(*profile, load_source_map(path.splitext(argv[1])[0] + ".map"))
+                print(f"\033[92;1mProfile written to {PROFILE_FILE} and {FOLDED_FILE}, execution took {seconds} seconds\033[0m")
+            else:
+                data = Memory.load(options["memory"]) if "memory" in options else None
+                if "resume" in options or "checkpoint" in options: # Carry on from a snapshot, saving one every so often to carry on from later
+                    machine = Machine.load(memory, options["resume"]) if "resume" in options else Machine(memory, data)
+                    data = run_with_checkpoints(machine, options.get("checkpoint", options.get("resume")), int(options.get("every", CHECKPOINT_STEPS)))
+                else:
+                    data = execute_assembly_code(memory, data)
+                print(f"\033[92;1mExecution successful, took {perf_counter() - stime} seconds\033[0m")
+                if "dump" in options:
+                    data.save(options["dump"])
         except FileNotFoundError as err: # Code file not found
-            print(f"\033[91;1m{err}\033[0m")
\ No newline at end of file
+            print(f"\033[91;1m{err}\033[0m")
+        except ValueError as err: # Snapshot of another program
+            print(f"\033[91;1m{err}\033[0m")
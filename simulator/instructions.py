@@ -0,0 +1,25 @@
+class Label: # Symbolic branch target, bound to a position in the instruction list once it is known
+
+    __slots__ = ("position",)
+
+    def __init__(self, position=None):
+        self.position = position
+
+    def bind(self, position):
+        self.position = position
+
+class Instruction: # Single assembly instruction, branches refer to a Label instead of a line number
+
+    __slots__ = ("opcode", "operands", "target", "line")
+
+    def __init__(self, opcode, *operands, target=None, line=None):
+        self.opcode = opcode
+        self.operands = operands
+        self.target = target
+        self.line = line # Index of the source line the instruction was compiled from, None if it was added by an optimisation
+
+    def __str__(self):
+        return " ".join((self.opcode,) + self.operands)
+
+    def __repr__(self):
+        return f"Instruction({self})"
@@ -0,0 +1,316 @@
+import json
+from sys import argv
+from time import perf_counter
+from array import array
+try:
+    import numpy as np
+except ImportError: # NumPy is only needed by this backend, run_lockstep says so if it is missing
+    np = None
+from executer import (ADD, SUB, MUL, MOD, FDV, LSL, LSR, AND, LDR, STR, MOV, CMP, BAL, BEQ, BNE, BGT, PRT, HALT, INVALID,
+                      ARITHMETIC, CONDITIONAL_BRANCHES, MEMORY_SIZE, REGISTER_NAMES, WORD_TYPE, Machine, Memory, decode)
+
+'''
+Runs one program over many instances at once with NumPy, each instance a lane of the register file, status register and data memory arrays.
+The lanes share one decoded program and move through it together, one NumPy operation per instruction for all of them,
+so the time taken grows with the instructions run rather than with instructions times instances.
+'''
+
+STATUS = -1 # Stands for the status register in find_written
+COMPACT_FRACTION = 8 # Stopped lanes are removed from the arrays once they are at least this fraction of them
+INT64_MIN = -1 << 63
+
+def _add(a, b): # Each returns the result and a mask of the lanes where it differs from Python's, or None if it never does
+    result = a + b
+    return result, ((a ^ result) & (b ^ result)) < 0
+
+def _sub(a, b):
+    result = a - b
+    return result, ((a ^ b) & (a ^ result)) < 0
+
+def _mul(a, b): # Products the float product puts at 2**63 or more may not fit, the float rounds up to exactly 2**63 at worst
+    return a * b, np.abs(a.astype(np.float64) * b) >= 2.0 ** 63
+
+def _mod(a, b): # Python's % and NumPy's remainder both take the sign of the divisor
+    zero = b == 0
+    return np.remainder(a, np.where(zero, 1, b)), zero
+
+def _floor_divide(a, b):
+    invalid = (b == 0) | (a == INT64_MIN) & (b == -1)
+    return np.floor_divide(a, np.where(invalid, 1, b)), invalid
+
+def _shift_left(a, b):
+    invalid = (b < 0) | (b > 62)
+    shift = np.where(invalid, 0, b)
+    result = np.left_shift(a, shift)
+    return result, invalid | (np.right_shift(result, shift) != a)
+
+def _shift_right(a, b): # Shifting by 63 or more gives 0 or -1 as it does in Python
+    return np.right_shift(a, np.clip(b, 0, 63)), b < 0
+
+def _and(a, b):
+    return a & b, None
+
+VECTOR_ARITHMETIC = {ADD: _add, SUB: _sub, MUL: _mul, MOD: _mod, FDV: _floor_divide, LSL: _shift_left, LSR: _shift_right, AND: _and}
+
+def find_written(program):
+    '''
+    Returns (reads, written), the registers each line reads and the registers written on every path to each line, None for lines
+    no path reaches. STATUS stands for the status register, written by CMP and read by the conditional branches.
+    '''
+    reads, writes, successors = [], [], []
+    for ln, instruction in enumerate(program):
+        opid, operands = instruction[0], instruction[1:]
+        if opid in ARITHMETIC or opid in (LDR, MOV):
+            reads.append(operands[1:]), writes.append(operands[0])
+        elif opid == CMP:
+            reads.append(operands), writes.append(STATUS)
+        elif opid in (STR, PRT):
+            reads.append(operands), writes.append(None)
+        elif opid in CONDITIONAL_BRANCHES:
+            reads.append((STATUS,)), writes.append(None)
+        else:
+            reads.append(()), writes.append(None)
+        if opid == BAL:
+            successors.append((operands[0],))
+        elif opid in CONDITIONAL_BRANCHES:
+            successors.append((operands[0], ln + 1))
+        elif opid in (HALT, INVALID):
+            successors.append(())
+        else:
+            successors.append((ln + 1,))
+
+    written = [None] * len(program)
+    if program:
+        written[0], work = frozenset(), [0]
+    else:
+        work = []
+    while work:
+        ln = work.pop()
+        after = written[ln] | {writes[ln]} - {None}
+        for succ in successors[ln]:
+            if 0 <= succ < len(program) and (written[succ] is None or not after >= written[succ]):
+                written[succ] = after if written[succ] is None else written[succ] & after
+                work.append(succ)
+    return reads, written
+
+def reads_unwritten(program):
+    '''
+    True if some path through the program reads a register before anything writes it, or branches before the first CMP.
+    The executer raises an error or finds no comparison, which lanes of int64 have no way to show.
+    '''
+    reads, written = find_written(program)
+    return any(operand not in written[ln] for ln in range(len(program)) if written[ln] is not None
+               for operand in reads[ln] if operand < len(REGISTER_NAMES))
+
+class Lockstep: # Register file, status register and data memory of every lane, a column each, with the line each lane is on
+    '''
+    Each step runs the instruction at the lowest line any lane is on, for the lanes on it, so lanes that branch apart wait
+    for the others and join them again where their paths meet. While every lane is on the same line the step works on whole rows
+    and no masks are made. Lanes that halt, or that would do anything the int64 lanes cannot do exactly as the executer does
+    (overflow, divide by zero, produce a float, use an address outside memory), stop, the latter to be run again by the executer.
+    '''
+
+    def __init__(self, program, constants, words, tracked=()):
+        '''constants is the register file of every lane, a list per register, and tracked the registers to note which lanes write.'''
+        self.program = program
+        self.halted = len(program) + 1 # Line of lanes that have halted, so they are never the lowest
+        self.fallback = len(program) + 2 # Line of lanes to run again in the executer
+        self.registers = np.zeros((len(constants), len(constants[0])), dtype=np.int64)
+        self.registers[len(REGISTER_NAMES):] = constants[len(REGISTER_NAMES):]
+        self.status = np.zeros((2, self.registers.shape[1]), dtype=np.int64)
+        self.data = np.repeat(np.asarray(words, dtype=np.int64)[:, None], self.registers.shape[1], axis=1) # data[address, lane]
+        self.lines = np.zeros(self.registers.shape[1], dtype=np.int64)
+        self.lanes = np.arange(self.registers.shape[1]) # Lane each column holds
+        self.columns = np.arange(self.registers.shape[1])
+        self.printed = [] # (lanes, values, immediate) for each PRT run
+        self.results = {} # key: lane, value: (r0-r7, data) of lanes that halted
+        self.stopped = set() # Lanes to run again in the executer
+        self.tracked = tracked # Registers some lanes may halt without writing, which the executer leaves as None
+        self.assigned = np.zeros((len(REGISTER_NAMES), self.registers.shape[1]), dtype=bool)
+        self.varying = {idx for idx in range(len(REGISTER_NAMES), len(constants)) if any(value != constants[idx][0] for value in constants[idx])}
+
+    def __fallback_where(self, invalid, ln): # Next line of each lane, lanes where invalid is True go to fallback
+        if invalid is None or not invalid.any():
+            return ln + 1
+        return np.where(invalid, self.fallback, ln + 1)
+
+    def __addresses(self, ref, idx): # (address of each lane, mask of the addresses outside memory or None, columns to index data with)
+        if ref >= len(REGISTER_NAMES) and ref not in self.varying: # The same address in every lane, a row of data
+            address = int(self.registers[ref, 0])
+            return address, None if 0 <= address < len(self.data) else True, idx
+        address = self.registers[ref, idx]
+        invalid = (address < 0) | (address >= len(self.data)) # Negative addresses count from the end in the executer
+        return np.where(invalid, 0, address), invalid, self.columns if isinstance(idx, slice) else idx
+
+    def __target(self, address): # Branches outside the program are an error in the executer
+        return address if 0 <= address < len(self.program) else self.fallback
+
+    def execute(self, ln, idx): # Run line ln for the columns in idx, a slice for all of them, returns the next line of all of them or of each
+        instruction = self.program[ln]
+        opid, registers = instruction[0], self.registers
+        if opid in VECTOR_ARITHMETIC:
+            _, var, op1, op2 = instruction
+            registers[var, idx], invalid = VECTOR_ARITHMETIC[opid](registers[op1, idx], registers[op2, idx])
+            if var in self.tracked:
+                self.assigned[var, idx] = True
+            return self.__fallback_where(invalid, ln)
+        if opid == MOV:
+            registers[instruction[1], idx] = registers[instruction[2], idx]
+            if instruction[1] in self.tracked:
+                self.assigned[instruction[1], idx] = True
+            return ln + 1
+        if opid == CMP:
+            self.status[0, idx] = registers[instruction[1], idx]
+            self.status[1, idx] = registers[instruction[2], idx]
+            return ln + 1
+        if opid in (LDR, STR):
+            _, reg, ref = instruction
+            address, invalid, columns = self.__addresses(ref, idx)
+            if invalid is True:
+                return self.fallback
+            if opid == LDR:
+                registers[reg, idx] = self.data[address, columns]
+                if reg in self.tracked:
+                    self.assigned[reg, idx] = True
+            elif invalid is None:
+                self.data[address, columns] = registers[reg, idx]
+            else:
+                valid = ~invalid
+                self.data[address[valid], columns[valid]] = registers[reg, idx][valid]
+            return self.__fallback_where(invalid, ln)
+        if opid == BAL:
+            return self.__target(instruction[1])
+        if opid in CONDITIONAL_BRANCHES:
+            lhs, rhs = self.status[0, idx], self.status[1, idx]
+            taken = lhs == rhs if opid == BEQ else lhs != rhs if opid == BNE else lhs > rhs if opid == BGT else lhs < rhs
+            if taken.all():
+                return self.__target(instruction[1])
+            if not taken.any():
+                return ln + 1
+            return np.where(taken, self.__target(instruction[1]), ln + 1)
+        if opid == PRT:
+            self.printed.append((self.lanes[idx], registers[instruction[1], idx].copy(), instruction[1] >= len(REGISTER_NAMES)))
+            return ln + 1
+        if opid == HALT:
+            return self.halted
+        return self.fallback # DIV and EXP give floats, and invalid instructions raise an error
+
+    def run(self):
+        end = len(self.program)
+        while len(self.lines):
+            ln = int(self.lines.min())
+            if ln >= self.halted:
+                self.compact()
+                break
+            at = self.lines == ln
+            if at.all(): # Every lane is on the same line, run whole rows until they branch apart or stop
+                while True:
+                    nxt = self.execute(ln, slice(None))
+                    if not isinstance(nxt, int) or nxt >= end:
+                        break
+                    ln = nxt
+                self.lines[:] = np.where(nxt == end, self.fallback, nxt) # Running off the end is an error in the executer
+            else:
+                idx = np.flatnonzero(at)
+                nxt = self.execute(ln, idx)
+                self.lines[idx] = np.where(np.equal(nxt, end), self.fallback, nxt)
+            if isinstance(nxt, int) and nxt < end:
+                continue
+            if np.count_nonzero(self.lines >= self.halted) * COMPACT_FRACTION >= len(self.lines):
+                self.compact()
+
+    def compact(self): # Keep the results of the lanes that have stopped and remove their columns
+        stopped = self.lines >= self.halted
+        for column in np.flatnonzero(stopped):
+            lane = int(self.lanes[column])
+            if self.lines[column] == self.fallback:
+                self.stopped.add(lane)
+                continue
+            words = array(WORD_TYPE)
+            words.frombytes(self.data[:, column].tobytes())
+            registers = self.registers[:len(REGISTER_NAMES), column].tolist()
+            for reg in self.tracked:
+                if not self.assigned[reg, column]:
+                    registers[reg] = None
+            self.results[lane] = (registers, Memory(words))
+        running = ~stopped
+        self.registers, self.status, self.data = self.registers[:, running], self.status[:, running], self.data[:, running]
+        self.lines, self.lanes, self.assigned = self.lines[running], self.lanes[running], self.assigned[:, running]
+        self.columns = np.arange(len(self.lines))
+
+def run_lockstep(memory, lanes=None, constants=None, data=None):
+    '''
+    Runs the assembly lines in memory once per lane, returning a dict for each lane in order with the lines it printed
+    (and the error that stopped it, as pipeline.execute gives them), r0-r7, the data segment and whether it was run by the executer instead.
+    constants maps an immediate value in the program to the value it has in each lane, every operand with that value changes,
+    addresses included, and lanes is the number of lanes when no constants are given. Every lane starts from the data Memory, 0 if None.
+    Lanes that stop for something the int64 lanes cannot do are run again from the start by the executer, as are all of them if the
+    program may read a register before writing it. Registers the program never writes are None, as they are in the executer.
+    '''
+    if np is None:
+        raise ImportError("The lockstep executer needs NumPy, install it with: pip install numpy")
+    program, registers = decode(memory)
+    constants = {value: list(values) for value, values in (constants or {}).items()}
+    count = len(next(iter(constants.values()))) if constants else lanes
+    if not count or any(len(values) != count for values in constants.values()):
+        raise ValueError("Every lane needs a value for each constant")
+    slots = {value: idx for idx, value in enumerate(registers) if idx >= len(REGISTER_NAMES)}
+    missing = [value for value in constants if value not in slots]
+    if missing:
+        raise ValueError(f"Constants {missing} are not immediate values in the program")
+    columns = [[0] * count] * len(REGISTER_NAMES) + [constants.get(value, [value] * count) for value in registers[len(REGISTER_NAMES):]]
+    data = Memory.zeros(max(MEMORY_SIZE, len(memory))) if data is None else data
+
+    written = {instruction[1] for instruction in program if instruction[0] in ARITHMETIC or instruction[0] in (LDR, MOV)}
+    halts = [before for instruction, before in zip(program, find_written(program)[1]) if instruction[0] == HALT and before is not None]
+    machine = Lockstep(program, columns, data.words, written - frozenset.intersection(*halts) if halts else written)
+    if reads_unwritten(program) or data.wide: # Values the lanes cannot hold
+        machine.stopped = set(range(count))
+    else:
+        machine.run()
+
+    results = [{"output": [], "registers": None, "data": None, "fallback": lane in machine.stopped} for lane in range(count)]
+    for lanes, values, immediate in machine.printed:
+        for lane, value in zip(lanes.tolist(), values.tolist()):
+            results[lane]["output"].append(str(float(value)) if immediate else str(value))
+    for lane, (lane_registers, lane_data) in machine.results.items():
+        results[lane]["registers"] = [value if idx in written else None for idx, value in enumerate(lane_registers)]
+        results[lane]["data"] = lane_data
+    for lane in sorted(machine.stopped):
+        scalar = Machine(None, data.copy(), (program, [None] * len(REGISTER_NAMES) + [column[lane] for column in columns[len(REGISTER_NAMES):]]))
+        scalar.run()
+        results[lane].update(output=scalar.take_output() + ([] if scalar.error is None else [scalar.error]),
+                             registers=scalar.registers[:len(REGISTER_NAMES)], data=scalar.data)
+    return results
+
+def parse_sweep(sweep): # <value>=<start>:<stop>[:<step>] -> (value, the values of range(start, stop, step))
+    value, bounds = sweep.split("=")
+    return int(value), range(*map(int, bounds.split(":")))
+
+if __name__ in "__main__":
+    options = dict(arg[2:].split("=", 1) for arg in argv[2:] if arg.startswith("--") and "=" in arg and not arg.startswith("--sweep="))
+    sweeps = [arg[len("--sweep="):] for arg in argv[2:] if arg.startswith("--sweep=")] # --sweep=<value>=<start>:<stop>[:<step>] can be given more than once
+    if "--version" in argv: # Version argument
+        print(f"\033[36;1mplockstep v0.15\033[0m")
+    elif "--help" in argv: # Help argument
+        print("\033[91;1mplockstep syntax: plockstep <assembly file> [--sweep=<value>=<start>:<stop>[:<step>]] [--lanes=<count>] [--memory=<image>]\033[0m")
+    elif len(argv) < 2 or len(options) + len(sweeps) != len(argv) - 2 or any(option not in ("lanes", "memory") for option in options) \
+         or not sweeps and "lanes" not in options: # Incorrect arguments
+        print("\033[91;1mplockstep: Incorrect number of arguments\033[0m")
+    elif not argv[1]: # Blank arguments
+        print("\033[91;1mplockstep: Some arguments are blank\033[0m")
+    else:
+        try:
+            with open(argv[1], "r") as f:
+                memory = f.read().splitlines()
+            constants = dict(parse_sweep(sweep) for sweep in sweeps)
+            stime = perf_counter()
+            results = run_lockstep(memory, int(options.get("lanes", 0)) or None, constants, Memory.load(options["memory"]) if "memory" in options else None)
+            seconds = perf_counter() - stime
+            for lane, result in enumerate(results):
+                print(json.dumps({"lane": lane, "constants": {value: values[lane] for value, values in constants.items()},
+                                  "output": result["output"], "registers": result["registers"], "fallback": result["fallback"]}))
+            fallbacks = sum(result["fallback"] for result in results)
+            print(f"\033[92;1mRan {len(results)} lanes in {seconds} seconds, {fallbacks} of them in the executer\033[0m")
+        except (FileNotFoundError, ImportError, ValueError) as err: # Assembly file or NumPy missing, or a bad sweep
+            print(f"\033[91;1m{err}\033[0m")
@@ -0,0 +1,335 @@
+from collections import Counter
+from instructions import Instruction, Label
+from peephole import Program, ARITHMETIC, BRANCHES, REGISTER_BITS, is_immediate, is_register, registers_read, register_written
+
+HOISTABLE = ("ADD", "SUB", "MUL", "LSL", "LSR", "AND", "MOV", "LDR") # Never raise an error, so they can run before a loop whose body never runs
+
+def insert(assembly_code, position, instructions, keep=(), branches=None): # Insert instructions before position
+    '''
+    Labels at or after position move with the code that was there, except labels in keep
+    which are left pointing at the first inserted instruction. branches saves looking through the code for the labels.
+    '''
+    labels = {id(instruction.target): instruction.target for instruction in branches or assembly_code if instruction.target is not None}
+    for label in labels.values():
+        if label.position is not None and (label.position > position or label.position == position and label not in keep):
+            label.position += len(instructions)
+    assembly_code[position:position] = instructions
+
+def value_operands(instruction): # Indices of the operands read as values
+    '''The address of a register indirect LDR or STR is not included, the processor takes it from the result of the previous instruction.'''
+    if instruction.opcode in ARITHMETIC or instruction.opcode == "MOV":
+        return range(1, len(instruction.operands))
+    if instruction.opcode in ("CMP", "PRT"):
+        return range(len(instruction.operands))
+    if instruction.opcode == "STR":
+        return range(1)
+    return range(0)
+
+def find_loops(program): # (header, end) of every loop, ordered by where they end so inner loops come before the loops around them
+    ends = {} # key: header, value: last backward branch to it
+    for ln in program.positions:
+        instruction = program.code[ln]
+        if instruction.opcode in BRANCHES and program.landing(instruction) <= ln:
+            header = program.landing(instruction)
+            ends[header] = max(ends.get(header, ln), ln)
+    return sorted(ends.items(), key=lambda loop: (loop[1], -loop[0]))
+
+class Loop: # Instructions from the header of a loop to its backward branch
+
+    def __init__(self, program, header, end, branches):
+        self.program = program
+        self.branches = branches # Every branch in the program, the loop pass never adds or removes one
+        self.header, self.end = header, end
+        self.body = [ln for ln in program.positions if header <= ln <= end]
+        self.defs = Counter(register_written(program.code[ln]) for ln in self.body) # key: register, value: number of instructions writing it
+        self.used = {reg for ln in self.body for reg in registers_read(program.code[ln])} | set(self.defs)
+        self.stored = {program.code[ln].operands[1] for ln in self.body if program.code[ln].opcode == "STR"} # Addresses written to
+        self.exits = {succ for ln in self.body for succ in program.successors(ln) if succ not in self}
+
+    def __contains__(self, ln):
+        return self.header <= ln <= self.end
+
+    def inside(self): # Ids of the instructions in the loop
+        return {id(self.program.code[ln]) for ln in self.body}
+
+    def has_single_entry(self): # Code outside the loop only branches to the header
+        inside = self.inside() # A branch lands between the header and the end exactly when its label is after the header
+        return all(id(branch) in inside or not self.header < branch.target.position <= self.end for branch in self.branches)
+
+    def is_invariant(self, operand): # Operand has the same value on every iteration
+        return is_immediate(operand) or is_register(operand) and not self.defs[operand]
+
+    def is_live_after(self, reg): # Value of reg may be read once the loop has been left
+        return any(self.program.is_live(reg, ln) for ln in self.exits)
+
+    def free_registers(self): # Registers the loop does not use and whose value is not needed during or after it
+        return [reg for reg in REGISTER_BITS if reg not in self.used and not self.program.is_live(reg, self.header)]
+
+    def add_preheader(self, instructions): # Insert instructions that run once each time the loop is entered
+        back_edge = Label(self.header)
+        keep, inside = set(), self.inside()
+        for branch in self.branches:
+            if branch.target.position <= self.header and self.program.landing(branch) == self.header:
+                if id(branch) in inside: # Later iterations skip the preheader
+                    branch.target = back_edge
+                else:
+                    keep.add(branch.target)
+        insert(self.program.code, self.header, instructions, keep, self.branches)
+
+'''Loop invariant code motion'''
+
+def hoist_invariants(loop): # Calculate values that are the same on every iteration once before the loop
+    '''
+    Each hoisted instruction is replaced by a MOV from a register the loop does not use, and later reads in the
+    same basic block read that register directly so the MOV can often be removed afterwards.
+    Loads are only hoisted from absolute addresses the loop never stores to, array stores only write the array range.
+    Returns the instructions added before the loop and (MOV, original opcode, original operands) for each instruction replaced.
+    '''
+    program, code = loop.program, loop.program.code
+    free = loop.free_registers()
+    preheader, moves = [], []
+    hoisted = {} # key: (opcode, operands), value: register holding the result
+    known = {} # key: register, value: invariant register holding the same value, valid until the end of the basic block
+    for ln in loop.body:
+        if ln in program.targets:
+            known.clear()
+        instruction = code[ln]
+        operands = list(instruction.operands)
+        for idx in value_operands(instruction):
+            operands[idx] = known.get(operands[idx], operands[idx])
+        instruction.operands = tuple(operands)
+
+        dest = register_written(instruction)
+        if dest is None:
+            continue
+        known.pop(dest, None)
+        if instruction.opcode not in HOISTABLE:
+            continue
+        sources = instruction.operands[1:]
+        if instruction.opcode == "LDR":
+            invariant = not is_register(sources[0]) and sources[0] not in loop.stored
+        else:
+            invariant = all(loop.is_invariant(op) for op in sources)
+        if not invariant:
+            continue
+        if instruction.opcode == "MOV" and is_register(sources[0]): # Already a copy of an invariant register
+            known[dest] = sources[0]
+            continue
+        nxt = code[program.following(ln)]
+        if instruction.opcode == "MOV" and nxt.opcode in ("LDR", "STR") and nxt.operands[1] == dest: # Left for the peephole optimiser to make an absolute address
+            continue
+        key = (instruction.opcode,) + sources
+        if key not in hoisted:
+            if not free:
+                continue
+            hoisted[key] = free.pop(0)
+            preheader.append(Instruction(instruction.opcode, hoisted[key], *sources))
+        moves.append((instruction, instruction.opcode, instruction.operands))
+        instruction.opcode, instruction.operands = "MOV", (dest, hoisted[key])
+        known[dest] = hoisted[key]
+
+    if preheader:
+        loop.add_preheader(preheader)
+    return preheader, moves
+
+def remove_dead(assembly_code, instructions, region, outside): # Remove any of instructions, all in region, whose result is never read
+    program = Program(assembly_code, region=region, outside=outside)
+    candidates = {id(instruction) for instruction in instructions}
+    for ln in program.positions:
+        if id(assembly_code[ln]) in candidates and program.is_dead(register_written(assembly_code[ln]), ln):
+            program.remove(ln)
+
+def restore_unprofitable(assembly_code, header, end, preheader, moves): # Undo hoisting that left a MOV as costly as the original instruction
+    '''
+    A hoisted value is put back when every read of it in the loop is still a MOV, unless it was a load which stalls the processor.
+    Reads renamed to the hoisted register by hoist_invariants count too, in the loop and in the preheader, where a value hoisted
+    after it reads it, so a value is only put back once nothing but its own MOVs reads the register it was hoisted to.
+    Returns the number of instructions removed from the preheader.
+    '''
+    removed = 0
+    changed = True
+    while changed: # Putting an instruction back can make it read another hoisted value
+        changed = False
+        reads = Counter(reg for instruction in assembly_code[header:end+1] for reg in registers_read(instruction))
+        reads.update(reg for hoisted in preheader for reg in registers_read(hoisted))
+        movs = Counter(instruction.operands[1] for instruction, _, _ in moves if instruction.opcode == "MOV")
+        for instruction, opcode, _ in moves:
+            if instruction.opcode == "MOV" and opcode != "LDR" and reads[reg := instruction.operands[1]] == movs[reg]:
+                for hoisted in preheader:
+                    if hoisted.opcode != "PASS" and hoisted.operands[0] == reg:
+                        hoisted.opcode, hoisted.operands = "PASS", ()
+                        removed += 1
+                for other, opcode, operands in moves:
+                    if other.opcode == "MOV" and other.operands[1] == reg:
+                        other.opcode, other.operands = opcode, operands
+                changed = True
+                break
+    return removed
+
+'''Induction variables'''
+
+def affine(value, instruction, source, loop): # Apply instruction to value = (scale, offset, invariant register added), None if the result is not of that form
+    scale, offset, base = value
+    opcode, (_, *ops) = instruction.opcode, instruction.operands
+    if opcode in ("ADD", "MUL") and ops[1] == source:
+        ops.reverse()
+    if len(ops) != 2 or ops[0] != source or ops[1] == source or not loop.is_invariant(ops[1]):
+        return None
+    if is_register(ops[1]): # Only an invariant register can be added, and only once
+        return (scale, offset, ops[1]) if opcode == "ADD" and base is None else None
+    constant = int(ops[1][1:])
+    match opcode:
+        case "ADD":
+            return scale, offset + constant, base
+        case "SUB":
+            return scale, offset - constant, base
+        case "LSL" if base is None:
+            return scale << constant, offset << constant, base
+        case "MUL" if base is None and constant:
+            return scale * constant, offset * constant, base
+    return None
+
+def follow_chain(loop, start, iv): # Instructions from start that calculate scale * iv + offset + base, with (scale, offset, base)
+    program, code = loop.program, loop.program.code
+    value = affine((1, 0, None), code[start], iv, loop)
+    if value is None:
+        return None
+    chain, reg = [start], code[start].operands[0]
+    while (nxt := program.following(chain[-1])) in loop and nxt not in program.targets: # Extend while the value only feeds the next instruction
+        instruction = code[nxt]
+        if reg not in registers_read(instruction) or register_written(instruction) != reg and not program.is_dead(reg, nxt):
+            break
+        new = affine(value, instruction, reg, loop)
+        if new is None:
+            break
+        chain.append(nxt)
+        value, reg = new, instruction.operands[0]
+    return chain, value
+
+def scaled(dest, source, scale, offset, base): # Instructions setting dest to scale * source + offset + base
+    instructions = [] if dest == source else [Instruction("MOV", dest, source)]
+    if scale != 1:
+        instructions.append(Instruction("MUL", dest, dest, f"#{scale}"))
+    if offset:
+        instructions.append(Instruction("ADD" if offset > 0 else "SUB", dest, dest, f"#{abs(offset)}"))
+    if base is not None:
+        instructions.append(Instruction("ADD", dest, dest, base))
+    return instructions
+
+def rebase_induction_variable(loop): # Replace address calculations from a loop counter with the counter itself
+    '''
+    A counter iv that is only changed by adding an invariant step and whose value is not needed after the loop is
+    rebased to scale * iv + offset + base when every calculation from it gives that value. The calculations become a MOV,
+    the step and any comparisons against invariant values are scaled to match.
+    Returns the number of instructions added before the loop, or None if no counter could be rebased.
+    '''
+    program, code = loop.program, loop.program.code
+    for iv in sorted(reg for reg, count in loop.defs.items() if reg is not None and count == 1):
+        update = next(ln for ln in loop.body if register_written(code[ln]) == iv)
+        opcode, ops = code[update].opcode, list(code[update].operands[1:])
+        if opcode == "ADD" and ops[1] == iv:
+            ops.reverse()
+        if opcode not in ("ADD", "SUB") or ops[0] != iv or ops[1] == iv or not loop.is_invariant(ops[1]) or loop.is_live_after(iv):
+            continue
+        step = ops[1]
+
+        chains, compares = [], []
+        for ln in loop.body:
+            if ln == update or iv not in registers_read(code[ln]):
+                continue
+            if code[ln].opcode == "CMP":
+                other = [op for op in code[ln].operands if op != iv]
+                if len(other) != 1 or not loop.is_invariant(other[0]):
+                    break
+                compares.append(ln)
+            elif (chain := follow_chain(loop, ln, iv)) is not None:
+                chains.append(chain)
+            else:
+                break
+        else:
+            if not chains or len({value for _, value in chains}) != 1 or all(len(chain) == 1 for chain, _ in chains):
+                continue # Nothing to remove
+            scale, offset, base = chains[0][1]
+
+            free = loop.free_registers()
+            preheader = scaled(iv, iv, scale, offset, base)
+            if scale != 1 and is_register(step): # Step has to be scaled before the loop
+                if not free:
+                    continue
+                new_step = free.pop(0)
+                preheader += scaled(new_step, step, scale, 0, None)
+            else:
+                new_step = f"#{int(step[1:]) * scale}" if scale != 1 else step
+
+            bounds = {} # key: value compared against, value: the same value after rebasing
+            readers = Counter(reg for ln in loop.body for reg in registers_read(code[ln]))
+            for ln in compares:
+                bound = next(op for op in code[ln].operands if op != iv)
+                if bound in bounds:
+                    continue
+                if is_immediate(bound) and base is None:
+                    if (constant := int(bound[1:]) * scale + offset) < 0:
+                        break
+                    bounds[bound] = f"#{constant}"
+                elif is_register(bound) and readers[bound] == sum(bound in code[other].operands for other in compares) \
+                        and not loop.is_live_after(bound) and bound not in (step, base):
+                    bounds[bound] = bound # Only read by the comparisons, so it can be changed in place
+                    preheader += scaled(bound, bound, scale, offset, base)
+                elif free:
+                    bounds[bound] = free.pop(0)
+                    if is_immediate(bound):
+                        preheader.append(Instruction("MOV", bounds[bound], bound))
+                        preheader += scaled(bounds[bound], bounds[bound], scale, offset, base)
+                    else:
+                        preheader += scaled(bounds[bound], bound, scale, offset, base)
+                else:
+                    break
+            else:
+                for chain, _ in chains:
+                    for ln in chain[:-1]:
+                        program.remove(ln)
+                    code[chain[-1]].opcode, code[chain[-1]].operands = "MOV", (code[chain[-1]].operands[0], iv)
+                for ln in compares:
+                    code[ln].operands = tuple(op if op == iv else bounds[op] for op in code[ln].operands)
+                code[update].operands = (iv, iv, new_step)
+                loop.add_preheader(preheader)
+                return len(preheader)
+    return None
+
+def optimise_loops(assembly_code): # Returns the number of instructions hoisted out of loops and of induction variables rebased
+    '''
+    Loops are the code between a header and the last backward branch to it, they are processed innermost first
+    so anything hoisted from an inner loop can then be hoisted out of the loops around it.
+    Liveness is worked out for the whole program once. After that each analysis only covers the loop being changed and reads
+    the registers live after it from the first one, which stays safe as changing a loop never makes more registers live outside it.
+    '''
+    if not assembly_code:
+        return 0, 0
+    hoisted = rebased = 0
+    outside = Program(assembly_code).live_registers() # key: id(instruction), value: registers live into it before any loop changed
+    inserted = 0 # Instructions added so far, all before the ends of the loops still to be processed
+    branches = [instruction for instruction in assembly_code if instruction.opcode in BRANCHES]
+    for header, end in find_loops(Program(assembly_code, liveness=False)): # Transformations keep the number and order of the loops
+        end += inserted
+        header = assembly_code[end].target.position # The loop's branch still goes to its header
+        while assembly_code[header].opcode == "PASS":
+            header += 1
+        program = Program(assembly_code, region=(header, end), outside=outside)
+        loop = Loop(program, header, end, branches)
+        if not loop.has_single_entry():
+            continue
+        before = [(assembly_code[ln].opcode, assembly_code[ln].operands) for ln in loop.body]
+        preheader, moves = hoist_invariants(loop)
+        if preheader:
+            header, end, inserted = header + len(preheader), end + len(preheader), inserted + len(preheader)
+            remove_dead(assembly_code, [instruction for instruction, _, _ in moves], (header, end), outside)
+            hoisted += len(preheader) - restore_unprofitable(assembly_code, header, end, preheader, moves)
+            program = None
+        elif before != [(assembly_code[ln].opcode, assembly_code[ln].operands) for ln in loop.body]: # Copies were renamed
+            program = None
+        while (added := rebase_induction_variable(Loop(program := program or Program(assembly_code, region=(header, end), outside=outside),
+                                                       header, end, branches))) is not None:
+            header, end, inserted = header + added, end + added, inserted + added
+            rebased += 1
+            program = None
+    return hoisted, rebased
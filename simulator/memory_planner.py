@@ -0,0 +1,153 @@
+import re
+import json
+from heapq import heappush, heappop
+from code_parser import If, While, For, ArrayDeclaration, ArrayAssignment, Assignment, Print
+from convert_expressions import is_number
+
+NAME_PATTERN = re.compile(r"[A-Za-z_]\w*") # Variable and array names in an expression
+ARRAY_ALIGNMENT = 1 # Arrays start at a multiple of this, the RAM reads any word in a single access so they are packed by default
+
+class MemoryPlan:
+    __slots__ = ("variables", "arrays", "entries", "start", "end", "peak")
+
+    def __init__(self, start):
+        self.variables = {} # key: variable name, value: address
+        self.arrays = {} # key: (array name, source line it is declared on), value: (address, size of array)
+        self.entries = [] # (name, "variable" or "array", address, words, first source line, last source line) in address order
+        self.start = start # First address of the data memory
+        self.end = start # First address after everything in the plan
+        self.peak = 0 # Most words in use at the same time
+
+    @property
+    def words(self): # Words of data memory the program touches
+        return self.end - self.start
+
+    def addresses(self, names): # The addresses the plan gives names, for keys that change when any of them moves
+        return sorted([(name, address) for name, address in self.variables.items() if name in names]
+                      + [(name, line, address) for (name, line), address in self.arrays.items() if name in names])
+
+def find_lifetimes(statements):
+    '''
+    Numbers the statements in the order they run and returns (ranges, lines, variables, arrays, defined).
+    ranges maps each variable name and (array name, declaration line) to the first and last number it is used at, widened to cover
+    the outermost loop it is used in as its value may be needed on the next iteration, and lines[number] is the source line of that statement.
+    Each declaration of an array is a new array, used until the next declaration with the same name, the same way the compiler reads them.
+    variables are the names assigned to, arrays maps each (array name, declaration line) to its size and defined holds the variables
+    first used by an assignment that always runs, outside any loop or if statement, and does not read them. Only those can reuse memory
+    something else used before, the others could read what was left there when they would have read 0.
+    '''
+    uses, lines, loops = {}, [], {} # key: name, value: (number, start of the outermost loop around it), key: start of a loop, value: its end
+    variables, arrays, defined = set(), {}, set()
+    declared = {} # key: array name, value: the declaration it currently refers to
+
+    def number(line):
+        lines.append(line)
+        return len(lines) - 1
+
+    def read(expression, position, outer):
+        for name in NAME_PATTERN.findall(expression):
+            uses.setdefault(name, []).append((position, outer))
+            if name in declared:
+                uses[declared[name]].append((position, outer))
+
+    def assign(statement, position, outer, always):
+        read(statement.expression, position, outer)
+        if statement.variable not in uses and always:
+            defined.add(statement.variable)
+        variables.add(statement.variable)
+        uses.setdefault(statement.variable, []).append((position, outer))
+
+    def visit(block, outer, always): # outer is the start of the outermost loop the block is in, None outside loops
+        for statement in block:
+            match statement:
+                case If():
+                    position = number(statement.line)
+                    for condition, body in statement.branches:
+                        read(condition, position, outer)
+                        visit(body, outer, False)
+                    if statement.orelse is not None:
+                        visit(statement.orelse, outer, False)
+                case While():
+                    start = number(statement.line)
+                    read(statement.condition, start, outer if outer is not None else start)
+                    visit(statement.body, outer if outer is not None else start, False)
+                    loops[start] = len(lines) - 1
+                case For():
+                    visit([statement.initialisation], outer, always)
+                    start = number(statement.line)
+                    read(statement.condition, start, outer if outer is not None else start)
+                    visit(statement.body + [statement.increment], outer if outer is not None else start, False)
+                    loops[start] = len(lines) - 1
+                case ArrayDeclaration():
+                    if is_number(statement.size): # The compiler reports variable length arrays
+                        declared[statement.name] = (statement.name, statement.line)
+                        arrays[declared[statement.name]] = int(statement.size)
+                        uses.setdefault(declared[statement.name], []).append((number(statement.line), outer))
+                case ArrayAssignment():
+                    position = number(statement.line)
+                    read(f"{statement.name}[{statement.index}]{statement.expression}", position, outer)
+                case Assignment():
+                    assign(statement, number(statement.line), outer, always)
+                case Print():
+                    read(statement.argument, number(statement.line), outer)
+
+    visit(statements, None, True)
+    ranges = {name: (min(position if outer is None else outer for position, outer in positions),
+                     max(position if outer is None else loops[outer] for position, outer in positions)) for name, positions in uses.items()}
+    return ranges, lines, variables, arrays, defined
+
+def plan_memory(statements, start, exclude=(), reuse=True, alignment=ARRAY_ALIGNMENT):
+    '''
+    Gives every variable and array in statements an address from start, except the variables in exclude, which are kept in registers.
+    With reuse False every variable gets a word of its own, so each address in the code belongs to one variable.
+    Variables and arrays are placed in the order their lifetimes start. Each array gets a contiguous block of memory never used before,
+    as arrays read 0 until they are written. A variable defined before it is read takes the lowest word freed by a variable or array
+    whose lifetime has ended, and the rest go after everything placed so far.
+    '''
+    ranges, lines, variables, arrays, defined = find_lifetimes(statements)
+    items = [(*ranges[array], "array", array, size) for array, size in arrays.items()]
+    items += [(*ranges[name], "variable", name, 1) for name in variables if name not in exclude]
+
+    plan = MemoryPlan(start)
+    free, live = [], [] # Words that can be reused, (last use, address, words) of everything in use
+    for first, last, kind, name, words in sorted(items, key=lambda item: (item[0], item[2], str(item[3]))):
+        while live and live[0][0] < first: # Lifetime over, its words are free
+            _, address, size = heappop(live)
+            for word in range(address, address + size):
+                heappush(free, word)
+        if kind == "variable" and name in defined and free and reuse:
+            address = heappop(free)
+        else:
+            address = plan.end if kind == "variable" else -(-plan.end // alignment) * alignment
+            for word in range(plan.end, address): # Padding before an array, never used so any variable can have it
+                heappush(free, word)
+            plan.end = address + words
+        if kind == "variable":
+            plan.variables[name] = address
+        else:
+            plan.arrays[name] = (address, words)
+        heappush(live, (last, address, words))
+        plan.peak = max(plan.peak, sum(size for _, _, size in live))
+        plan.entries.append((name if kind == "variable" else name[0], kind, address, words, lines[first] + 1, lines[last] + 1))
+    plan.entries.sort(key=lambda entry: entry[2])
+    return plan
+
+def print_memory_map(plan, registers=None): # Table of the plan, registers maps the variables kept in registers to them
+    print(f"\033[36;1m{'address':>8}{'words':>8}  {'kind':10}{'lines':>12}  name\033[0m")
+    for name, kind, address, words, first, last in plan.entries:
+        print(f"{address:>8}{words:>8}  {kind:10}{f'{first}-{last}':>12}  {name}")
+    for name, reg in sorted((registers or {}).items()):
+        print(f"{reg:>8}{'':>8}  {'register':10}{'':>12}  {name}")
+    print(f"\033[36;1m{plan.words} words from address {plan.start} used, at most {plan.peak} at the same time\033[0m")
+
+def write_memory_map(plan, map_file, registers=None): # JSON memory map, the address, size and source lines of every variable and array
+    with open(map_file, "w") as f:
+        json.dump({
+            "start": plan.start,
+            "end": plan.end,
+            "words": plan.words,
+            "peak": plan.peak,
+            "entries": [{"name": name, "kind": kind, "address": address, "words": words, "lines": [first, last]}
+                        for name, kind, address, words, first, last in plan.entries],
+            "registers": registers or {},
+        }, f, indent=1)
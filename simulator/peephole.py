@@ -0,0 +1,267 @@
+import re
+from bisect import bisect_left, bisect_right
+
+WINDOW_SIZE = 3
+ARITHMETIC = ("ADD", "SUB", "MUL", "DIV", "EXP", "MOD", "FDV", "LSL", "LSR", "AND")
+COMMUTATIVE = ("ADD", "MUL", "AND")
+BRANCHES = ("BAL", "BEQ", "BNE", "BGT", "BLT")
+REGISTER_BITS = {f"r{idx}": 1 << idx for idx in range(8)}
+ALL_REGISTERS = sum(REGISTER_BITS.values())
+
+def is_register(operand):
+    return operand in REGISTER_BITS
+
+def is_immediate(operand):
+    return re.fullmatch(r"#\d+", operand) is not None
+
+def registers_read(instruction):
+    if instruction.opcode in ARITHMETIC or instruction.opcode in ("MOV", "LDR"):
+        operands = instruction.operands[1:]
+    elif instruction.opcode in ("STR", "CMP", "PRT"):
+        operands = instruction.operands
+    else:
+        operands = ()
+    return [op for op in operands if is_register(op)]
+
+def register_written(instruction):
+    if instruction.opcode in ARITHMETIC or instruction.opcode in ("MOV", "LDR"):
+        return instruction.operands[0]
+    return None
+
+class Program: # Instruction list being optimised, with the analysis the rules need for one pass
+
+    def __init__(self, assembly_code, liveness=True, region=None, outside=None):
+        '''
+        Passes that only change branches can leave out the liveness analysis. region = (first, last) limits the analysis to the
+        instructions between them, so a pass changing one loop does not redo it for the whole program. The region must only be
+        entered at first, which is then the only target outside the branches in it. Registers live into the instructions it branches
+        or falls out to are read from outside, key: id(instruction), value: live registers, and every register is taken to be live
+        into an instruction missing from it.
+        '''
+        self.code = assembly_code
+        self.outside = outside
+        self.end = len(assembly_code) - 1 # The final statement becomes HALT
+        first, last = (0, self.end - 1) if region is None else region
+        self.positions = [ln for ln in range(first, last + 1) if assembly_code[ln].opcode != "PASS"]
+
+        self.next_real = [None] * len(assembly_code) # next_real[ln] = first instruction at or after ln that is not a pass statement, see real()
+        self.next_real[self.end] = self.end
+        nxt = self.real(last + 1)
+        for ln in range(last, first - 1, -1):
+            nxt = self.next_real[ln] = ln if assembly_code[ln].opcode != "PASS" else nxt
+
+        self.branches = [instruction for instruction in assembly_code[first:last+1] if instruction.opcode in BRANCHES]
+        self.targets = {self.landing(instruction) for instruction in self.branches}
+        if region is not None:
+            self.targets.add(first)
+        self.live_in, self.live_out = self.__liveness() if liveness else ({}, {})
+
+    def real(self, ln): # First instruction at or after ln that is not a pass statement, looked up ahead of the region when it is needed
+        start = ln
+        while self.next_real[ln] is None and self.code[ln].opcode == "PASS":
+            ln += 1
+        nxt = ln if self.next_real[ln] is None else self.next_real[ln]
+        for skipped in range(ln, start - 1, -1):
+            self.next_real[skipped] = nxt
+        return nxt
+
+    def landing(self, instruction): # Instruction a branch ends up at
+        position = instruction.target.position
+        return self.next_real[position] if self.next_real[position] is not None else self.real(position)
+
+    def following(self, ln): # Instruction after ln that is not a pass statement
+        return self.next_real[ln+1] if self.next_real[ln+1] is not None else self.real(ln + 1)
+
+    def preceding(self, ln): # Instruction before ln that is not a pass statement, None if there is none
+        idx = bisect_left(self.positions, ln) - 1
+        while idx >= 0 and self.code[self.positions[idx]].opcode == "PASS": # Removed since the analysis
+            idx -= 1
+        return self.positions[idx] if idx >= 0 else None
+
+    def successors(self, ln):
+        instruction = self.code[ln]
+        if instruction.opcode == "HALT" or ln == self.end:
+            return ()
+        if instruction.opcode == "BAL":
+            return (self.landing(instruction),)
+        if instruction.opcode in BRANCHES:
+            return (self.landing(instruction), self.following(ln))
+        return (self.following(ln),)
+
+    def __liveness(self): # Registers whose value may still be read after each instruction
+        reads, keeps, successors = {}, {}, {}
+        for ln in self.positions: # Everything the dataflow needs from an instruction is worked out once
+            reads[ln] = sum(REGISTER_BITS[reg] for reg in set(registers_read(self.code[ln])))
+            keeps[ln] = ~REGISTER_BITS.get(register_written(self.code[ln]), 0)
+            successors[ln] = self.successors(ln)
+        live_in, live_out = dict.fromkeys(self.positions, 0), dict.fromkeys(self.positions, 0)
+        boundary = {succ: self.__outside_live(succ) for ln in self.positions for succ in successors[ln] if succ not in live_in}
+        changed = True
+        while changed:
+            changed = False
+            for ln in reversed(self.positions):
+                out = 0
+                for succ in successors[ln]:
+                    out |= live_in[succ] if succ in live_in else boundary[succ]
+                inn = out & keeps[ln] | reads[ln]
+                if live_in[ln] != inn or live_out[ln] != out:
+                    live_in[ln], live_out[ln] = inn, out
+                    changed = True
+        return live_in, live_out
+
+    def __outside_live(self, ln): # Registers live into an instruction the analysis did not cover
+        if ln == self.end or self.outside is None: # The final statement reads nothing
+            return 0
+        return self.outside.get(id(self.code[ln]), ALL_REGISTERS)
+
+    def is_dead(self, reg, ln): # Value of reg is never read after the instruction at ln
+        if ln not in self.live_out and self.outside is not None: # Outside the region, nothing is known to be dead
+            return False
+        return not self.live_out.get(ln, 0) & REGISTER_BITS[reg]
+
+    def is_live(self, reg, ln): # Value of reg may be read by the instruction at ln or after it
+        live = self.live_in[ln] if ln in self.live_in else self.__outside_live(ln)
+        return bool(live & REGISTER_BITS[reg])
+
+    def live_registers(self): # key: id(instruction), value: registers live into it, the outside of a later analysis of a region
+        return {id(self.code[ln]): live for ln, live in self.live_in.items()}
+
+    def window(self, ln): # Up to WINDOW_SIZE instructions from ln that can only be reached by falling through from ln
+        window = [ln]
+        while len(window) < WINDOW_SIZE and self.code[window[-1]].opcode not in BRANCHES + ("HALT",):
+            nxt = self.following(window[-1])
+            if nxt == self.end or nxt in self.targets:
+                break
+            window.append(nxt)
+        return window
+
+    def remove(self, ln):
+        self.code[ln].opcode, self.code[ln].operands, self.code[ln].target = "PASS", (), None
+
+    def replace(self, first, last, instructions): # Put as many instructions in place of those from first to last, labels must already have moved
+        '''The analysis is kept up to date, except liveness, as long as the first and last instructions are not pass statements.'''
+        replaced = {id(instruction) for instruction in self.code[first:last+1]}
+        self.code[first:last+1] = instructions
+        self.positions[bisect_left(self.positions, first):bisect_right(self.positions, last)] = \
+            [ln for ln in range(first, last + 1) if self.code[ln].opcode != "PASS"]
+        nxt = last
+        for ln in range(last, first - 1, -1):
+            nxt = self.next_real[ln] = ln if self.code[ln].opcode != "PASS" else nxt
+        self.branches = [branch for branch in self.branches if id(branch) not in replaced] + \
+                        [instruction for instruction in instructions if instruction.opcode in BRANCHES]
+        self.targets = {self.landing(branch) for branch in self.branches}
+
+'''Rules, each takes a window and the program and returns True if it changed the code'''
+
+def store_then_load(window, program): # STR rX a, LDR rY a -> STR rX a, MOV rY rX
+    if len(window) < 2:
+        return False
+    store, load = program.code[window[0]], program.code[window[1]]
+    if store.opcode != "STR" or load.opcode != "LDR" or store.operands[1] != load.operands[1]:
+        return False
+    if load.operands[0] == store.operands[0]:
+        program.remove(window[1])
+    else:
+        load.opcode, load.operands = "MOV", (load.operands[0], store.operands[0])
+    return True
+
+def forward_move(window, program): # MOV rT x, OP d a rT -> OP d a x when the value in rT is not used again
+    if len(window) < 2:
+        return False
+    move, user = program.code[window[0]], program.code[window[1]]
+    if move.opcode != "MOV" or user.opcode not in ARITHMETIC + ("CMP",):
+        return False
+    reg, value = move.operands
+    if register_written(user) != reg and not program.is_dead(reg, window[1]):
+        return False
+    dest, sources = (user.operands[:1], list(user.operands[1:])) if user.opcode in ARITHMETIC else ((), list(user.operands))
+    if reg not in sources:
+        return False
+    sources = [value if op == reg else op for op in sources]
+    if is_immediate(sources[0]): # Only the last operand can be an immediate value on the processor
+        if user.opcode not in COMMUTATIVE or is_immediate(sources[1]):
+            return False
+        sources.reverse()
+    user.operands = dest + tuple(sources)
+    program.remove(window[0])
+    return True
+
+def constant_address(window, program): # MOV rT #a, LDR/STR x rT -> LDR/STR x a when the value in rT is not used again
+    if len(window) < 2:
+        return False
+    move, access = program.code[window[0]], program.code[window[1]]
+    if move.opcode != "MOV" or access.opcode not in ("LDR", "STR") or not is_immediate(move.operands[1]):
+        return False
+    reg = move.operands[0]
+    if access.operands[1] != reg or access.operands[0] == reg and access.opcode == "STR":
+        return False
+    if register_written(access) != reg and not program.is_dead(reg, window[1]):
+        return False
+    access.operands = (access.operands[0], move.operands[1][1:])
+    program.remove(window[0])
+    return True
+
+def fold_constants(window, program): # OP d #a #b -> MOV d #result
+    instruction = program.code[window[0]]
+    if instruction.opcode not in ("ADD", "SUB", "MUL") or not all(is_immediate(op) for op in instruction.operands[1:]):
+        return False
+    lhs, rhs = (int(op[1:]) for op in instruction.operands[1:])
+    result = {"ADD": lhs + rhs, "SUB": lhs - rhs, "MUL": lhs * rhs}[instruction.opcode]
+    if result < 0: # Negative immediate values cannot be written
+        return False
+    instruction.opcode, instruction.operands = "MOV", (instruction.operands[0], f"#{result}")
+    return True
+
+def identity(window, program): # ADD d a #0, SUB d a #0, MUL d a #1, LSL/LSR d a #0 -> MOV d a, and MOV a a is removed
+    instruction = program.code[window[0]]
+    if instruction.opcode == "MOV" and instruction.operands[0] == instruction.operands[1]:
+        program.remove(window[0])
+        return True
+    if (instruction.opcode, instruction.operands[-1:]) not in (("ADD", ("#0",)), ("SUB", ("#0",)), ("MUL", ("#1",)), ("LSL", ("#0",)), ("LSR", ("#0",))):
+        return False
+    if not is_register(instruction.operands[1]):
+        return False
+    instruction.opcode, instruction.operands = "MOV", instruction.operands[:2]
+    return True
+
+def branch_to_next(window, program): # Branch to the instruction that follows it anyway
+    instruction = program.code[window[0]]
+    if instruction.opcode not in BRANCHES or program.landing(instruction) != program.following(window[0]):
+        return False
+    program.remove(window[0])
+    return True
+
+def jump_to_jump(window, program): # Branch to a BAL -> branch straight to where the BAL goes
+    instruction = program.code[window[0]]
+    if instruction.opcode not in BRANCHES:
+        return False
+    landing = program.code[program.landing(instruction)]
+    if program.landing(instruction) == program.end or landing.opcode != "BAL" or program.landing(landing) == program.landing(instruction):
+        return False
+    instruction.target = landing.target
+    program.targets.add(program.landing(instruction))
+    return True
+
+RULES = [store_then_load, forward_move, constant_address, fold_constants, identity, branch_to_next, jump_to_jump]
+
+def optimise(assembly_code, rules=RULES): # Apply the rules until none of them fire, returns the number of instructions removed
+    '''
+    assembly_code is the compiler's instruction list, its last statement becomes HALT and is never changed.
+    Removed instructions become pass statements so labels bound to them still resolve to the next instruction.
+    '''
+    if not assembly_code:
+        return 0
+    before = sum(instruction.opcode != "PASS" for instruction in assembly_code)
+    fired = True
+    while fired:
+        fired = False
+        program = Program(assembly_code)
+        for ln in program.positions:
+            if assembly_code[ln].opcode == "PASS": # Removed earlier in this pass
+                continue
+            window = program.window(ln)
+            for rule in rules:
+                if rule(window, program):
+                    fired = True
+                    break
+    return before - sum(instruction.opcode != "PASS" for instruction in assembly_code)
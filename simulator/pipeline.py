@@ -0,0 +1,112 @@
+import json
+import asyncio
+from sys import argv
+from os import cpu_count
+from io import StringIO
+from time import perf_counter
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from compiler import Compiler
+from compile_cache import BlockCache
+from assembler import AssemblerError, assembler
+from executer import TIME_SLICE, Machine, run_async
+from translator import execute_translated_code
+
+'''Compile, assemble and execute programs in memory, without the files the command line tools read and write'''
+
+def compile_source(source, optimise=False, unroll_factor=Compiler.UNROLL_FACTOR, cache=None): # Returns the assembly lines and the compile errors
+    code = source.splitlines() if isinstance(source, str) else list(source)
+    compiler = Compiler(optimise=optimise, unroll_factor=unroll_factor, cache=cache)
+    with redirect_stdout(StringIO()) as errors: # The compiler prints the errors it finds
+        assembly = compiler.compile_code(code)
+    return assembly, errors.getvalue().splitlines()
+
+def assemble(assembly): # Returns the machine code words, raises AssemblerError for instructions the processor does not have
+    return assembler(assembly)
+
+def machine_output(machine): # Lines a stopped machine printed, with the error that stopped it like pexec prints it
+    return machine.take_output() + ([] if machine.error is None else [machine.error])
+
+def execute(assembly, translate=False): # Returns the lines the program printed and the memory after it halts, memory[address] is the value stored there
+    memory = assembly + [""] * (Compiler.ARRAY_RANGE[1] + 1 - len(assembly)) # Room for the variables and arrays, as written by pcompile
+    if translate:
+        with redirect_stdout(StringIO()) as output:
+            data = execute_translated_code(memory)
+        return output.getvalue().splitlines(), data
+    machine = Machine(memory)
+    machine.run()
+    return machine_output(machine), machine.data
+
+async def execute_async(assembly, seconds=TIME_SLICE): # Same as execute on the running event loop, giving other tasks a turn every slice of seconds
+    machine = await run_async(Machine(assembly + [""] * (Compiler.ARRAY_RANGE[1] + 1 - len(assembly))), seconds)
+    return machine_output(machine), machine.data
+
+async def execute_all(programs, seconds=TIME_SLICE): # Runs the assembly of every program interleaved on one event loop, returns what execute would for each
+    return await asyncio.gather(*(execute_async(assembly, seconds) for assembly in programs))
+
+def run_program(source, optimise=False, unroll_factor=Compiler.UNROLL_FACTOR, cache=None, translate=False):
+    '''
+    Runs every stage on source, returning a dict of the assembly, machine code (None if it does not assemble), printed output
+    (None if the program has compile errors, which stop it being executed), errors and the seconds each stage took.
+    '''
+    result = {"assembly": None, "machine_code": None, "output": None, "errors": [], "seconds": {}}
+    stime = perf_counter()
+    assembly, errors = compile_source(source, optimise, unroll_factor, cache)
+    result["assembly"], result["errors"] = assembly, list(errors)
+    result["seconds"]["compile"] = perf_counter() - stime
+
+    stime = perf_counter()
+    try:
+        result["machine_code"] = assemble(assembly)
+    except AssemblerError as err: # The executer still runs it, it has DIV, EXP, MOD and FDV
+        result["errors"].append(str(err))
+    result["seconds"]["assemble"] = perf_counter() - stime
+
+    if not errors:
+        stime = perf_counter()
+        result["output"], _ = execute(assembly, translate)
+        result["seconds"]["execute"] = perf_counter() - stime
+    return result
+
+'''Batch driver, each worker process keeps its modules imported and its block cache warm between programs'''
+
+_worker_options = {}
+
+def _start_worker(optimise, unroll_factor, use_cache, translate):
+    _worker_options.update(optimise=optimise, unroll_factor=unroll_factor, cache=BlockCache() if use_cache else None, translate=translate)
+
+def _run_file(source_file): # JSON line for one program
+    stime = perf_counter()
+    try:
+        with open(source_file, "r") as f:
+            result = run_program(f.read(), **_worker_options)
+    except Exception as err: # Missing file, or a program the compiler cannot handle, the rest of the batch still runs
+        return json.dumps({"program": source_file, "errors": [f"{type(err).__name__}: {err}"]})
+    return json.dumps({
+        "program": source_file,
+        "instructions": len(result["assembly"]),
+        "words": None if result["machine_code"] is None else len(result["machine_code"]),
+        "output": result["output"],
+        "errors": result["errors"],
+        "seconds": dict(result["seconds"], total=perf_counter() - stime),
+    })
+
+def run_batch(source_files, workers=None, optimise=False, unroll_factor=Compiler.UNROLL_FACTOR, use_cache=True, translate=False):
+    '''Runs the programs across a pool of one worker per core by default, yielding a JSON line for each in the order given'''
+    with ProcessPoolExecutor(max_workers=workers or cpu_count(), initializer=_start_worker,
+                             initargs=(optimise, unroll_factor, use_cache, translate)) as executor:
+        yield from executor.map(_run_file, source_files)
+
+if __name__ in "__main__":
+    flags = ("-O", "--no-cache", "--translate")
+    options = [arg for arg in argv[1:] if arg.startswith("--unroll=") or arg.startswith("--workers=")] # Options can go anywhere
+    files = [arg for arg in argv[1:] if arg not in flags and arg not in options]
+    settings = dict(option[2:].split("=") for option in options)
+    if "--version" in argv: # Version argument
+        print(f"\033[36;1mpbatch v0.15\033[0m")
+    elif "--help" in argv or not files: # Help argument or no programs
+        print("\033[91;1mpbatch syntax: pbatch <code files> [-O] [--unroll=<factor>] [--workers=<count>] [--no-cache] [--translate]\033[0m")
+    else:
+        for line in run_batch(files, int(settings.get("workers", 0)) or None, "-O" in argv,
+                              int(settings.get("unroll", Compiler.UNROLL_FACTOR)), "--no-cache" not in argv, "--translate" in argv):
+            print(line, flush=True)
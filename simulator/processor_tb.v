@@ -2,20 +2,62 @@
 
 module processor_tb;
 
+// Run with: vvp tb [+memory=<image>] [+vcd[=<file>]] [+dump=<file>] [+cycles=<limit>]
+localparam HALTED = 2'b10; // control_unit state after a HALT instruction
+
 reg clk = 0;
 reg nreset;
+integer i;
+integer cycles = 0;
+integer max_cycles;
+reg [8*256-1:0] image; // Memory image to run, memory.txt in the working directory by default
+reg [8*256-1:0] vcd; // Waveform file, only written with +vcd
+reg [8*256-1:0] dump; // File the data memory is written to when the processor halts, only with +dump
 
 always #1 clk = !clk;
 
+always @(posedge clk) // Rising edges since reset, the same count as cycles.py
+    if (nreset === 1'b1)
+        cycles = cycles + 1;
+
 initial begin
-    $readmemh("C:\\Users\\nhlo\\Documents\\GitHub\\PythonCompiler\\main\\memory.txt", u_ram.Mem,0,3135);
-    $dumpfile("iexec.vcd");
-    $dumpvars(0,processor_tb);
+    if (!$value$plusargs("memory=%s", image))
+        image = "memory.txt";
+    if (!$value$plusargs("cycles=%d", max_cycles))
+        max_cycles = 500000; // The old fixed #1000000 run
+    for (i = 0; i <= 3135; i = i + 1) // Words left out of a sparse memory.txt read as 0
+        u_ram.Mem[i] = 0;
+    $readmemh(image, u_ram.Mem,0,3135);
+    if ($test$plusargs("vcd")) begin
+        if (!$value$plusargs("vcd=%s", vcd))
+            vcd = "iexec.vcd";
+        $dumpfile(vcd);
+        $dumpvars(0,processor_tb);
+    end
     #1
     nreset = 0;
     #1
     nreset = 1;
-    #1000000
+end
+
+initial begin
+    #3
+    while (dut.cu.state !== HALTED && cycles < max_cycles) // Checked between rising edges, when every register has settled
+        @(negedge clk);
+    if (dut.cu.state == HALTED)
+        $display("HALTED %0d", cycles);
+    else
+        $display("TIMEOUT %0d", cycles);
+    $display("r0 %h", dut.ureg.r0);
+    $display("r1 %h", dut.ureg.r1);
+    $display("r2 %h", dut.ureg.r2);
+    $display("r3 %h", dut.ureg.r3);
+    $display("r4 %h", dut.ureg.r4);
+    $display("r5 %h", dut.ureg.r5);
+    $display("r6 %h", dut.ureg.r6);
+    $display("r7 %h", dut.ureg.r7);
+    if ($value$plusargs("dump=%s", dump))
+        $writememh(dump, u_ram.Mem, 1024, 3135);
     $finish;
 end
 
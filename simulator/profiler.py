@@ -0,0 +1,84 @@
+import json
+
+PROFILE_FILE = "profile.json"
+FOLDED_FILE = "profile.folded" # Collapsed stacks, one "frame;frame;frame count" line each, as read by flamegraph.pl and speedscope
+TOP = 10 # Rows in each table of the report
+
+'''Reports for the counts from executer.profile_assembly_code, attributed to source lines through the compiler's source map'''
+
+def load_source_map(map_file): # Returns (source lines, source file text) from a map written by pcompile, (None, None) if there is no map
+    try:
+        with open(map_file, "r") as f:
+            source_map = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None, None
+    try:
+        with open(source_map["source"], "r") as f:
+            code = f.read().splitlines()
+    except (FileNotFoundError, TypeError):
+        code = None
+    return source_map["lines"], code
+
+def frame(ln, lines): # Name of the source line assembly line ln came from, the assembly line itself without a source map
+    if lines is None or ln >= len(lines) or lines[ln] is None:
+        return f"asm {ln}"
+    return f"line {lines[ln]}"
+
+def hot_lines(executions, lines): # (frame, instructions executed) for every line that ran, most executed first
+    totals = {}
+    for ln, count in enumerate(executions):
+        if count:
+            totals[frame(ln, lines)] = totals.get(frame(ln, lines), 0) + count
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+def hot_loops(executions, loops, lines): # (frame, first line, last line, iterations, instructions executed inside) for each loop, most executed first
+    table = [(frame(end, lines), start, end, executions[end], sum(executions[start:end+1])) for start, end in loops]
+    return sorted(table, key=lambda row: -row[4])
+
+def collapsed_stacks(executions, loops, lines): # Instructions executed under each stack of program, enclosing loops outermost first, then source line
+    stacks = {}
+    for ln, count in enumerate(executions):
+        if not count:
+            continue
+        enclosing = sorted(((start, end) for start, end in loops if start <= ln <= end), key=lambda loop: (loop[0], -loop[1]))
+        stack = ";".join(["program"] + [f"loop {frame(end, lines)}" for _, end in enclosing] + [frame(ln, lines)])
+        stacks[stack] = stacks.get(stack, 0) + count
+    return stacks
+
+def report_profile(executions, branches, accesses, loops, source_map, profile_file=PROFILE_FILE, folded_file=FOLDED_FILE):
+    '''Prints the hottest source lines, loops, branches and addresses and writes the whole profile as JSON and as collapsed stacks'''
+    lines, code = source_map
+    total = sum(executions)
+
+    def text(name): # Source code of a frame, when it is known
+        if code is None or not name.startswith("line "):
+            return ""
+        return code[int(name[5:]) - 1].strip()
+
+    print(f"\033[36;1m{total} instructions executed\033[0m")
+    print(f"\033[36;1m{'source':12}{'executed':>12}{'share':>8}  code\033[0m")
+    for name, count in hot_lines(executions, lines)[:TOP]:
+        print(f"{name:12}{count:>12}{count / total:>8.1%}  {text(name)}")
+    print(f"\033[36;1m{'loop':12}{'iterations':>12}{'executed':>12}{'share':>8}  code\033[0m")
+    for name, start, end, iterations, count in hot_loops(executions, loops, lines)[:TOP]:
+        print(f"{name:12}{iterations:>12}{count:>12}{count / total:>8.1%}  {text(name)}")
+    print(f"\033[36;1m{'branch':12}{'taken':>12}{'not taken':>12}{'ratio':>8}\033[0m")
+    for ln, (taken, not_taken) in sorted(branches.items(), key=lambda item: -sum(item[1]))[:TOP]:
+        if taken + not_taken:
+            print(f"{f'asm {ln}':12}{taken:>12}{not_taken:>12}{taken / (taken + not_taken):>8.1%}  {frame(ln, lines)}")
+    print(f"\033[36;1m{'address':12}{'loads':>12}{'stores':>12}\033[0m")
+    for address, (loads, stores) in sorted(accesses.items(), key=lambda item: -sum(item[1]))[:TOP]:
+        print(f"{address:<12}{loads:>12}{stores:>12}")
+
+    with open(profile_file, "w") as f:
+        json.dump({
+            "executed": total,
+            "instructions": [{"line": ln, "source": frame(ln, lines), "executed": count} for ln, count in enumerate(executions)],
+            "lines": hot_lines(executions, lines),
+            "loops": [{"source": name, "first": start, "last": end, "iterations": iterations, "executed": count}
+                      for name, start, end, iterations, count in hot_loops(executions, loops, lines)],
+            "branches": [{"line": ln, "source": frame(ln, lines), "taken": taken, "not_taken": not_taken} for ln, (taken, not_taken) in sorted(branches.items())],
+            "memory": {str(address): {"loads": loads, "stores": stores} for address, (loads, stores) in sorted(accesses.items())},
+        }, f, indent=1)
+    with open(folded_file, "w") as f:
+        f.writelines(f"{stack} {count}\n" for stack, count in sorted(collapsed_stacks(executions, loops, lines).items()))
@@ -0,0 +1,162 @@
+import json
+import subprocess
+from sys import argv
+from os import path, cpu_count
+from io import StringIO
+from shutil import which
+from tempfile import TemporaryDirectory
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from compiler import Compiler
+from pipeline import compile_source, assemble
+from assembler import AssemblerError, write_sparse_memory_image
+from executer import REGISTER_NAMES, run_assembly_code
+from emulator import WORD_MASK, EmulationError
+from cycles import simulate_cycles
+
+SIMULATOR_DIRECTORY = path.dirname(path.abspath(__file__))
+VERILOG_SOURCES = ("processor_tb.v", "processor.v", "control_unit.v", "alu.v", "regfile.v", "ram.v")
+RESULTS_FILE = "regression.json"
+MAX_CYCLES = 500000 # Clock cycles a program gets before the testbench gives up on it
+DATA_RANGE = (Compiler.VARIABLE_RANGE[0], Compiler.ARRAY_RANGE[1]) # Addresses the testbench dumps and the results are compared over
+
+'''
+Runs programs on the verilog processor in parallel vvp processes and checks the registers and memory it halts with against executer.py,
+and the cycles it took against the pipeline model in cycles.py
+'''
+
+def build_testbench(directory): # Compile the processor and its testbench with iverilog, returns the path of the vvp file
+    tb = path.join(directory, "tb")
+    subprocess.run([which("iverilog") or "iverilog", "-o", tb, "-s", "processor_tb"] + [path.join(SIMULATOR_DIRECTORY, source) for source in VERILOG_SOURCES],
+                   check=True, capture_output=True, text=True)
+    return tb
+
+def word(text): # Value of a hex word printed by the testbench, None if the simulation left any bit of it unknown
+    return None if any(digit in text.lower() for digit in "xz") else int(text, 16)
+
+def read_memory_dump(dump_file, start=DATA_RANGE[0]): # key: address, value: word, from a file written by $writememh
+    words, address = {}, start
+    with open(dump_file, "r") as f:
+        for line in f:
+            for text in line.split("//")[0].split():
+                if text.startswith("@"):
+                    address = int(text[1:], 16)
+                    continue
+                words[address] = word(text)
+                address += 1
+    return words
+
+def simulate(tb, image, dump_file, max_cycles=MAX_CYCLES):
+    '''
+    Runs one memory image on the processor, returns (halted, cycles, registers, memory).
+    The testbench stops as soon as the control unit halts, or after max_cycles, and prints r0-r7 as hex.
+    '''
+    process = subprocess.run([which("vvp") or "vvp", "-n", tb, f"+memory={image}", f"+dump={dump_file}", f"+cycles={max_cycles}"],
+                             capture_output=True, text=True, check=True)
+    halted, cycles, registers = False, None, [None] * len(REGISTER_NAMES)
+    for line in process.stdout.splitlines():
+        name, _, value = line.partition(" ")
+        if name in ("HALTED", "TIMEOUT"):
+            halted, cycles = name == "HALTED", int(value)
+        elif name in REGISTER_NAMES:
+            registers[REGISTER_NAMES.index(name)] = word(value)
+    if cycles is None:
+        raise RuntimeError(process.stdout + process.stderr)
+    return halted, cycles, registers, read_memory_dump(dump_file)
+
+def reference(assembly): # Registers and data memory after executer.py runs the program, as the processor's 32 bit words
+    with redirect_stdout(StringIO()):
+        registers, data = run_assembly_code(assembly)
+
+    def as_word(value):
+        return value & WORD_MASK if isinstance(value, int) else value
+
+    return [as_word(value) for value in registers], {address: as_word(data[address]) for address in range(DATA_RANGE[0], DATA_RANGE[1] + 1)}
+
+def compare(expected, actual): # Returns (location, executer value, processor value) for each difference
+    (registers, memory), (tb_registers, tb_memory) = expected, actual
+    differences = [(name, registers[idx], tb_registers[idx]) for idx, name in enumerate(REGISTER_NAMES) if registers[idx] != tb_registers[idx]]
+    differences += [(address, memory[address], tb_memory.get(address)) for address in memory if memory[address] != tb_memory.get(address)]
+    return differences
+
+def prepare_program(directory, idx, source_file, optimise=False): # Returns the result dict, the assembly, machine code and memory image to simulate, None for programs that are skipped
+    result = {"program": source_file, "status": "skipped", "cycles": None, "predicted_cycles": None, "differences": [], "errors": []}
+    try:
+        with open(source_file, "r") as f:
+            assembly, result["errors"] = compile_source(f.read(), optimise)
+        if result["errors"]:
+            return result, None, None, None
+        machine_code = assemble(assembly)
+    except (FileNotFoundError, AssemblerError) as err: # Missing file, or an instruction the processor does not have (DIV, EXP, MOD, FDV)
+        result["errors"].append(str(err))
+        return result, None, None, None
+    image = path.join(directory, f"{idx}.txt")
+    with open(image, "w") as f:
+        write_sparse_memory_image(machine_code, f)
+    return result, assembly, machine_code, image
+
+def run_regression(source_files, tb=None, workers=None, optimise=False, max_cycles=MAX_CYCLES):
+    '''
+    Checks every program against the executer with one vvp process per core by default, yielding each result as a dict in the order given.
+    The testbench is built from the verilog sources with iverilog unless tb gives a vvp file that is already built.
+    Compiling and running the executer stay in this thread, as they redirect stdout, while the worker threads wait on vvp.
+    '''
+    with TemporaryDirectory() as directory:
+        tb = tb or build_testbench(directory)
+        with ThreadPoolExecutor(max_workers=workers or cpu_count()) as executor:
+            programs = []
+            for idx, source_file in enumerate(source_files):
+                result, assembly, machine_code, image = prepare_program(directory, idx, source_file, optimise)
+                simulation = None if image is None else executor.submit(simulate, tb, image, path.join(directory, f"{idx}.dump"), max_cycles)
+                programs.append((result, assembly, machine_code, simulation))
+            for result, assembly, machine_code, simulation in programs:
+                if simulation is None:
+                    yield result
+                    continue
+                try:
+                    halted, result["cycles"], tb_registers, tb_memory = simulation.result()
+                except (subprocess.CalledProcessError, RuntimeError) as err: # vvp failed, eg. the image could not be read
+                    result["status"], result["errors"] = "error", [getattr(err, "stderr", None) or str(err)]
+                    yield result
+                    continue
+                if not halted: # The executer would not halt either
+                    result["status"] = "timeout"
+                else:
+                    result["differences"] = compare(reference(assembly), (tb_registers, tb_memory))
+                    try:
+                        result["predicted_cycles"] = simulate_cycles(machine_code, max_cycles)[0]
+                    except EmulationError as err:
+                        result["errors"].append(str(err))
+                    if result["predicted_cycles"] != result["cycles"]:
+                        result["differences"].append(("cycles", result["predicted_cycles"], result["cycles"]))
+                    result["status"] = "fail" if result["differences"] else "pass"
+                yield result
+
+if __name__ in "__main__":
+    options = dict(arg[2:].split("=", 1) for arg in argv[1:] if arg.startswith("--") and "=" in arg) # Options can go anywhere
+    files = [arg for arg in argv[1:] if not arg.startswith("-")]
+    colours = {"pass": 92, "fail": 91, "error": 91, "timeout": 93, "skipped": 90}
+    if "--version" in argv: # Version argument
+        print(f"\033[36;1miregress v0.15\033[0m")
+    elif "--help" in argv or not files: # Help argument or no programs
+        print("\033[91;1miregress syntax: iregress <code files> [-O] [--tb=<vvp file>] [--workers=<count>] [--cycles=<limit>] [--output=<file>]\033[0m")
+    else:
+        try:
+            results = []
+            for result in run_regression(files, options.get("tb"), int(options.get("workers", 0)) or None, "-O" in argv, int(options.get("cycles", MAX_CYCLES))):
+                results.append(result)
+                cycles = "" if result["cycles"] is None else f" in {result['cycles']} cycles"
+                print(f"\033[{colours[result['status']]};1m{result['status'].upper():8}\033[0m{result['program']}{cycles}")
+                for location, expected, actual in result["differences"]:
+                    print(f"    {location}: {'cycles.py' if location == 'cycles' else 'executer'} {expected}, processor {actual}")
+                for error in result["errors"]:
+                    print(f"    {error}")
+        except (FileNotFoundError, subprocess.CalledProcessError) as err: # iverilog or vvp missing, or the verilog does not compile
+            print(f"\033[91;1m{getattr(err, 'stderr', None) or err}\033[0m")
+            quit()
+        with open(options.get("output", RESULTS_FILE), "w") as f:
+            json.dump(results, f, indent=1)
+        failed = sum(result["status"] in ("fail", "error", "timeout") for result in results)
+        print(f"\033[{91 if failed else 92};1m{len(results) - failed} of {len(results)} programs passed or were skipped, results written to {options.get('output', RESULTS_FILE)}\033[0m")
+        if failed:
+            exit(1)
@@ -0,0 +1,170 @@
+import marshal
+from sys import argv, implementation
+from os import makedirs, path, replace
+from hashlib import sha256
+from time import perf_counter
+from executer import decode, Memory, NoComparison, MEMORY_SIZE, WIDE, REGISTER_NAMES, HALT, ADD, SUB, MUL, DIV, EXP, MOD, FDV, LSL, LSR, AND, LDR, STR, MOV, CMP, BAL, BEQ, BNE, BGT, BLT, PRT
+
+TRANSLATOR_VERSION = "3"
+CACHE_DIRECTORY = path.join(path.dirname(path.abspath(__file__)), "__pycache__")
+
+OPERATORS = {ADD: "+", SUB: "-", MUL: "*", DIV: "/", EXP: "**", MOD: "%", FDV: "//", LSL: "<<", LSR: ">>", AND: "&"}
+CONDITIONS = {BEQ: "==", BNE: "!=", BGT: ">", BLT: "<"}
+BRANCHES = (BAL, BEQ, BNE, BGT, BLT)
+
+def find_basic_blocks(program): # Return the sorted line numbers that start a basic block
+    leaders = {0}
+    for ln, instruction in enumerate(program):
+        if instruction[0] in BRANCHES:
+            if instruction[1] < len(program):
+                leaders.add(instruction[1]) # Branch target
+            leaders.add(ln + 1) # Instruction after a branch
+        elif instruction[0] == HALT:
+            leaders.add(ln + 1)
+    return sorted(leader for leader in leaders if leader < len(program))
+
+def translate_block(program, registers, start, end): # Generate (line, Python statement) for each statement run for lines start to end
+    def operand(idx): # Registers are locals, immediates are literals
+        return REGISTER_NAMES[idx] if idx < len(REGISTER_NAMES) else repr(registers[idx])
+
+    def jump(target): # Statement that moves to another block
+        if target < len(program):
+            return f"block = {target}"
+        return f"raise IndexError('Branch to line {target} is outside of the program')"
+
+    lines = []
+    for ln in range(start, end):
+        opcode, *operands = program[ln]
+        if opcode in OPERATORS:
+            var, op1, op2 = operands
+            lines.append((ln, f"{REGISTER_NAMES[var]} = {operand(op1)} {OPERATORS[opcode]} {operand(op2)}"))
+        elif opcode == LDR:
+            address = operand(operands[1])
+            lines.append((ln, f"value = words[{address}]"))
+            lines.append((ln, f"{REGISTER_NAMES[operands[0]]} = wide[{address}] if value == WIDE else value"))
+        elif opcode == STR: # Stored the same way the executer's STR does, wide values go in the Memory's wide dict
+            address, reg = operand(operands[1]), REGISTER_NAMES[operands[0]]
+            lines += [(ln, statement) for statement in ("try:", f"    words[{address}] = {reg}", "except (TypeError, OverflowError, ValueError):",
+                                                        f"    words[{address}] = WIDE", f"    wide[{address}] = {reg}")]
+        elif opcode == MOV:
+            lines.append((ln, f"{REGISTER_NAMES[operands[0]]} = {operand(operands[1])}"))
+        elif opcode == CMP:
+            lines.append((ln, f"lhs = {operand(operands[0])}"))
+            lines.append((ln, f"rhs = {operand(operands[1])}"))
+        elif opcode == BAL:
+            lines.append((ln, jump(operands[0])))
+            return lines
+        elif opcode in CONDITIONS:
+            if operands[0] >= len(program) or ln + 1 >= len(program):
+                lines.append((ln, f"if lhs {CONDITIONS[opcode]} rhs: {jump(operands[0])}"))
+                lines.append((ln, f"else: {jump(ln + 1)}"))
+            else:
+                lines.append((ln, f"block = {operands[0]} if lhs {CONDITIONS[opcode]} rhs else {ln + 1}"))
+            return lines
+        elif opcode == PRT:
+            if operands[0] < len(REGISTER_NAMES): # Register
+                lines.append((ln, f"print({REGISTER_NAMES[operands[0]]})"))
+            else: # Immediate values are printed as floats
+                lines.append((ln, f"print({float(registers[operands[0]])!r})"))
+        elif opcode == HALT:
+            lines.append((ln, f"return {ln}, None"))
+            return lines
+        else: # Invalid instruction
+            message = f"Invalid instruction '{operands[0]}'" # Worded as the executer words it
+            lines.append((ln, f"raise SyntaxError({message!r})"))
+            return lines
+    lines.append((end - 1, jump(end))) # Fall through into the next block
+    return lines
+
+def translate(memory): # Generate the source of a function that runs the program one basic block at a time
+    '''
+    The generated run(memory) keeps r0-r7 and the status register in locals and picks the next block
+    with a binary search over block start lines. memory is a Memory like the executer's data segment,
+    its words are read and written directly so unwritten addresses read 0. It returns the line it stopped on
+    and the error that stopped it, which is None if it reached HALT. LINES holds the program line of each
+    line of the generated source, so the line an error was raised on is looked up from its traceback.
+    '''
+    program, registers = decode(memory)
+    leaders = find_basic_blocks(program)
+    bounds = leaders + [len(program)]
+
+    def dispatch(lo, hi, depth): # Binary search over leaders[lo:hi]
+        indent = "    " * depth
+        if hi - lo == 1:
+            return [(ln, indent + line) for ln, line in translate_block(program, registers, bounds[lo], bounds[lo+1])]
+        mid = (lo + hi) // 2
+        return [(None, f"{indent}if block < {leaders[mid]}:")] + dispatch(lo, mid, depth + 1) + [(None, f"{indent}else:")] + dispatch(mid, hi, depth + 1)
+
+    source = [(None, line) for line in (
+        "def run(memory):",
+        f"    {' = '.join(REGISTER_NAMES)} = None",
+        "    lhs = rhs = NoComparison()",
+        "    words, wide = memory.words, memory.wide",
+        "    block = 0",
+        "    try:",
+        "        while True:",
+    )]
+    if leaders:
+        source += dispatch(0, len(leaders), 3)
+    else:
+        source.append((None, "            raise IndexError('Program is empty')"))
+    source += [
+        (None, "    except Exception as err:"),
+        (None, "        ln = LINES[err.__traceback__.tb_lineno - 1]"),
+        (None, "        return block if ln is None else ln, err"),
+    ]
+    lines = [ln for ln, _ in source]
+    return "\n".join(line for _, line in source) + f"\nLINES = {tuple(lines)!r}\n"
+
+def load_translation(memory, use_cache=True, cache_directory=CACHE_DIRECTORY): # Return the translated run function, compiling it only on a cache miss
+    end = len(memory)
+    while end and not memory[end-1]:
+        end -= 1
+    key = sha256("\n".join([TRANSLATOR_VERSION, implementation.cache_tag] + memory[:end]).encode()).hexdigest()
+    cache_file = path.join(cache_directory, f"aot-{key}.bin")
+
+    code = None
+    if use_cache and path.isfile(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                code = marshal.load(f)
+        except (EOFError, ValueError, TypeError): # Corrupt cache entry, translate again
+            code = None
+    if code is None:
+        code = compile(translate(memory), f"<translated {key[:12]}>", "exec")
+        if use_cache:
+            makedirs(cache_directory, exist_ok=True)
+            with open(cache_file + ".tmp", "wb") as f:
+                marshal.dump(code, f)
+            replace(cache_file + ".tmp", cache_file) # Readers never see a partly written file
+
+    namespace = {"NoComparison": NoComparison, "WIDE": WIDE}
+    exec(code, namespace)
+    return namespace["run"]
+
+def execute_translated_code(memory, data=None, use_cache=True): # Run the assembly lines in memory with data as the data segment, returns the data segment
+    data = Memory.zeros(max(MEMORY_SIZE, len(memory))) if data is None else data
+    run = load_translation(memory, use_cache)
+    ln, err = run(data)
+    if err is not None: # Reported as the executer reports Machine.error
+        print(f"Error occurred on line {ln}: {err}")
+    return data
+
+if __name__ in "__main__":
+    if "--version" in argv: # Version argument
+        print(f"\033[36;1mpaot v0.15\033[0m")
+    elif "--help" in argv: # Help argument
+        print("\033[91;1mpaot syntax: paot <assembly file> [--no-cache]\033[0m")
+    elif len(argv) not in (2, 3) or len(argv) == 3 and argv[2] != "--no-cache": # Incorrect arguments
+        print("\033[91;1mpaot: Incorrect number of arguments\033[0m")
+    elif not argv[1]: # Blank arguments
+        print("\033[91;1mpaot: Some arguments are blank\033[0m")
+    else:
+        try:
+            with open(argv[1], "r") as f:
+                memory = f.read().splitlines()
+            stime = perf_counter()
+            execute_translated_code(memory, use_cache="--no-cache" not in argv)
+            print(f"\033[92;1mExecution successful, took {perf_counter() - stime} seconds\033[0m")
+        except FileNotFoundError as err: # Code file not found
+            print(f"\033[91;1m{err}\033[0m")
@@ -0,0 +1,6 @@
+import sys
+from os import path
+
+'''The simulator modules import each other by name, so the tests run with simulator/ on the path like the scripts in it do'''
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "simulator"))
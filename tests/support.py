@@ -0,0 +1,25 @@
+import re
+from os import path
+from glob import glob
+from pipeline import compile_source
+from executer import Machine
+
+TESTS_DIRECTORY = path.dirname(path.abspath(__file__))
+PROGRAMS = sorted(glob(path.join(TESTS_DIRECTORY, "programs", "*.txt"))) # Small programs written to catch a bug or cover a feature
+MAX_STEPS = 5_000_000 # Handlers a program gets before a test gives up on it
+
+def read(source_file):
+    with open(source_file, "r") as f:
+        return f.read()
+
+def compile_program(source, optimise=False, unroll_factor=None): # Assembly lines, failing the test if the compiler reports errors
+    options = {} if unroll_factor is None else {"unroll_factor": unroll_factor}
+    assembly, errors = compile_source(source, optimise, **options)
+    assert not errors, errors
+    return assembly
+
+def run(assembly): # Lines the program printed, with the error that stopped it less the line number, which -O changes
+    machine = Machine(assembly)
+    assert machine.run(steps=MAX_STEPS), "program did not halt"
+    error = [] if machine.error is None else [re.sub(r"on line \d+", "on line", machine.error)]
+    return machine.take_output() + error
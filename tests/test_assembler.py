@@ -0,0 +1,42 @@
+import pytest
+from io import BytesIO
+from assembler import assembler, write_binary_image, AssemblerError
+
+'''Words worked out by hand from the layout in emulator.decode(), opcode in bits 31:27 and bit 26 set when the last operand is a register'''
+ENCODINGS = {
+    "ADD r1 r2 r3": 0x140000D1,
+    "SUB r1 r2 #5": 0x18000151,
+    "MUL r0 r1 r2": 0x84000088,
+    "MOV r3 #1048575": 0x23FFFFC3,
+    "MOV r3 r4": 0x24000103,
+    "LDR r2 1030": 0x00002032,
+    "STR r1 r4": 0x0C000021,
+    "CMP r5 #7": 0x280001E8,
+    "HALT": 0x78000000,
+}
+BRANCHES = {"BAL": 0x30000000, "BEQ": 0x38000000, "BGT": 0x3A000000, "BLT": 0x3C000000, "BNE": 0x3E000000} # Branching to address 1
+
+@pytest.mark.parametrize("line, word", ENCODINGS.items(), ids=ENCODINGS.keys())
+def test_encoding(line, word):
+    assert assembler([line]) == [word]
+
+@pytest.mark.parametrize("opcode, word", BRANCHES.items(), ids=BRANCHES.keys())
+def test_branch_encoding(opcode, word):
+    assert assembler(["CMP r0 #0", f"{opcode} loop", "loop: HALT"]) == [0x28000000, word | 2, 0x78000000]
+    assert assembler(["CMP r0 #0", f"{opcode} 2", "HALT"])[1] == word | 2
+
+@pytest.mark.parametrize("lines, message", [
+    (["HALT", "MOV r1 #1048576"], "line 2: #1048576 does not fit in 20 bits"),
+    (["ADD r1 r8 #1"], "line 1: register r8 does not exist"),
+    (["STR r1 r9"], "line 1: register r9 does not exist"),
+    (["LDR r1 8388608"], "line 1: 8388608 does not fit in 23 bits"),
+    (["BAL 8388608"], "line 1: 8388608 does not fit in 23 bits"),
+    (["ADD r0 #4 #1034"], "line 1: #4 is not a register"),
+], ids=["immediate", "register", "address register", "address", "branch target", "immediate before the last operand"])
+def test_field_out_of_range(lines, message):
+    with pytest.raises(AssemblerError, match=message):
+        assembler(lines)
+
+def test_binary_image_word_out_of_range():
+    with pytest.raises(AssemblerError, match="address 1"):
+        write_binary_image([0, 1 << 32], BytesIO())
@@ -0,0 +1,49 @@
+import pytest
+from os import path
+from io import StringIO
+from contextlib import redirect_stdout
+from support import PROGRAMS, read, compile_program
+from compiler import Compiler
+from pipeline import execute
+from translator import execute_translated_code
+
+'''The executer, the translator and the lockstep executer run the same assembly, so they must print and store the same values'''
+
+DATA_RANGE = range(Compiler.VARIABLE_RANGE[0], Compiler.ARRAY_RANGE[1] + 1)
+
+def reference(source_file, optimise): # Memory to run the program from, with the lines it printed and the data segment the executer left
+    assembly = compile_program(read(source_file), optimise)
+    output, data = execute(assembly)
+    return assembly + [""] * (DATA_RANGE.stop - len(assembly)), output, [data[address] for address in DATA_RANGE]
+
+@pytest.mark.parametrize("optimise", [False, True], ids=["plain", "-O"])
+@pytest.mark.parametrize("source_file", PROGRAMS, ids=path.basename)
+def test_translator_matches_executer(source_file, optimise):
+    memory, output, data = reference(source_file, optimise)
+    with redirect_stdout(StringIO()) as printed:
+        translated = execute_translated_code(memory, use_cache=False)
+    assert printed.getvalue().splitlines() == output
+    assert [translated[address] for address in DATA_RANGE] == data
+
+@pytest.mark.parametrize("optimise", [False, True], ids=["plain", "-O"])
+@pytest.mark.parametrize("source_file", PROGRAMS, ids=path.basename)
+def test_lockstep_matches_executer(source_file, optimise):
+    pytest.importorskip("numpy")
+    from lockstep import run_lockstep
+    memory, output, data = reference(source_file, optimise)
+    for lane in run_lockstep(memory, lanes=2):
+        assert lane["output"] == output
+        assert [lane["data"][address] for address in DATA_RANGE] == data
+
+FAILING_PROGRAMS = {
+    "division by zero": ["MOV r7 #0", "MOV r1 #5", "DIV r7 r1 r7", "PRT r7", "HALT"],
+    "unwritten register": ["MOV r0 #1", "ADD r1 r2 r0", "HALT"],
+    "address out of range": ["MOV r1 #7", "PRT r1", "LDR r4 5000", "HALT"],
+    "invalid instruction": ["MOV r0 #1", "FOO r1", "HALT"],
+}
+
+@pytest.mark.parametrize("assembly", FAILING_PROGRAMS.values(), ids=FAILING_PROGRAMS.keys())
+def test_translator_reports_errors_like_executer(assembly):
+    with redirect_stdout(StringIO()) as printed:
+        execute_translated_code(assembly, use_cache=False)
+    assert printed.getvalue().splitlines() == execute(assembly)[0]
@@ -0,0 +1,48 @@
+import pytest
+from pipeline import compile_source, assemble, execute
+from assembler import AssemblerError
+from compiler import Compiler
+from emulator import WORD_MASK, emulate, EmulationError
+from cycles import simulate_cycles
+
+'''Register mode LDR and STR take their address from the previous instruction's ALU result on the processor, not from rn'''
+
+ADDRESS_FROM_PREVIOUS = ["MOV r1 #1030", "MOV r0 #7", "ADD r1 r1 #1", "STR r0 r1", "ADD r2 r1 #0", "LDR r3 r2", "HALT"]
+ADDRESS_ERRORS = {
+    "compare": (["MOV r1 #1030", "CMP r1 #0", "LDR r3 r1", "HALT"], "LDR at program counter 2 .* which does not compute r1"),
+    "other register": (["MOV r1 #1030", "MOV r2 #5", "STR r3 r1", "HALT"], "STR at program counter 2 .* which does not compute r1"),
+    "branch": (["MOV r1 #1030", "ADD r1 r1 #0", "BAL 4", "HALT", "LDR r3 r1", "HALT"], "LDR at program counter 4 .* branch at program counter 2"),
+}
+
+def test_register_address_from_previous_instruction():
+    registers, memory, steps = emulate(assemble(ADDRESS_FROM_PREVIOUS))
+    assert registers[:4] == [7, 1031, 1031, 7] and memory[1031] == 7 and steps == 7
+    assert simulate_cycles(assemble(ADDRESS_FROM_PREVIOUS))[0] == 11
+
+@pytest.mark.parametrize("simulate", [emulate, simulate_cycles])
+@pytest.mark.parametrize("assembly, message", ADDRESS_ERRORS.values(), ids=ADDRESS_ERRORS.keys())
+def test_register_address_not_computed(simulate, assembly, message):
+    with pytest.raises(EmulationError, match=message):
+        simulate(assemble(assembly))
+
+'''alu.v shifts unsigned words, so floor division by a power of two only becomes LSR for a dividend that cannot be negative'''
+
+DATA_RANGE = range(Compiler.VARIABLE_RANGE[0], Compiler.ARRAY_RANGE[1] + 1)
+NON_NEGATIVE_DIVIDEND = ["a = 13", "b = a \\ 4", "x = array(2)", "x[0] = b", "x[1] = a * 3 \\ 2"]
+NEGATIVE_DIVIDEND = ["a = 0 - 7", "b = a \\ 2", "print(b)"]
+
+@pytest.mark.parametrize("optimise", [False, True], ids=["plain", "-O"])
+def test_floor_division_by_shift(optimise):
+    assembly, errors = compile_source(NON_NEGATIVE_DIVIDEND, optimise)
+    assert not errors and any(line.startswith("LSR") for line in assembly)
+    _, data = execute(assembly)
+    _, memory, _ = emulate(assemble(assembly))
+    assert [memory[address] for address in DATA_RANGE] == [data[address] & WORD_MASK for address in DATA_RANGE]
+
+@pytest.mark.parametrize("optimise", [False, True], ids=["plain", "-O"])
+def test_floor_division_of_negative_dividend(optimise):
+    assembly, errors = compile_source(NEGATIVE_DIVIDEND, optimise)
+    assert not errors and not any(line.startswith("LSR") for line in assembly)
+    assert execute(assembly)[0] == ["-4"]
+    with pytest.raises(AssemblerError, match="FDV"): # Left to the general routine, which the processor does not have
+        assemble(assembly)
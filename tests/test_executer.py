@@ -0,0 +1,71 @@
+import pytest
+from os import path
+from support import TESTS_DIRECTORY, MAX_STEPS, read, compile_program
+from compiler import Compiler
+from executer import REGISTER_NAMES, Machine, run_with_checkpoints
+
+'''A program run in slices, or stopped, snapshotted and restored or forked part of the way through, ends as one run straight through does'''
+
+SOURCE_FILE = path.join(TESTS_DIRECTORY, "programs", "arrays.txt")
+DATA_RANGE = range(Compiler.VARIABLE_RANGE[0], Compiler.ARRAY_RANGE[1] + 1)
+
+def memory():
+    assembly = compile_program(read(SOURCE_FILE))
+    return assembly + [""] * (DATA_RANGE.stop - len(assembly))
+
+def final_state(machine, output=()): # Everything a finished run leaves, output holds lines collected before the end
+    assert machine.run(steps=MAX_STEPS), "program did not halt"
+    return list(output) + machine.take_output(), machine.registers[:len(REGISTER_NAMES)], [machine.data[address] for address in DATA_RANGE], machine.halted
+
+@pytest.fixture(scope="module")
+def straight_through():
+    return final_state(Machine(memory()))
+
+@pytest.mark.parametrize("steps", [1, 7, 100])
+def test_resume_in_slices(straight_through, steps):
+    machine, output = Machine(memory()), []
+    while not machine.run(steps):
+        output += machine.take_output()
+    assert final_state(machine, output) == straight_through
+
+@pytest.mark.parametrize("steps", [0, 5, 40])
+def test_snapshot_round_trip(straight_through, steps):
+    machine = Machine(memory())
+    machine.run(steps)
+    snapshot = machine.snapshot()
+    restored = Machine.restore(memory(), snapshot)
+    assert restored.snapshot() == snapshot
+    assert final_state(restored) == final_state(machine) == straight_through
+
+def test_save_and_load(straight_through, tmp_path):
+    machine = Machine(memory())
+    machine.run(25)
+    machine.save(str(tmp_path / "checkpoint"))
+    assert final_state(Machine.load(memory(), str(tmp_path / "checkpoint"))) == straight_through
+
+def test_restore_onto_another_program():
+    snapshot = Machine(memory()).snapshot()
+    with pytest.raises(ValueError, match="different program"):
+        Machine.restore(["MOV r0 #1", "HALT"], snapshot)
+
+def test_fork(straight_through):
+    machine = Machine(memory())
+    machine.run(30)
+    output = machine.take_output()
+    fork = machine.fork()
+    assert final_state(fork, output) == straight_through
+    assert final_state(machine, output) == straight_through
+
+def test_fork_data_is_a_copy():
+    machine = Machine(memory())
+    machine.run(30)
+    fork = machine.fork()
+    fork.data[DATA_RANGE.start] = 12345
+    assert machine.data[DATA_RANGE.start] != 12345
+
+def test_run_with_checkpoints(straight_through, tmp_path, capsys):
+    checkpoint = str(tmp_path / "checkpoint")
+    run_with_checkpoints(Machine(memory()), checkpoint, steps=10)
+    assert capsys.readouterr().out.splitlines() == straight_through[0]
+    restored = Machine.load(memory(), checkpoint)
+    assert restored.halted and final_state(restored)[1:] == straight_through[1:]
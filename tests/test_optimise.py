@@ -0,0 +1,24 @@
+import pytest
+from os import path
+from support import PROGRAMS, read, compile_program, run
+from pipeline import compile_source
+from compiler import CompliationError
+
+@pytest.mark.parametrize("source_file", PROGRAMS, ids=path.basename)
+def test_optimised_output_matches_plain_output(source_file):
+    source = read(source_file)
+    assert run(compile_program(source, optimise=True)) == run(compile_program(source))
+
+INVALID_PROGRAMS = {
+    "break outside a loop": ["x = 1", "break", "print(x)"],
+    "break in a while loop": ["i = 0", "while i < 3:", "    i += 1", "    break", "print(i)"],
+}
+
+@pytest.mark.parametrize("source", INVALID_PROGRAMS.values(), ids=INVALID_PROGRAMS.keys())
+def test_optimised_errors_match_plain_errors(source):
+    messages = []
+    for optimise in (False, True):
+        with pytest.raises(CompliationError) as error:
+            compile_source(source, optimise)
+        messages.append(str(error.value))
+    assert messages[0] == messages[1]
@@ -0,0 +1,25 @@
+import pytest
+from shutil import which
+from pipeline import assemble
+from assembler import write_sparse_memory_image
+from emulator import emulate
+from cycles import simulate_cycles
+from regression import build_testbench, simulate
+
+'''The loop's back edge sits just before HALT, so HALT is decoded while the taken BLT is in execute and is squashed by its flush'''
+
+HALT_AFTER_BRANCH = ["MOV r0 #0", "loop: ADD r0 r0 #1", "CMP r0 #3", "BLT loop", "HALT"]
+HALT_AFTER_BRANCH_CYCLES = 18 # 3 cycles to reach execute, 11 instructions and 2 cycles flushed by each of the 2 taken branches
+
+def test_squashed_halt_model():
+    registers, _, steps = emulate(assemble(HALT_AFTER_BRANCH))
+    cycles, executed, _, flushes, _ = simulate_cycles(assemble(HALT_AFTER_BRANCH))
+    assert registers[0] == 3 and (cycles, sum(executed), sum(flushes)) == (HALT_AFTER_BRANCH_CYCLES, steps, 2)
+
+@pytest.mark.skipif(which("iverilog") is None or which("vvp") is None, reason="needs iverilog and vvp")
+def test_squashed_halt_testbench(tmp_path):
+    image = tmp_path / "memory.txt"
+    with open(image, "w") as f:
+        write_sparse_memory_image(assemble(HALT_AFTER_BRANCH), f)
+    halted, cycles, registers, _ = simulate(build_testbench(str(tmp_path)), str(image), str(tmp_path / "dump.txt"), max_cycles=100)
+    assert halted and registers[0] == 3 and cycles == HALT_AFTER_BRANCH_CYCLES